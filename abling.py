@@ -0,0 +1,236 @@
+"""
+Linha de comando do ABLING, sem navegador nem HTTP (cron, manutenção).
+
+Usa os mesmos BlingAPI e construtores de painéis do app, com o token
+guardado no servidor (tokens.json no cache da conta, gravado no login
+pelo navegador e a cada renovação) ou de --tokens.
+
+  python -m abling sync [--account K ... | --all] [--full]
+      atualiza a cópia do mês pelo feed de alterações, completa os
+      detalhes e grava no histórico
+  python -m abling warm [--account K ... | --all]
+      recarrega dados de referência e monta os painéis do mês (preenche
+      os caches em disco: detalhes, vendedores, histórico)
+  python -m abling export O_QUE [--format json|csv|xlsx] [-o arquivo] [--details]
+      pedidos ou itens do mês (CSV/XLSX) ou um painel do mês (month_status,
+      month_vendor, month_day, prod_month; JSON, CSV ou XLSX); com várias
+      empresas, os pedidos são concatenados e os painéis somados
+  python -m abling archive [AAAA-MM ...] [--no-fetch]
+      completa o histórico do mês fechado (padrão: o mês passado) e o
+      grava em colunas (archive.py); depois disso o mês não é mais buscado
+  python -m abling backfill INI FIM [...]    (ver backfill.py)
+  python -m abling bench [...]               (ver bench.py)
+
+As chamadas ao Bling entram na cota com a origem cli-<comando>.
+"""
+from __future__ import annotations
+import argparse
+import json
+import sys
+import time
+from datetime import timedelta
+
+
+def _accounts(app, args):
+    if args.all:
+        out = [acc for acc in app.ACCOUNTS.values() if acc.tokens.get(acc.token_key)]
+        if not out:
+            raise RuntimeError('Nenhuma empresa com token no servidor: conecte pelo navegador.')
+        return out
+    out = []
+    for key in args.account or [app.DEFAULT_ACCOUNT]:
+        acc = app.ACCOUNTS.get(key)
+        if acc is None:
+            raise RuntimeError(f'Empresa desconhecida: {key}')
+        out.append(acc)
+    return out
+
+
+def _each(args, fn, need_client=True):
+    """
+    Roda fn(app, acc, client) em cada empresa pedida, no contexto da conta
+    (client None com need_client=False). Devolve (status, resultados): status
+    1 se alguma falhar.
+    """
+    import accounts
+    import app
+    import timing
+    status, results = 0, []
+    for acc in _accounts(app, args):
+        ctx = accounts.context(acc)
+        t = ctx.run(timing.start, f'cli-{args.cmd}')
+        try:
+            client = app.server_api(acc, tokens=args.tokens, refresh=args.refresh) if need_client else None
+            results.append(ctx.run(fn, app, acc, client))
+        except Exception as e:
+            print(f'[{acc.key}] erro: {e}', file=sys.stderr)
+            status = 1
+        finally:
+            acc.quota.flush()
+        calls = sum(c[0] for c in t.calls.values())
+        print(f'[{acc.key}] {t.total() * 1000:.0f} ms, {calls} chamadas ao Bling', file=sys.stderr)
+    return status, results
+
+
+def cmd_sync(args):
+    import timing
+
+    def run(app, acc, client):
+        m_ini, m_fim = app.month_bounds_today()
+        if args.full:
+            acc.orders.request_full()
+        with timing.stage('sync'):
+            touched = acc.orders.sync(client, app.to_iso(m_ini), app.to_iso(m_fim))
+        agg = app.month_aggregates(client, m_ini, m_fim)
+        acc.history.put_async([]).result()      # espera o histórico gravar
+        print(f'[{acc.key}] {len(acc.orders)} pedidos no mês, {len(touched)} novos ou alterados, '
+              f'{len(agg.partial)} sem detalhe')
+    return _each(args, run)[0]
+
+
+def cmd_warm(args):
+    def run(app, acc, client):
+        if acc.refdata.is_stale():
+            acc.refdata.load_from(client)
+        for name, (_, build) in app.MONTH_PANELS.items():
+            t0 = time.perf_counter()
+            panel = build(client)
+            print(f'[{acc.key}] {name}: {(time.perf_counter() - t0) * 1000:.0f} ms, '
+                  f'{panel.get("total_qtd")} / {panel.get("total_valor"):.2f}')
+        acc.history.put_async([]).result()
+    return _each(args, run)[0]
+
+
+def cmd_archive(args):
+    import archive
+    import backfill
+
+    def run(app, acc, client):
+        yms = args.months or [f'{app.month_bounds_today()[0] - timedelta(days=1):%Y-%m}']
+        for ym in yms:
+            bounds = app.closed_month(ym)
+            if bounds is None:
+                raise RuntimeError(f'{ym}: mês inválido ou ainda em andamento')
+            if archive.exists(acc.archive_dir, ym):
+                print(f'[{acc.key}] {ym}: já arquivado')
+                continue
+            ini, fim = bounds
+            if client is not None:
+                # completa o histórico do mês (só busca o que falta) antes de congelar
+                stats = backfill.run(client, acc, ini, fim, rps=args.rps, share=args.share,
+                                     progress=lambda msg: None)
+                if stats['stopped']:
+                    raise RuntimeError(f'{ym}: backfill parado ({stats["stopped"]}); rode de novo')
+                if stats['partial']:
+                    raise RuntimeError(f'{ym}: {stats["partial"]} pedidos sem detalhe no backfill; rode de novo')
+            contribs = acc.history.contributions(ini.isoformat(), fim.isoformat())
+            parciais = sum(1 for _, c in contribs if c['partial'])
+            if not contribs or parciais:
+                raise RuntimeError(f'{ym}: histórico incompleto ({len(contribs)} pedidos, {parciais} sem detalhe)')
+            meta = archive.write(acc.archive_dir, ym, (ini.isoformat(), fim.isoformat()), contribs)
+            arc = archive.MonthArchive(acc.archive_dir, ym)
+            print(f'[{acc.key}] {ym}: {meta["pedidos"]} pedidos, {meta["itens"]} itens, '
+                  f'{len(meta["produtos"])} produtos, colunas {arc.nbytes() / 1024:.0f} KB')
+            arc.close()
+    return _each(args, run, need_client=not args.no_fetch)[0]
+
+
+def _jsonable(obj):
+    if isinstance(obj, dict):
+        return {(' | '.join(map(str, k)) if isinstance(k, tuple) else str(k)): _jsonable(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_jsonable(v) for v in obj]
+    return obj
+
+
+def cmd_export(args):
+    import itertools
+    import export as exporter
+    from aggregates import merge_panels
+
+    fmt = args.format or ('json' if args.what not in ('pedidos', 'itens') else 'csv')
+    if args.what in ('pedidos', 'itens'):
+        if fmt == 'json':
+            raise RuntimeError('pedidos e itens: use --format csv ou xlsx')
+        status, tables = _each(args, lambda app, acc, client: app.export_table(client, args.what))
+        if status or not tables:
+            return 1
+        header, rows = tables[0][0], itertools.chain.from_iterable(t[1] for t in tables)
+    else:
+        status, panels = _each(args, lambda app, acc, client: app.MONTH_PANELS[args.what][1](client))
+        if status or not panels:
+            return 1
+        # várias empresas: soma como em /consolidated
+        panel = panels[0] if len(panels) == 1 else merge_panels(args.what, panels)
+        if fmt == 'json':
+            if not args.details:
+                panel = {k: v for k, v in panel.items() if not k.startswith('details_by_')}
+            out = json.dumps(_jsonable(panel), ensure_ascii=False, indent=1)
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8') as f:
+                    f.write(out)
+            else:
+                print(out)
+            return 0
+        import app
+        header, rows = exporter.panel_table(args.what, panel, app.export_margins())
+
+    chunks = exporter.stream(fmt, header, rows, sheet=args.what)
+    if args.output:
+        with open(args.output, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+    else:
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
+    return 0
+
+
+def main(argv=None):
+    argv = list(sys.argv[1:] if argv is None else argv)
+    # backfill e bench têm argumentos próprios
+    if argv and argv[0] == 'backfill':
+        import backfill
+        return backfill.main(argv[1:])
+    if argv and argv[0] == 'bench':
+        import bench    # antes do app: usa um diretório de cache temporário
+        return bench.main(argv[1:])
+
+    ap = argparse.ArgumentParser(prog='python -m abling', description='ABLING pela linha de comando.')
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--account', action='append', help='empresa (pode repetir; padrão: a primeira)')
+    common.add_argument('--all', action='store_true', help='todas as empresas com token no servidor')
+    common.add_argument('--tokens', help='arquivo JSON com o token (padrão: tokens.json no cache da conta)')
+    common.add_argument('--refresh', action='store_true', help='renova o token quando expirar')
+    sub = ap.add_subparsers(dest='cmd', required=True)
+    p = sub.add_parser('sync', parents=[common], help='atualiza a cópia do mês e o histórico')
+    p.add_argument('--full', action='store_true', help='recarga completa (reconcilia exclusões)')
+    p.set_defaults(fn=cmd_sync)
+    p = sub.add_parser('warm', parents=[common], help='monta os painéis do mês e aquece os caches em disco')
+    p.set_defaults(fn=cmd_warm)
+    p = sub.add_parser('export', parents=[common], help='exporta pedidos, itens ou um painel do mês')
+    p.add_argument('what', choices=['pedidos', 'itens', 'month_status', 'month_vendor', 'month_day', 'prod_month'])
+    p.add_argument('--format', choices=['json', 'csv', 'xlsx'],
+                   help='padrão: json para painéis, csv para pedidos e itens')
+    p.add_argument('-o', '--output', help='arquivo de saída (padrão: stdout)')
+    p.add_argument('--details', action='store_true', help='json: inclui o zoom por pedido')
+    p.set_defaults(fn=cmd_export)
+    p = sub.add_parser('archive', parents=[common], help='arquiva meses fechados em colunas (archive.py)')
+    p.add_argument('months', nargs='*', metavar='AAAA-MM', help='padrão: o mês passado')
+    p.add_argument('--no-fetch', action='store_true', help='só o que já está no histórico, sem chamar o Bling')
+    p.add_argument('--rps', type=float, default=1.0, help='chamadas por segundo do backfill do mês')
+    p.add_argument('--share', type=float, default=0.3, help='fração da cota diária do backfill do mês')
+    p.set_defaults(fn=cmd_archive)
+    sub.add_parser('backfill', help='backfill do histórico (python -m abling backfill -h)')
+    sub.add_parser('bench', help='benchmarks (python -m abling bench -h)')
+    args = ap.parse_args(argv)
+    try:
+        return args.fn(args)
+    except RuntimeError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,138 @@
+"""
+Empresas (contas do Bling) e o estado de cada uma.
+
+Cada conta tem seus próprios caches dos painéis do mês, snapshot da
+página, cópias locais dos pedidos (e seus índices para filtros),
+agregados, histórico, arquivo dos meses fechados, detalhes, payloads
+brutos, índice de vendedores, dados de referência, cota, disjuntor e
+caixa de webhooks: nada é compartilhado, então sessões em empresas diferentes nunca
+recebem o painel uma da outra e cada conta invalida o seu cache sozinha.
+
+A conta da requisição fica numa ContextVar (definida no before_request).
+Threads do pool recebem uma cópia do contexto (contextvars.copy_context),
+então o que é montado em segundo plano continua na conta certa.
+
+A primeira conta usa os arquivos de sempre em CACHE_DIR (e a cota e o
+disjuntor globais); as demais ficam em CACHE_DIR/contas/<chave>/.
+"""
+from __future__ import annotations
+import contextvars
+import os
+
+from bling import BREAKER, CircuitBreaker, TokenFile
+from quota import QUOTA, QuotaBudget
+from detail_cache import DetailCache, RawArchive, VendorIndex
+from order_store import OrderStore, OrderIndex
+from aggregates import MonthAggregates, ProductDim
+from webhooks import WebhookInbox
+from refdata import ReferenceData
+from history import HistoryStore
+
+_CURRENT = contextvars.ContextVar('abling_account', default=None)
+
+
+def current():
+    return _CURRENT.get()
+
+
+def use(account) -> None:
+    """Define a conta do contexto atual (requisição ou thread)."""
+    _CURRENT.set(account)
+
+
+def context(account):
+    """Cópia do contexto atual com `account` como conta (para pool.submit(ctx.run, ...))."""
+    ctx = contextvars.copy_context()
+    ctx.run(use, account)
+    return ctx
+
+
+class Account:
+    def __init__(self, key, label, client_id, client_secret, cache_dir, primary=False,
+                 final_status=(), seeds=None):
+        self.key, self.label = key, label
+        self.client_id, self.client_secret = client_id, client_secret
+        self.cache_dir, self.primary = cache_dir, primary
+        self.final_status, self.seeds = final_status, seeds
+        # a primeira conta mantém a chave antiga do token na sessão
+        self.token_key = 'bling_token' if primary else f'bling_token@{key}'
+        # token guardado no servidor (gravado no login e a cada renovação), para a CLI e o backfill
+        self.token_file = os.path.join(cache_dir, 'tokens.json')
+        self.tokens = TokenFile(self.token_file)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.month_status = {}
+        self.month_vendor = {}
+        self.month_day = {}
+        self.month_prod = {}    # produtos no mês
+        self.page_snapshot = {}
+        self.probe_memo = {}
+        self.stale = {}         # painel -> quando passou a ser servido desatualizado
+        self.revalidating = set()
+        self.panel_jobs = {}    # painel -> Future da montagem (em andamento ou a última)
+
+        if primary:
+            self.quota, self.breaker = QUOTA, BREAKER
+        else:
+            self.quota = QuotaBudget(os.path.join(cache_dir, 'quota.json'),
+                                     daily_limit=int(os.getenv('BLING_DAILY_QUOTA', '120000')))
+            self.breaker = CircuitBreaker(threshold=int(os.getenv('BLING_BREAKER_THRESHOLD', '5')),
+                                          cooldown=float(os.getenv('BLING_BREAKER_COOLDOWN', '30')))
+        self.vendor_index = VendorIndex(os.path.join(cache_dir, 'vendor_index.json'))
+        self.detail_cache = DetailCache(os.path.join(cache_dir, 'details'),
+                                        max_items=int(os.getenv('DETAIL_CACHE_MAX', '2000')),
+                                        final_status=final_status, vendor_index=self.vendor_index)
+        # linha + detalhe brutos dos pedidos da página (só o /api-fields lê)
+        self.raw_archive = RawArchive(os.path.join(cache_dir, 'raw.sqlite3'),
+                                      max_items=int(os.getenv('RAW_ARCHIVE_MAX', '500')))
+        # cópia local da listagem do mês, atualizada pelo feed de alterações
+        self.orders = OrderStore(page_limit=int(os.getenv('ORDERS_PAGE_LIMIT', '2000')),
+                                 reconcile_secs=int(os.getenv('ORDERS_RECONCILE', '1800')),
+                                 on_change=self._orders_changed)
+        # períodos fora do mês atual (filtro de datas da lista de pedidos)
+        self.range_orders = OrderStore(page_limit=int(os.getenv('ORDERS_PAGE_LIMIT', '2000')),
+                                       reconcile_secs=int(os.getenv('ORDERS_RECONCILE', '1800')),
+                                       on_change=self._orders_changed)
+        # SQLite em memória sobre as cópias: filtros de data/situação/vendedor sem ir ao Bling
+        self.orders_index = OrderIndex(self.orders, vendor_of=self.vendor_index.get)
+        self.range_index = OrderIndex(self.range_orders, vendor_of=self.vendor_index.get)
+        # (nome, sku) -> id inteiro, compartilhado pelos painéis de produtos (mês, dia, meses arquivados)
+        self.products = ProductDim()
+        self.agg = MonthAggregates(self.products)
+        # histórico com agregados diários: consultas de qualquer período (alimentado pelo mês e pelo backfill)
+        self.history = HistoryStore(os.path.join(cache_dir, 'history.sqlite3'))
+        # meses fechados em colunas mapeadas em memória (archive.py); abertos sob demanda
+        self.archive_dir = os.path.join(cache_dir, 'arquivo')
+        self.archives = {}          # 'AAAA-MM' -> MonthArchive
+        self.archive_panels = {}    # 'AAAA-MM' -> (chave, painéis)
+        record = os.getenv('BLING_WEBHOOK_RECORD') or None
+        if record and not primary:
+            record = os.path.join(cache_dir, os.path.basename(record))
+        self.webhooks = WebhookInbox(self.orders, record_path=record)
+        self.refdata = ReferenceData(os.path.join(cache_dir, 'refdata.json'),
+                                     ttl=int(os.getenv('REFDATA_TTL', str(7 * 24 * 3600))), seeds=seeds)
+
+    def __repr__(self):
+        return f'<Account {self.key}>'
+
+    def _orders_changed(self, ids):
+        # pedido alterado (situação, total, vendedor...): detalhe e vendedor são buscados de novo
+        self.vendor_index.forget(ids)
+        self.detail_cache.forget(ids)
+
+    def fresh(self, cache_dir):
+        """Mesma empresa com todos os caches vazios em `cache_dir` (benchmarks)."""
+        acc = Account(self.key, self.label, self.client_id, self.client_secret, cache_dir,
+                      primary=False, final_status=self.final_status, seeds=self.seeds)
+        acc.token_key = self.token_key
+        return acc
+
+
+def load(specs, cache_dir, final_status=(), seeds=None) -> dict:
+    """{chave: Account} na ordem de settings.ACCOUNTS; a primeira é a padrão."""
+    out = {}
+    for i, spec in enumerate(specs):
+        path = cache_dir if i == 0 else os.path.join(cache_dir, 'contas', spec['key'])
+        out[spec['key']] = Account(spec['key'], spec['label'], spec['client_id'], spec['client_secret'],
+                                   path, primary=(i == 0), final_status=final_status, seeds=seeds)
+    return out
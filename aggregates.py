@@ -0,0 +1,283 @@
+"""
+Agregados do mês mantidos por pedido (status, vendedor, dia, produto).
+
+Cada pedido contribui com um registro (situação, dia, total, vendedor,
+itens). Aplicar/remover/alterar um pedido desfaz a contribuição anterior
+e soma a nova, em O(itens do pedido); os painéis são materializados a
+partir dos contadores só quando a versão muda.
+
+Produtos são codificados numa dimensão compartilhada (ProductDim): cada
+(nome, sku) vira um id inteiro uma vez só, os itens das contribuições
+apontam para a mesma tupla de textos e o zoom de produto guarda por pedido
+só um array de (qtd, valor) — o resto (número, data, situação) vem da
+contribuição do pedido quando o painel é montado.
+
+Regras de cancelado (sid == 12), as mesmas dos painéis:
+  - status e dias: o pedido conta nos totais (dias marca has_cancelled);
+  - vendedor e produtos: fica fora dos totais, aparece no zoom e marca
+    has_cancelled.
+"""
+from __future__ import annotations
+import threading
+from array import array
+from datetime import datetime
+
+CANCELADO = 12
+
+
+def _day_label(iso):
+    try:
+        return datetime.strptime(iso, '%Y-%m-%d').strftime('%d/%m/%y')
+    except Exception:
+        return iso
+
+
+def _details(by_order):
+    """Zoom em ordem estável: mais recentes primeiro, independente do histórico de alterações."""
+    out = []
+    for lst in by_order.values():
+        out.extend(lst)
+    out.sort(key=lambda d: (d['_dia'], str(d['numero'])), reverse=True)
+    return [{k: v for k, v in d.items() if k != '_dia'} for d in out]
+
+
+class ProductDim:
+    """Dimensão de produtos: (nome, sku) -> id inteiro estável no processo; textos guardados uma vez."""
+
+    def __init__(self):
+        self._ids = {}
+        self.keys = []      # id -> (nome, sku)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def id(self, key) -> int:
+        pid = self._ids.get(key)
+        if pid is None:
+            with self._lock:
+                pid = self._ids.get(key)
+                if pid is None:
+                    key = (str(key[0]), str(key[1]))
+                    pid = self._ids[key] = len(self.keys)
+                    self.keys.append(key)
+        return pid
+
+    def key(self, pid) -> tuple:
+        return self.keys[pid]
+
+
+class MonthAggregates:
+    def __init__(self, products=None):
+        self.lock = threading.RLock()
+        self.fill_lock = threading.Lock()   # uma thread por vez completando detalhes
+        self.products = products if products is not None else ProductDim()
+        self.reset(None)
+
+    def reset(self, period) -> None:
+        self.period = period
+        self.version = -1
+        self.partial = set()    # pedidos sem detalhe (itens/vendedor): tentar de novo
+        self._orders = {}       # oid -> contribuição
+        self._status = {}       # sid -> [qtd, valor, {oid: [zoom]}]
+        self._vendor = {}       # vid -> [qtd ativos, valor ativos, cancelados, {oid: [zoom]}]
+        self._day = {}          # dia ISO -> [qtd, valor, cancelados, {oid: [zoom]}]
+        self._prod = {}         # id do produto -> [qtd, valor, cancelados, {oid: array(qtd, valor, ...)}]
+
+    def __len__(self):
+        return len(self._orders)
+
+    def contribution(self, oid):
+        return self._orders.get(str(oid))
+
+    def contributions(self) -> list:
+        """[(oid, contribuição)] mais recentes primeiro (exportação); as contribuições não são alteradas no lugar."""
+        with self.lock:
+            out = list(self._orders.items())
+        out.sort(key=lambda kv: (kv[1]['dia'], str(kv[1]['numero'])), reverse=True)
+        return out
+
+    # ---------- deltas ----------
+    def apply(self, oid, contrib) -> None:
+        """Insere ou atualiza o pedido `oid` (contrib=None remove)."""
+        oid = str(oid)
+        old = self._orders.pop(oid, None)
+        if old is not None:
+            self._add(oid, old, -1)
+        self.partial.discard(oid)
+        if contrib is None:
+            return
+        dim = self.products
+        # itens com a tupla (nome, sku) da dimensão: um só par de textos por produto no mês
+        contrib = dict(contrib, items=[(dim.key(dim.id(key)), q, v) for key, q, v in contrib['items']])
+        self._orders[oid] = contrib
+        self._add(oid, contrib, +1)
+        if contrib.get('partial'):
+            self.partial.add(oid)
+
+    def remove(self, oid) -> None:
+        self.apply(oid, None)
+
+    @staticmethod
+    def _bump(table, key, oid, sign, qtd, valor, cancel, zooms):
+        slot = table.get(key)
+        if slot is None:
+            if sign < 0:
+                return
+            slot = table[key] = [0, 0.0, 0, {}] if cancel is not None else [0, 0.0, {}]
+        slot[0] += sign * qtd
+        slot[1] += sign * valor
+        if cancel is not None:
+            slot[2] += sign * cancel
+        if sign > 0:
+            slot[-1][oid] = zooms
+        else:
+            slot[-1].pop(oid, None)
+        if not slot[-1]:
+            del table[key]
+
+    def _add(self, oid, c, sign):
+        sid, valor = c['sid'], c['valor']
+        cancel = sid == CANCELADO
+        base = {'numero': c['numero'], 'data': c['data_br'], '_dia': c['dia']}
+        self._bump(self._status, sid, oid, sign, 1, valor, None, [dict(base, total=valor)])
+        self._bump(self._day, c['dia'], oid, sign, 1, valor, int(cancel), [dict(base, total=valor, sid=sid)])
+        self._bump(self._vendor, c['vid'], oid, sign, 0 if cancel else 1, 0.0 if cancel else valor,
+                   int(cancel), [dict(base, total=valor, sid=sid)])
+        grouped = {}    # o mesmo produto pode vir em mais de um item do pedido
+        pid_of = self.products.id
+        for key, q, v in c['items']:
+            pid = pid_of(key)
+            g = grouped.get(pid)
+            if g is None:
+                g = grouped[pid] = [0.0, 0.0, array('d')]
+            g[0] += q
+            g[1] += v
+            g[2].extend((q, v))
+        for pid, (q, v, zooms) in grouped.items():
+            self._bump(self._prod, pid, oid, sign, 0.0 if cancel else q, 0.0 if cancel else v, int(cancel), zooms)
+
+    def _prod_details(self, by_order):
+        """Zoom de um produto a partir dos arrays (qtd, valor) por pedido, mais recentes primeiro."""
+        out = []
+        for oid, qv in by_order.items():
+            c = self._orders[oid]
+            for i in range(0, len(qv), 2):
+                out.append((c['dia'], str(c['numero']), {'numero': c['numero'], 'data': c['data_br'],
+                                                         'qtd': qv[i], 'valor': qv[i + 1], 'sid': c['sid']}))
+        out.sort(key=lambda x: (x[0], x[1]), reverse=True)
+        return [d for _, _, d in out]
+
+    # ---------- painéis ----------
+    def status_panel(self, mes_label, status_name, only=None):
+        linhas, details, tq, tv = [], {}, 0, 0.0
+        for sid, (q, v, by_order) in self._status.items():
+            if only is not None and str(sid) != str(only):
+                continue
+            if q == 0 and abs(v) < 0.005:
+                continue
+            linhas.append({'sid': sid, 'status': status_name(sid, f'STATUS {sid}'), 'qtd': int(q), 'valor': float(v)})
+            details[sid] = _details(by_order)
+            tq += q
+            tv += v
+        linhas.sort(key=lambda x: x['valor'], reverse=True)
+        return {'mes_label': mes_label, 'status_list': linhas, 'total_qtd': int(tq), 'total_valor': tv,
+                'details_by_status': details}
+
+    def vendor_panel(self, mes_label, vendor_name, nomes_validos):
+        acum, details, cancelled = {}, {}, {}
+        for vid, (q, v, nc, by_order) in self._vendor.items():
+            nome = vendor_name(vid) if vid else None
+            key = nome if nome in nomes_validos else 'SEM VENDEDOR'
+            a = acum.setdefault(key, [0, 0.0])
+            a[0] += q
+            a[1] += v
+            details.setdefault(key, {}).update(by_order)
+            cancelled[key] = cancelled.get(key, False) or nc > 0
+        linhas = []
+        for nome in list(nomes_validos) + ['SEM VENDEDOR']:
+            a = acum.get(nome)
+            if not a or (a[0] == 0 and nome != 'SEM VENDEDOR'):
+                continue
+            linhas.append({'vendedor': nome, 'qtd': int(a[0]), 'valor': float(a[1]),
+                           'has_cancelled': bool(cancelled.get(nome))})
+        linhas.sort(key=lambda x: x['valor'], reverse=True)
+        return {'mes_label': mes_label, 'vendors_list': linhas,
+                'total_qtd': sum(l['qtd'] for l in linhas), 'total_valor': sum(l['valor'] for l in linhas),
+                'details_by_vendor': {k: _details(v) for k, v in details.items()}}
+
+    def day_panel(self, mes_label):
+        lines, details = [], {}
+        for dia in sorted(self._day, reverse=True):
+            q, v, nc, by_order = self._day[dia]
+            lines.append({'day_key': dia, 'day_label': _day_label(dia), 'qtd': int(q), 'valor': float(v),
+                          'has_cancelled': nc > 0})
+            details[dia] = _details(by_order)
+        return {'mes_label': mes_label, 'days_list': lines,
+                'total_qtd': sum(x['qtd'] for x in lines), 'total_valor': sum(x['valor'] for x in lines),
+                'details_by_day': details}
+
+    def products_panel(self, mes_label, detail_id):
+        lines, details, tq, tv = [], {}, 0.0, 0.0
+        keys = self.products.keys
+        for pid, (q, v, nc, by_order) in self._prod.items():
+            nome, sku = key = keys[pid]
+            lines.append({'produto': nome, 'sku': sku, 'qtd': q, 'valor': v, 'has_cancelled': nc > 0,
+                          'detail_id': detail_id(nome, sku)})
+            details[key] = self._prod_details(by_order)
+            tq += q
+            tv += v
+        lines.sort(key=lambda x: x['valor'], reverse=True)
+        return {'mes_label': mes_label, 'products_list': lines, 'total_qtd': tq, 'total_valor': tv,
+                'details_by_product': details}
+
+
+# ---------- visão consolidada (várias empresas) ----------
+def _merge_lines(panels, list_key, details_key, key_of, sum_keys, sort_by=None):
+    acum, details, order = {}, {}, []
+    for p in panels:
+        for line in p[list_key]:
+            k = key_of(line)
+            cur = acum.get(k)
+            if cur is None:
+                acum[k] = dict(line)
+                order.append(k)
+                continue
+            for s in sum_keys:
+                cur[s] += line[s]
+            if line.get('has_cancelled'):
+                cur['has_cancelled'] = True
+        for k, lst in p[details_key].items():
+            details.setdefault(k, []).extend(lst)
+    lines = [acum[k] for k in order]
+    if sort_by:
+        lines.sort(key=lambda x: x[sort_by], reverse=True)
+    return lines, details
+
+
+def merge_panels(name, panels):
+    """Soma os painéis do mês de várias empresas (mesmo formato dos painéis de uma só)."""
+    panels = [p for p in panels if p]
+    if not panels:
+        return None
+    out = {'mes_label': panels[0]['mes_label'],
+           'total_qtd': sum(p['total_qtd'] for p in panels),
+           'total_valor': sum(p['total_valor'] for p in panels)}
+    if name == 'month_status':
+        out['status_list'], out['details_by_status'] = _merge_lines(
+            panels, 'status_list', 'details_by_status', lambda l: l['sid'], ('qtd', 'valor'), 'valor')
+    elif name == 'month_vendor':
+        out['vendors_list'], out['details_by_vendor'] = _merge_lines(
+            panels, 'vendors_list', 'details_by_vendor', lambda l: l['vendedor'], ('qtd', 'valor'), 'valor')
+    elif name == 'month_day':
+        lines, details = _merge_lines(
+            panels, 'days_list', 'details_by_day', lambda l: l['day_key'], ('qtd', 'valor'))
+        out['days_list'] = sorted(lines, key=lambda x: x['day_key'], reverse=True)
+        out['details_by_day'] = details
+    elif name == 'prod_month':
+        out['products_list'], out['details_by_product'] = _merge_lines(
+            panels, 'products_list', 'details_by_product', lambda l: (l['produto'], l['sku']),
+            ('qtd', 'valor'), 'valor')
+    else:
+        raise KeyError(name)
+    return out
@@ -1,49 +1,70 @@
 from __future__ import annotations
 from datetime import datetime, timedelta, date
-from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-from flask import Flask, render_template, redirect, request, session, url_for, flash
+from zoneinfo import ZoneInfo
+from flask import Flask, render_template, redirect, request, session, url_for, flash, Response
 from config import settings
-from bling import BlingAPI
+from bling import BlingAPI, CircuitOpen, TokenFile
+from orders import (STATUS_MAP, VENDEDOR_MAP, FORMAPAG_MAP, FINAL_STATUS_IDS, default_dates, month_bounds_today,
+                    first, br_dmy_short, parse_date, parse_total, parse_qty, normalize_item)
+from contributions import order_contribution
+from aggregates import MonthAggregates, merge_panels
+from webhooks import SIGNATURE_HEADER, verify as verify_webhook
+import export as exporter
+import archive
+import accounts
+import timing
+import metrics
 import json
+import base64
+import hashlib
+import hmac
+import heapq
 from collections import defaultdict
 import os
 import io
 import csv
+import time
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait
 import requests
 
 app = Flask(__name__)
 app.secret_key = settings.FLASK_SECRET_KEY
 
-# ================== MAPAS ==================
-STATUS_MAP = {
-    56035: 'AGUARDANDO SEPARAÇÃO',
-    6: 'EM ABERTO',
-    466202: 'ENVIO ESTOQUE FULL',
-    12: 'CANCELADO',
-    9: 'ATENDIDO',
-    67578: 'ENTREGUE',
-    446927: 'SEPARADO AGUARD. COLETA',
-    21: 'EM DIGITAÇÃO',
-    67577: 'ENVIADO'
-}
-VENDEDOR_MAP = {
-    15596309360: 'WENIO',
-    15596488325: 'JOICE',
-    4664550185: 'MERCADO LIVRE',
-    14402874266: 'RANGEL'
-}
-FORMAPAG_MAP = {
-    2515978: 'CONTA A RECEBER',
-    1917260: 'PAGAR.ME',
-    554129: 'CONTA A RECEBER'
-}
+# ================== EMPRESAS (CACHES POR CONTA) ==================
+# cada empresa tem caches, cópia do mês, agregados, cota e disjuntor próprios (accounts.Account)
+ACCOUNTS = accounts.load(settings.ACCOUNTS, settings.CACHE_DIR, final_status=FINAL_STATUS_IDS,
+                         seeds={'status': STATUS_MAP, 'vendor': VENDEDOR_MAP, 'payment': FORMAPAG_MAP})
+DEFAULT_ACCOUNT = settings.ACCOUNTS[0]['key']
+
+
+def account():
+    """Conta da requisição (ou da thread que a herdou); fora de requisição, a primeira."""
+    return accounts.current() or ACCOUNTS[DEFAULT_ACCOUNT]
+
+
+def connected(acc=None) -> bool:
+    return bool(session.get((acc or account()).token_key))
+
+# ================== COTA DO BLING ==================
+# TTL (s) das consultas de novidade (feed de alterações do mês, pedido mais recente) por nível da cota
+PROBE_TTL = {'ok': int(os.getenv('PROBE_TTL', '15')), 'low': 300, 'critical': 1800, 'exhausted': 1800}
+# intervalo do auto-refresh da página (ms) por nível da cota
+REFRESH_MS = {'ok': 60000, 'low': 300000, 'critical': 900000, 'exhausted': 1800000}
+# com webhooks chegando, o polling vira só reconciliação
+WEBHOOK_PROBE_TTL = int(os.getenv('WEBHOOK_PROBE_TTL', '600'))
+
+metrics.Gauge('abling_bling_quota_used', 'Chamadas ao Bling contadas hoje por empresa e origem.',
+              lambda: {(k, o): n for k, a in ACCOUNTS.items() for o, n in a.quota.snapshot()['by_origin'].items()},
+              ('account', 'origin'))
+metrics.Gauge('abling_bling_quota_remaining', 'Chamadas restantes na cota diária do Bling por empresa.',
+              lambda: {k: a.quota.remaining() for k, a in ACCOUNTS.items()}, ('account',))
+
 
-# ================== CACHES ==================
-MONTH_STATUS_CACHE = {}
-MONTH_VENDOR_CACHE = {}
-MONTH_DAY_CACHE = {}
-MONTH_PROD_CACHE = {}   # produtos no mês
-PAGE_SNAPSHOT = {}
+def details_allowed() -> bool:
+    """Com a cota crítica, não busca detalhes novos no Bling."""
+    return account().quota.level() in ('ok', 'low')
 # ============================================
 
 # ================== CONFIG LOCAL (PLANILHA ANÁLISE) ==================
@@ -124,81 +145,38 @@ def load_margin_map_from_sheet(sheet_url: str) -> dict[str, str]:
         if numero_pedido:
             margin_map[numero_pedido] = margem
     return margin_map
-# =====================================================================
 
 
-# --------------- UTILIDADES -----------------
-def default_dates():
-    try:
-        tz = ZoneInfo('America/Sao_Paulo')
-        today = datetime.now(tz).date()
-    except ZoneInfoNotFoundError:
-        today = datetime.now().date()
-    return today - timedelta(days=2), today
+SHEET_TTL = int(os.getenv('SHEET_TTL', '300'))   # s; a planilha muda pouco e o auto-refresh é frequente
+SHEET_MEMO = {}     # url -> (quando, mapa)
 
 
-def month_bounds_today():
-    try:
-        tz = ZoneInfo('America/Sao_Paulo')
-        today = datetime.now(tz).date()
-    except ZoneInfoNotFoundError:
-        today = datetime.now().date()
-    return date(today.year, today.month, 1), today
+def margin_map_cached(sheet_url: str) -> dict[str, str]:
+    hit = SHEET_MEMO.get(sheet_url)
+    if hit and time.time() - hit[0] < SHEET_TTL:
+        return hit[1]
+    margin_map = load_margin_map_from_sheet(sheet_url)
+    SHEET_MEMO[sheet_url] = (time.time(), margin_map)
+    return margin_map
 
 
+def with_margins(pedidos, margin_map):
+    """Cópias dos pedidos com a margem da planilha (o snapshot não é alterado)."""
+    out = []
+    for p in pedidos:
+        num = str(p.get('_numero') or p.get('numero') or p.get('id') or '').strip()
+        out.append(dict(p, _margem_lucro=margin_map[num]) if num and num in margin_map else p)
+    return out
+# =====================================================================
+
+
+# --------------- UTILIDADES -----------------
 def to_iso(d):
     if isinstance(d, datetime):
         d = d.date()
     return d.isoformat()
 
 
-def first(d, keys):
-    for k in keys:
-        if not k:
-            continue
-        if '.' in k:
-            cur = d
-            ok = True
-            for part in k.split('.'):
-                if isinstance(cur, dict) and part in cur:
-                    cur = cur.get(part)
-                else:
-                    ok = False
-                    break
-            if ok and cur not in (None, ''):
-                return cur
-        else:
-            v = d.get(k)
-            if v not in (None, ''):
-                return v
-    return None
-
-
-def br_dmy_short(s):
-    if not s:
-        return '-'
-    s = str(s)
-    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S'):
-        try:
-            d = datetime.strptime(s[:10], fmt)
-            return d.strftime('%d/%m/%y')
-        except Exception:
-            pass
-    return s
-
-
-def parse_date(s):
-    if not s:
-        return None
-    s = str(s)
-    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S'):
-        try:
-            return datetime.strptime(s[:10], fmt).date()
-        except Exception:
-            continue
-    return None
-
-
 def brl(v):
     try:
         v = float(v or 0)
@@ -208,51 +186,66 @@ def brl(v):
     return "R$ " + s.replace(",", "X").replace(".", ",").replace("X", ".")
 
 
-def parse_total(raw) -> float:
-    if raw is None:
-        return 0.0
-    if isinstance(raw, (int, float)):
-        return float(raw)
-    s = str(raw).strip().replace('R$', '').replace(' ', '')
-    if ',' in s:
-        s = s.replace('.', '').replace(',', '.')
-    try:
-        return float(s)
-    except Exception:
-        return 0.0
-
-
-def parse_qty(q):
-    try:
-        return float(q)
-    except Exception:
-        try:
-            return float(str(q).replace(',', '.'))
-        except Exception:
-            return 0.0
+def stable_id(prefix, *parts) -> str:
+    """
+    Id de linha de painel derivado do conteúdo (blake2b), igual em todos os
+    workers e reinícios — hash() de str muda a cada processo.
+    """
+    digest = hashlib.blake2b('\x1f'.join(map(str, parts)).encode('utf-8'), digest_size=6).hexdigest()
+    return f'{prefix}-{digest}'
 
 
-def normalize_item(i):
-    prod = i.get('produto') or {}
-    nome = prod.get('nome') or i.get('descricao') or '-'
-    sku = prod.get('codigo') or i.get('codigo') or '-'
-    qtd = parse_qty(i.get('quantidade') or 0)
-    preco = i.get('valor') or 0
-    try:
-        preco = float(preco)
-    except Exception:
-        try:
-            preco = float(str(preco).replace(',', '.'))
-        except Exception:
-            preco = 0.0
-    return {'_nome': nome, '_sku': sku, '_qtd': qtd, '_preco': preco}
+def api(acc=None):
+    acc = acc or account()
+    _adopt_server_token(acc)
+    return BlingAPI(acc.client_id,
+                    acc.client_secret,
+                    settings.BLING_REDIRECT_URI,
+                    session,
+                    token_key=acc.token_key, quota=acc.quota, breaker=acc.breaker,
+                    token_file=acc.tokens)
+
+
+def _adopt_server_token(acc):
+    """Sessão já conectada adota o token do servidor quando ele é mais novo (renovado pela CLI)."""
+    ts_key = acc.token_key + '_ts'
+    if not session.get(acc.token_key):
+        return
+    ts = acc.tokens.get(ts_key) or 0
+    if ts > (session.get(ts_key) or 0) and acc.tokens.get(acc.token_key):
+        session[acc.token_key] = acc.tokens.get(acc.token_key)
+        session[ts_key] = ts
+
+
+def detached_api(acc=None):
+    """Cliente com cópia do token da sessão, para uso em threads fora do request."""
+    acc = acc or account()
+    return BlingAPI(acc.client_id,
+                    acc.client_secret,
+                    settings.BLING_REDIRECT_URI,
+                    {acc.token_key: dict(session.get(acc.token_key) or {})},
+                    can_refresh=False,
+                    token_key=acc.token_key, quota=acc.quota, breaker=acc.breaker)
 
 
-def api():
-    return BlingAPI(settings.BLING_CLIENT_ID,
-                    settings.BLING_CLIENT_SECRET,
+def server_api(acc=None, tokens=None, refresh=False):
+    """
+    Cliente sem sessão do Flask (CLI, cron, backfill): token do arquivo da conta,
+    gravado no login pelo navegador, ou de `tokens` (arquivo JSON do token).
+    Só renova com refresh=True; o token renovado volta para o arquivo e as
+    sessões do navegador o adotam.
+    """
+    acc = acc or account()
+    store = TokenFile(tokens) if tokens else acc.tokens
+    if not store.get(acc.token_key):
+        raise RuntimeError(f'Sem token para {acc.label}: conecte pelo navegador ou informe um arquivo de token.')
+    return BlingAPI(acc.client_id,
+                    acc.client_secret,
                     settings.BLING_REDIRECT_URI,
-                    session)
+                    store,
+                    can_refresh=refresh,
+                    token_key=acc.token_key, quota=acc.quota, breaker=acc.breaker,
+                    token_file=acc.tokens)
 
 
 @app.template_filter('brl')
@@ -260,6 +253,11 @@ def jinja_brl(v):
     return brl(v)
 
 
+@app.template_filter('dom_id')
+def jinja_dom_id(v, prefix):
+    return stable_id(prefix, v)
+
+
 # Horário SP
 def br_now_saopaulo():
     try:
@@ -282,7 +280,9 @@ def build_daily_panels(pedidos):
     from collections import defaultdict as dd
     por_dia_vend = dd(lambda: dd(lambda: {'qtd': 0, 'valor': 0.0}))
     detalhes_por_dia_vend = dd(list)
-    vendedores_fixos = ['MERCADO LIVRE', 'WENIO', 'JOICE', 'RANGEL']
+    vendedores_fixos = ['MERCADO LIVRE', 'WENIO', 'JOICE', 'RANGEL']     # sempre aparecem, mesmo zerados
+    # mesmos nomes válidos do painel do mês (cadastro de vendedores do Bling)
+    nomes_validos = {str(n).upper().strip() for n in account().refdata.vendor_names()} | set(vendedores_fixos)
 
     for p in pedidos:
         dia_br = p.get('_data_emissao_br')
@@ -294,13 +294,10 @@ def build_daily_panels(pedidos):
             continue
 
         vend = (p.get('_vendedor_display') or '-').upper().strip()
-        if vend not in vendedores_fixos:
+        if vend not in nomes_validos:
             vend = 'SEM VENDEDOR'
 
-        raw_total = p.get('total')
-        if raw_total is None:
-            raw_total = (p.get('_raw_pair') or {}).get('detalhes', {}).get('total')
-        valor = parse_total(raw_total)
+        valor = parse_total(p.get('total'))
         sid = p.get('_situacao_id')
 
         por_dia_vend[dia_key][vend]['qtd'] += 1
@@ -318,7 +315,8 @@ def build_daily_panels(pedidos):
     vendor_panels = []
     for d in dias_ordenados:
         vendedores_list, total_qtd_dia, total_valor_dia = [], 0, 0.0
-        for v in ['MERCADO LIVRE', 'WENIO', 'JOICE', 'RANGEL']:
+        outros = sorted(v for v in por_dia_vend[d] if v not in vendedores_fixos and v != 'SEM VENDEDOR')
+        for v in vendedores_fixos + outros:
             dados = por_dia_vend[d][v]
             q = int(dados['qtd'])
             val = float(dados['valor'])
@@ -351,23 +349,103 @@ def build_daily_panels(pedidos):
 
 
 # --------- Assinaturas “mais recente” ----------
-def newest_month_key(client, m_ini, m_fim):
+def _probe_ttl(kind='newest'):
+    acc = account()
+    ttl = PROBE_TTL[acc.quota.level()]
+    # webhooks só alimentam a cópia do mês (acc.orders): períodos fora dele seguem o TTL normal
+    return max(ttl, WEBHOOK_PROBE_TTL) if kind == 'month' and acc.webhooks.active() else ttl
+
+
+def _probe_memo(a, b, fn, kind='newest'):
+    """Memoriza a consulta de novidade; o TTL cresce conforme a cota baixa (e, no mês, com webhooks ativos)."""
+    acc = account()
+    key = (kind, to_iso(a), to_iso(b))
+    hit = acc.probe_memo.get(key)
+    if hit and time.time() - hit[0] < _probe_ttl(kind):
+        return hit[1]
+    val = fn()
+    if val is None:
+        # Bling falhou: mantém a última assinatura para servir os caches (stale-if-error)
+        if hit:
+            acc.stale.setdefault('snapshot', br_now_saopaulo())
+            return hit[1]
+        return None
+    acc.probe_memo[key] = (time.time(), val)
+    acc.stale.pop('snapshot', None)
+    return val
+
+
+def month_version(client, m_ini, m_fim):
+    """
+    Versão da cópia local do mês (orders da conta), sincronizada pelo feed de
+    alterações: muda com pedido novo e também com pedido antigo alterado.
+    Webhooks aplicados entre um sync e outro já contam.
+    """
+    if _probe_memo(m_ini, m_fim, lambda: _sync_month(client, m_ini, m_fim), kind='month') is None:
+        return None
+    orders = account().orders
+    return ('v', orders.period, orders.version)
+
+
+def force_month_sync(m_ini, m_fim):
+    """refresh=force: o próximo sync do mês é a recarga completa (reconcilia exclusões)."""
+    acc = account()
+    acc.orders.request_full()
+    acc.probe_memo.pop(('month', to_iso(m_ini), to_iso(m_fim)), None)
+
+
+def _sync_month(client, m_ini, m_fim):
+    return _sync_store(account().orders, client, m_ini, m_fim)
+
+
+def _sync_store(store, client, ini, fim):
     try:
-        resp = client.list_sales(to_iso(m_ini), to_iso(m_fim), None, pagina=1, limite=1)
-        data = resp.get('data') or []
-        if not data:
-            return ('none',)
-        rec = data[0]
-        pid = rec.get('id') or rec.get('numero') or '0'
-        dem = first(rec, ['dataEmissao', 'data.emissao', 'data']) or ''
-        return (str(pid), str(dem))
+        with timing.stage('sync'):
+            store.sync(client, to_iso(ini), to_iso(fim))
+        return True
     except Exception:
         return None
 
 
+DAILY_LIMIT = 50    # pedidos na lista do período (como a primeira página do Bling)
+
+
+def daily_orders(client, d_ini, d_fim, m_ini, m_fim, situacao=None, vendedor=None):
+    """
+    Lista do período filtrada localmente (SQLite sobre a cópia dos pedidos):
+    dentro do mês usa a cópia do mês; fora dele, uma cópia do próprio período
+    (carga completa uma vez, depois feed de alterações).
+    Devolve (linhas, versão) ou None se ainda não há cópia (primeira carga do
+    mês: o index usa a listagem do Bling).
+    """
+    acc = account()
+    ini, fim = to_iso(d_ini), to_iso(d_fim)
+    if m_ini <= d_ini and d_fim <= m_fim:
+        if not acc.orders.covers(to_iso(m_ini), to_iso(m_fim)):
+            return None
+        index = acc.orders_index
+    else:
+        store = acc.range_orders
+        if not store.covers(ini, fim):
+            acc.probe_memo.pop(('range', ini, fim), None)
+        ok = _probe_memo(d_ini, d_fim, lambda: _sync_store(store, client, d_ini, d_fim), kind='range')
+        if ok is None or not store.covers(ini, fim):
+            return None
+        index = acc.range_index
+    sids = acc.refdata.find('status', situacao) if situacao else None   # id ou parte do nome
+    with timing.stage('filter'):
+        rows = index.query(ini, fim, situacao=sids, vendedor=vendedor, limit=DAILY_LIMIT)
+    return rows, ('v', index.store.period, index.store.version)
+
+
 def newest_range_key(client, d_ini, d_fim):
+    return _probe_memo(d_ini, d_fim, lambda: _newest_key(client, d_ini, d_fim))
+
+
+def _newest_key(client, m_ini, m_fim):
     try:
-        resp = client.list_sales(to_iso(d_ini), to_iso(d_fim), None, pagina=1, limite=1)
+        with timing.stage('probe'):
+            resp = client.list_sales(to_iso(m_ini), to_iso(m_fim), None, pagina=1, limite=1)
         data = resp.get('data') or []
         if not data:
             return ('none',)
@@ -380,85 +458,125 @@ def newest_range_key(client, d_ini, d_fim):
 # ------------------------------------------------
 
 
-# ----------------- Painel STATUS — MÊS -----------------
-def build_month_status_panel(client, situacao=None):
-    m_ini, m_fim = month_bounds_today()
-    newest = newest_month_key(client, m_ini, m_fim)
-    cache_key = (m_ini.isoformat(), m_fim.isoformat(), newest)
-    if MONTH_STATUS_CACHE.get('key') == cache_key and MONTH_STATUS_CACHE.get('panel'):
-        return MONTH_STATUS_CACHE['panel']
-
-    all_rows, pagina = [], 1
-    page_size, page_limit = 100, 12
-    for _ in range(page_limit):
-        try:
-            resp = client.list_sales(to_iso(m_ini), to_iso(m_fim), situacao or None,
-                                     pagina=pagina, limite=page_size)
-            data = resp.get('data', []) or []
-            all_rows.extend(data)
-            if len(data) < page_size:
-                break
-            pagina += 1
-        except Exception:
-            break
-
-    by_id = {}
-    for r in all_rows:
-        rid = r.get('id') or r.get('numero')
-        if rid is None:
-            continue
-        if rid not in by_id:
-            by_id[rid] = r
-    rows = list(by_id.values())
+# --------- Agregados do mês (incrementais sobre a cópia local) ----------
+def month_aggregates(client, m_ini, m_fim, details=True):
+    """
+    Agregados da conta na versão atual da cópia do mês, aplicando só os pedidos alterados desde
+    a última vez. Em duas fases: primeiro só com a linha da listagem (sem
+    rede; basta para status e dias); com details=True completa itens e
+    vendedor dos pedidos parciais, fora do lock dos agregados.
+    Carga completa da listagem na primeira vez; falha do Bling propaga.
+    """
+    acc = account()
+    orders, agg = acc.orders, acc.agg
+    if not orders.covers(to_iso(m_ini), to_iso(m_fim)):
+        orders.sync(client, to_iso(m_ini), to_iso(m_fim))
+    changed = []    # (oid, contribuição) aplicados agora: vão também para o histórico
+    with agg.lock:
+        version = orders.version
+        if not (agg.period == orders.period and agg.version == version):
+            ids = orders.changes_since(agg.version) if agg.period == orders.period else None
+            if ids is None:
+                agg.reset(orders.period)
+                ids = orders.ids()
+            with timing.stage('aggregate'):
+                for oid in ids:
+                    row = orders.get(oid)
+                    contrib = order_contribution(client, row, m_ini, m_fim, acc, fetch=False) if row else None
+                    agg.apply(oid, contrib)
+                    changed.append((oid, contrib))
+            agg.version = version
+    if details and agg.partial:
+        with agg.fill_lock, timing.stage('aggregate-details'):
+            for oid in list(agg.partial):
+                row = orders.get(oid)
+                contrib = order_contribution(client, row, m_ini, m_fim, acc, allow_fetch=details_allowed()) if row else None
+                if contrib is None or contrib['partial']:
+                    continue
+                with agg.lock:
+                    cur = agg.contribution(oid)
+                    if cur is not None and cur['fp'] == contrib['fp']:   # pedido não mudou no meio
+                        agg.apply(oid, contrib)
+                        changed.append((oid, contrib))
+        acc.vendor_index.flush()
+    if changed:
+        acc.history.put_async(changed)
+    return agg
+# ---------------------------------------------------------------
+
+
+# --------- Meses fechados (arquivo colunar) ----------
+def closed_month(ym):
+    """(ini, fim) do mês 'AAAA-MM' se ele já fechou; None se inválido ou em andamento."""
+    try:
+        ini = datetime.strptime(ym or '', '%Y-%m').date()
+    except ValueError:
+        return None
+    fim = (ini.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+    return (ini, fim) if fim < month_bounds_today()[0] else None
 
-    from collections import defaultdict as dd
-    acum = dd(lambda: {'qtd': 0, 'valor': 0.0})
-    details = dd(list)
 
-    for r in rows:
-        sid = first(r, ['situacao.id', 'idSituacao', 'geral.situacao.id'])
-        try:
-            sid = int(sid) if sid is not None else None
-        except Exception:
-            sid = None
+def month_archive(ym, acc=None):
+    """MonthArchive do mês (aberto uma vez por processo) ou None se não arquivado."""
+    acc = acc or account()
+    if closed_month(ym) is None:    # também barra caminhos arbitrários vindos da URL
+        return None
+    arc = acc.archives.get(ym)
+    if arc is None and archive.exists(acc.archive_dir, ym):
+        arc = acc.archives[ym] = archive.MonthArchive(acc.archive_dir, ym)
+    return arc
 
-        d_raw = first(r, ['dataEmissao', 'data.emissao', 'data'])
-        d = parse_date(d_raw)
-        if not d or d < m_ini or d > m_fim:
-            continue
 
-        valor = parse_total(r.get('total'))
-        numero = r.get('numero') or r.get('id')
-        data_em_br = br_dmy_short(d_raw)
-
-        acum[sid]['qtd'] += 1
-        acum[sid]['valor'] += valor
-        details[sid].append({'numero': numero, 'data': data_em_br, 'total': valor})
-
-    # inclui todos os status encontrados
-    linhas = []
-    tq, tv = 0, 0.0
-    for sid, data in acum.items():
-        q = int(data['qtd'])
-        v = float(data['valor'])
-        if q == 0 and v == 0:
-            continue
-        nome = STATUS_MAP.get(sid, f'STATUS {sid}')
-        linhas.append({'sid': sid, 'status': nome, 'qtd': q, 'valor': v})
-        tq += q
-        tv += v
+def archived_panels(ym, acc=None):
+    """
+    Painéis de um mês arquivado (com o zoom por pedido), montados pelos mesmos
+    agregados dos painéis do mês a partir das colunas mapeadas; None se o mês
+    não estiver arquivado. Mês fechado não muda: só os nomes (dados de
+    referência) invalidam.
+    """
+    acc = acc or account()
+    arc = month_archive(ym, acc)
+    if arc is None:
+        return None
+    refdata = acc.refdata
+    key = (ym, refdata.loaded_at)
+    hit = acc.archive_panels.get(ym)
+    if hit and hit[0] == key:
+        return hit[1]
+    with timing.stage('archive'):
+        agg = MonthAggregates(acc.products)
+        agg.reset(arc.period)
+        for oid, c in arc.contributions():
+            agg.apply(oid, c)
+        label = f'{ym[5:]}/{ym[:4]}'
+        panels = {
+            'month_status': agg.status_panel(label, refdata.status_name),
+            'month_vendor': agg.vendor_panel(label, refdata.vendor_name, refdata.vendor_names()),
+            'month_day': agg.day_panel(label),
+            'prod_month': agg.products_panel(label, lambda nome, sku: stable_id('pm', nome, sku)),
+        }
+    acc.archive_panels[ym] = (key, panels)
+    return panels
+# ---------------------------------------------------------------
 
-    linhas.sort(key=lambda x: x['valor'], reverse=True)
 
-    panel = {
-        'mes_label': m_ini.strftime('%m/%Y'),
-        'status_list': linhas,
-        'total_qtd': tq,
-        'total_valor': tv,
-        'details_by_status': details
-    }
-    MONTH_STATUS_CACHE['key'] = cache_key
-    MONTH_STATUS_CACHE['panel'] = panel
+# ----------------- Painel STATUS — MÊS -----------------
+def build_month_status_panel(client, situacao=None):
+    m_ini, m_fim = month_bounds_today()
+    newest = month_version(client, m_ini, m_fim)
+    cache_key = (m_ini.isoformat(), m_fim.isoformat(), newest, situacao or None)
+    cache = account().month_status
+    hit = cache.get('key') == cache_key and bool(cache.get('panel'))
+    timing.record_cache('MONTH_STATUS_CACHE', hit)
+    if hit:
+        return cache['panel']
+
+    agg = month_aggregates(client, m_ini, m_fim, details=False)
+    with agg.lock:
+        # inclui todos os status encontrados (cancelado entra nos totais)
+        panel = agg.status_panel(m_ini.strftime('%m/%Y'), account().refdata.status_name, only=situacao or None)
+    cache['key'] = cache_key
+    cache['panel'] = panel
     return panel
 # --------------------------------------------------------
 
@@ -466,118 +584,22 @@ def build_month_status_panel(client, situacao=None):
 # ----------------- Painel VENDEDOR — MÊS (exclui CANCELADO) -----------------
 def build_month_vendor_panel(client):
     m_ini, m_fim = month_bounds_today()
-    newest = newest_month_key(client, m_ini, m_fim)
+    newest = month_version(client, m_ini, m_fim)
     cache_key = (m_ini.isoformat(), m_fim.isoformat(), newest, 'vendor')
-    if MONTH_VENDOR_CACHE.get('key') == cache_key and MONTH_VENDOR_CACHE.get('panel'):
-        return MONTH_VENDOR_CACHE['panel']
-
-    all_rows, pagina = [], 1
-    page_size, page_limit = 100, 12
-    for _ in range(page_limit):
-        try:
-            resp = client.list_sales(to_iso(m_ini), to_iso(m_fim), None, pagina=pagina, limite=page_size)
-            data = resp.get('data', []) or []
-            all_rows.extend(data)
-            if len(data) < page_size:
-                break
-            pagina += 1
-        except Exception:
-            break
-
-    by_id = {}
-    for r in all_rows:
-        rid = r.get('id') or r.get('numero')
-        if rid is None:
-            continue
-        if rid not in by_id:
-            by_id[rid] = r
-    rows = list(by_id.values())
-
-    from collections import defaultdict as dd
-    acum = dd(lambda: {'qtd': 0, 'valor': 0.0})
-    details = dd(list)
-
-    detail_cache = {}
-    nomes_validos = set(VENDEDOR_MAP.values())
-    vendor_has_cancelled = dd(bool)
-
-    for r in rows:
-        d_raw = first(r, ['dataEmissao', 'data.emissao', 'data'])
-        d = parse_date(d_raw)
-        if not d or d < m_ini or d > m_fim:
-            continue
-
-        sid = first(r, ['situacao.id', 'idSituacao', 'geral.situacao.id'])
-        try:
-            sid = int(sid) if sid is not None else None
-        except Exception:
-            sid = None
-
-        vid = first(r, ['vendedor.id', 'idVendedor', 'geral.vendedor.id'])
-        nome_vendor = None
-
-        if vid is None:
-            rid = r.get('id') or r.get('numero')
-            det = detail_cache.get(rid)
-            if det is None:
-                try:
-                    det = client.get_sale(str(rid)) if rid else None
-                except Exception:
-                    det = None
-                detail_cache[rid] = det
-            if det:
-                vid = first(det, ['vendedor.id'])
-                nome_vendor = first(det, ['vendedor.nome'])
-
-        if vid is not None and nome_vendor is None:
-            try:
-                nome_vendor = VENDEDOR_MAP.get(int(vid))
-            except Exception:
-                nome_vendor = None
-
-        vend_key = nome_vendor if (nome_vendor in nomes_validos) else 'SEM VENDEDOR'
-
-        valor = parse_total(r.get('total'))
-        numero = r.get('numero') or r.get('id')
-        data_em_br = br_dmy_short(d_raw)
-
-        details[vend_key].append({'numero': numero, 'data': data_em_br, 'total': valor, 'sid': sid})
-        if sid == 12:
-            vendor_has_cancelled[vend_key] = True
-        else:
-            acum[vend_key]['qtd'] += 1
-            acum[vend_key]['valor'] += valor
-
-    linhas = []
-    for nome in nomes_validos:
-        dct = acum.get(nome)
-        if dct:
-            linhas.append({
-                'vendedor': nome,
-                'qtd': int(dct['qtd']),
-                'valor': float(dct['valor']),
-                'has_cancelled': bool(vendor_has_cancelled[nome])
-            })
-    if 'SEM VENDEDOR' in acum or vendor_has_cancelled['SEM VENDEDOR']:
-        dct = acum.get('SEM VENDEDOR', {'qtd': 0, 'valor': 0.0})
-        linhas.append({
-            'vendedor': 'SEM VENDEDOR',
-            'qtd': int(dct['qtd']),
-            'valor': float(dct['valor']),
-            'has_cancelled': bool(vendor_has_cancelled['SEM VENDEDOR'])
-        })
-
-    linhas.sort(key=lambda x: x['valor'], reverse=True)
-
-    panel = {
-        'mes_label': m_ini.strftime('%m/%Y'),
-        'vendors_list': linhas,
-        'total_qtd': sum(l['qtd'] for l in linhas),
-        'total_valor': sum(l['valor'] for l in linhas),
-        'details_by_vendor': details
-    }
-    MONTH_VENDOR_CACHE['key'] = cache_key
-    MONTH_VENDOR_CACHE['panel'] = panel
+    cache = account().month_vendor
+    hit = cache.get('key') == cache_key and bool(cache.get('panel'))
+    timing.record_cache('MONTH_VENDOR_CACHE', hit)
+    if hit:
+        return cache['panel']
+
+    agg = month_aggregates(client, m_ini, m_fim)
+    with agg.lock:
+        refdata = account().refdata
+        panel = agg.vendor_panel(m_ini.strftime('%m/%Y'), refdata.vendor_name, refdata.vendor_names())
+        complete = not agg.partial
+    # pedido ainda sem detalhe (cota, disjuntor, detalhe vazio): sem chave, a próxima chamada tenta completar
+    cache['key'] = cache_key if complete else None
+    cache['panel'] = panel
     return panel
 # -----------------------------------------------------------------------------
 
@@ -585,100 +607,20 @@ def build_month_vendor_panel(client):
 # ----------------- Painel DIAS — MÊS -----------------
 def build_month_day_panel(client):
     m_ini, m_fim = month_bounds_today()
-    newest = newest_month_key(client, m_ini, m_fim)
+    newest = month_version(client, m_ini, m_fim)
     cache_key = (m_ini.isoformat(), m_fim.isoformat(), newest, 'day')
 
-    if MONTH_DAY_CACHE.get('key') == cache_key and MONTH_DAY_CACHE.get('panel'):
-        return MONTH_DAY_CACHE['panel']
-
-    status_key = (m_ini.isoformat(), m_fim.isoformat(), newest)
-    status_panel = None
-    if MONTH_STATUS_CACHE.get('key') == status_key:
-        status_panel = MONTH_STATUS_CACHE.get('panel')
-
-    from collections import defaultdict as dd
-    acum = dd(lambda: {'qtd': 0, 'valor': 0.0})
-    details_by_day = dd(list)
-    day_has_cancelled = dd(bool)
-
-    def push_item(d_br, numero, total, sid):
-        try:
-            d_iso = datetime.strptime(d_br, '%d/%m/%y').date().isoformat()
-        except Exception:
-            d_iso = d_br
-        acum[d_iso]['qtd'] += 1
-        acum[d_iso]['valor'] += total
-        details_by_day[d_iso].append({'numero': numero, 'data': d_br, 'total': total, 'sid': sid})
-        if sid == 12:
-            day_has_cancelled[d_iso] = True
-
-    if status_panel and status_panel.get('details_by_status'):
-        for sid, lst in (status_panel.get('details_by_status') or {}).items():
-            try:
-                sid_int = int(sid)
-            except Exception:
-                sid_int = sid
-            for it in lst:
-                push_item(it.get('data'), it.get('numero'), parse_total(it.get('total')), sid_int)
-    else:
-        all_rows, pagina = [], 1
-        page_size, page_limit = 100, 12
-        for _ in range(page_limit):
-            try:
-                resp = client.list_sales(to_iso(m_ini), to_iso(m_fim), None,
-                                         pagina=pagina, limite=page_size)
-                data = resp.get('data', []) or []
-                all_rows.extend(data)
-                if len(data) < page_size:
-                    break
-                pagina += 1
-            except Exception:
-                break
-        by_id = {}
-        for r in all_rows:
-            rid = r.get('id') or r.get('numero')
-            if rid is None:
-                continue
-            if rid not in by_id:
-                by_id[rid] = r
-        rows = list(by_id.values())
-
-        for r in rows:
-            d_raw = first(r, ['dataEmissao', 'data.emissao', 'data'])
-            d = parse_date(d_raw)
-            if not d or d < m_ini or d > m_fim:
-                continue
-            sid = first(r, ['situacao.id', 'idSituacao', 'geral.situacao.id'])
-            try:
-                sid = int(sid) if sid is not None else None
-            except Exception:
-                sid = None
-            push_item(br_dmy_short(d_raw), r.get('numero') or r.get('id'), parse_total(r.get('total')), sid)
-
-    dias = sorted(acum.keys(), reverse=True)
-    lines = []
-    for k in dias:
-        try:
-            d_lbl = datetime.strptime(k, '%Y-%m-%d').strftime('%d/%m/%y')
-        except Exception:
-            d_lbl = k
-        lines.append({
-            'day_key': k,
-            'day_label': d_lbl,
-            'qtd': int(acum[k]['qtd']),
-            'valor': float(acum[k]['valor']),
-            'has_cancelled': bool(day_has_cancelled[k])
-        })
-
-    panel = {
-        'mes_label': m_ini.strftime('%m/%Y'),
-        'days_list': lines,
-        'total_qtd': sum(x['qtd'] for x in lines),
-        'total_valor': sum(x['valor'] for x in lines),
-        'details_by_day': details_by_day
-    }
-    MONTH_DAY_CACHE['key'] = cache_key
-    MONTH_DAY_CACHE['panel'] = panel
+    cache = account().month_day
+    hit = cache.get('key') == cache_key and bool(cache.get('panel'))
+    timing.record_cache('MONTH_DAY_CACHE', hit)
+    if hit:
+        return cache['panel']
+
+    agg = month_aggregates(client, m_ini, m_fim, details=False)
+    with agg.lock:
+        panel = agg.day_panel(m_ini.strftime('%m/%Y'))
+    cache['key'] = cache_key
+    cache['panel'] = panel
     return panel
 # -----------------------------------------------------------------------------
 
@@ -692,6 +634,7 @@ def build_products_today_panel(pedidos):
     - Ordena por maior VALOR total.
     """
     hoje = br_now_saopaulo().strftime('%d/%m/%y')
+    dim = account().products     # (nome, sku) -> id: agrupa por inteiro, textos uma vez só
     prods = defaultdict(lambda: {'qtd': 0.0, 'valor': 0.0, 'has_cancelled': False, 'details': []})
 
     for p in pedidos:
@@ -702,7 +645,7 @@ def build_products_today_panel(pedidos):
         data_br = p.get('_data_emissao_br') or '-'
         itens = p.get('itens_norm') or []
         for it in itens:
-            key = (it.get('_nome') or '-', it.get('_sku') or '-')
+            key = dim.id((it.get('_nome') or '-', it.get('_sku') or '-'))
             q = parse_qty(it.get('_qtd') or 0)
             v_item = (it.get('_preco') or 0.0) * q
             prods[key]['details'].append({
@@ -719,14 +662,15 @@ def build_products_today_panel(pedidos):
                 prods[key]['valor'] += v_item
 
     lines, total_qtd, total_valor = [], 0.0, 0.0
-    for (nome, sku), d in prods.items():
+    for prod_id, d in prods.items():
+        nome, sku = dim.key(prod_id)
         lines.append({
             'produto': nome,
             'sku': sku,
             'qtd': d['qtd'],
             'valor': d['valor'],
             'has_cancelled': d['has_cancelled'],
-            'detail_id': f"pd-{abs(hash((nome, sku))) % 10**8}",
+            'detail_id': stable_id('pd', nome, sku),
         })
         total_qtd += d['qtd']
         total_valor += d['valor']
@@ -734,8 +678,8 @@ def build_products_today_panel(pedidos):
     lines.sort(key=lambda x: x['valor'], reverse=True)
 
     details_map = {}
-    for (nome, sku), d in prods.items():
-        details_map[(nome, sku)] = d['details']
+    for prod_id, d in prods.items():
+        details_map[dim.key(prod_id)] = d['details']
 
     panel = {
         'day_label': hoje,
@@ -757,119 +701,348 @@ def build_products_month_panel(client):
     - Ordena por maior VALOR total.
     """
     m_ini, m_fim = month_bounds_today()
-    newest = newest_month_key(client, m_ini, m_fim)
+    newest = month_version(client, m_ini, m_fim)
     cache_key = (m_ini.isoformat(), m_fim.isoformat(), newest, 'prod-month')
-    if MONTH_PROD_CACHE.get('key') == cache_key and MONTH_PROD_CACHE.get('panel'):
-        return MONTH_PROD_CACHE['panel']
+    cache = account().month_prod
+    hit = cache.get('key') == cache_key and bool(cache.get('panel'))
+    timing.record_cache('MONTH_PROD_CACHE', hit)
+    if hit:
+        return cache['panel']
+
+    agg = month_aggregates(client, m_ini, m_fim)
+    with agg.lock:
+        panel = agg.products_panel(m_ini.strftime('%m/%Y'),
+                                   lambda nome, sku: stable_id('pm', nome, sku))
+        complete = not agg.partial
+    cache['key'] = cache_key if complete else None     # idem painel de vendedores
+    cache['panel'] = panel
+    return panel
+# -----------------------------------------------------------------------------
+
+
+# --------- ENRIQUECIMENTO DE PEDIDO (lista + detalhe) ----------------------
+def enrich_order(client, p, allow_fetch=True, raw=None):
+    """
+    Pedido da página a partir da linha da listagem e do detalhe (itens, vendedor,
+    parcelas...), só com os campos que o template e os painéis do dia usam.
+    Com allow_fetch=False usa só o que estiver no cache ('_sem_detalhe' marca a falta).
+    O par bruto (linha, detalhe) vai para `raw` como (id, par), para o arquivo do /api-fields.
+    """
+    acc = account()
+    try:
+        det = acc.detail_cache.fetch(client, p, allow_fetch=allow_fetch and details_allowed())
+    except CircuitOpen:
+        det = acc.detail_cache.fetch(client, p, allow_fetch=False)
+    if raw is not None:
+        raw.append((p.get('id') or p.get('numero'), {'lista': p, 'detalhes': det}))
+
+    total = p.get('total')
+    if total is None:
+        total = (det or {}).get('total')
+    contato = p.get('contato') if isinstance(p.get('contato'), dict) else (det or {}).get('contato') or {}
+    o = {
+        'id': p.get('id'),
+        'numero': p.get('numero'),
+        'total': total,
+        'contato': {'nome': contato.get('nome')},
+        '_numero': p.get('numero') or p.get('id'),
+        '_sem_detalhe': det is None,
+    }
+
+    itens = (det or {}).get('itens') or p.get('itens') or []
+    o['itens_norm'] = [normalize_item(i) for i in itens]
+
+    vendedor_id = (det or {}).get('vendedor', {}).get('id') or first(
+        p, ['vendedor.id', 'idVendedor', 'geral.vendedor.id']
+    )
+    nome_vendedor = acc.refdata.vendor_name(vendedor_id)
+    o['_vendedor_display'] = nome_vendedor or (str(vendedor_id) if vendedor_id else '-')
+
+    situacao_id = first(p, ['situacao.id', 'idSituacao', 'geral.situacao.id'])
+    try:
+        sid = int(situacao_id) if situacao_id is not None else None
+    except Exception:
+        sid = None
+    o['_situacao_id'] = sid
+    o['_situacao_display'] = acc.refdata.status_name(sid, str(situacao_id) if situacao_id else '-')
+
+    data_em = first(p, ['dataEmissao', 'data.emissao', 'data'])
+    o['_data_emissao_br'] = br_dmy_short(data_em)
+
+    o['_obs'] = first(det or p, ['observacoes', 'obs']) or ''
+    o['_obs_int'] = first(det or p, ['observacoesInternas']) or ''
+
+    pars = (det or {}).get('parcelas') or p.get('parcelas') or []
+    norm = []
+    for par in pars:
+        fpid = None
+        if isinstance(par.get('formaPagamento'), dict):
+            fpid = par['formaPagamento'].get('id')
+        desc = acc.refdata.payment_name(fpid)
+        norm.append({
+            'id': par.get('id'),
+            'dataVencimento': br_dmy_short(par.get('dataVencimento') or par.get('vencimento')),
+            'valor': par.get('valor') or 0,
+            'observacoes': par.get('observacoes') or '',
+            'caut': par.get('caut') or '',
+            'formaPagamentoId': fpid,
+            'formaPagamentoDesc': desc or (str(fpid) if fpid is not None else None)
+        })
+    o['_parcelas'] = norm
+
+    frete_raw = first(det or p, ['transporte.frete', 'frete'])
+    o['_frete'] = parse_total(frete_raw)
+    return o
+# -----------------------------------------------------------------------------
 
-    all_rows, pagina = [], 1
-    page_size, page_limit = 100, 20
-    for _ in range(page_limit):
+
+# =================== STALE-WHILE-REVALIDATE ===================
+# estado por conta: account().stale (painel -> desde quando) e account().revalidating
+_SWR_LOCK = threading.Lock()
+
+
+def empty_panel(name):
+    m_ini, _ = month_bounds_today()
+    base = {'mes_label': m_ini.strftime('%m/%Y'), 'total_qtd': 0, 'total_valor': 0.0}
+    extra = {
+        'month_status': {'status_list': [], 'details_by_status': {}},
+        'month_vendor': {'vendors_list': [], 'details_by_vendor': {}},
+        'month_day': {'days_list': [], 'details_by_day': {}},
+        'prod_month': {'products_list': [], 'details_by_product': {}},
+    }[name]
+    return dict(base, **extra)
+
+
+def _revalidate(name, build, client, attempts=6):
+    acc = account()
+    try:
+        for _ in range(attempts):
+            wait = acc.breaker.open_until - time.time()
+            if wait > 0:
+                time.sleep(min(wait, 300))
+            try:
+                build(client)
+                acc.stale.pop(name, None)
+                return
+            except Exception:
+                time.sleep(5)
+    finally:
+        with _SWR_LOCK:
+            acc.revalidating.discard(name)
+
+
+def serve_panel(name, cache, build, client):
+    """
+    Stale-while-revalidate dos painéis do mês: se o Bling falhar (ou o
+    disjuntor estiver aberto), devolve na hora o último painel bom, marca
+    desde quando ele está desatualizado e reconstrói em segundo plano.
+    Devolve (painel, novo): novo=False quando é o último bom (ou vazio).
+    Roda em threads: client deve vir de detached_api().
+    """
+    acc = account()
+    if not acc.breaker.is_open():
         try:
-            resp = client.list_sales(to_iso(m_ini), to_iso(m_fim), None, pagina=pagina, limite=page_size)
-            data = resp.get('data', []) or []
-            all_rows.extend(data)
-            if len(data) < page_size:
-                break
-            pagina += 1
+            panel = build(client)
+            acc.stale.pop(name, None)
+            return panel, True
         except Exception:
-            break
+            pass
+    acc.stale.setdefault(name, br_now_saopaulo())
+    with _SWR_LOCK:
+        start = name not in acc.revalidating
+        acc.revalidating.add(name)
+    if start:
+        # a thread herda o contexto (conta atual)
+        threading.Thread(target=contextvars.copy_context().run, args=(_revalidate, name, build, client),
+                         name=f'swr-{acc.key}-{name}', daemon=True).start()
+    return cache.get('panel') or empty_panel(name), False
+
+
+# =================== PRAZO DO INDEX (painéis em paralelo) ===================
+INDEX_BUDGET = float(os.getenv('INDEX_BUDGET', '2.0'))   # segundos; 0 = espera todos os painéis
+PANEL_WAIT = 20.0       # quanto /panel/<nome> segura a resposta antes de devolver 202
+PANEL_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('PANEL_WORKERS', '6')), thread_name_prefix='panel')
+# detalhes que ficaram de fora do index: pool próprio, para não ocupar os workers dos painéis
+DETAIL_POOL = ThreadPoolExecutor(max_workers=int(os.getenv('DETAIL_WORKERS', '2')), thread_name_prefix='details')
+_JOBS_LOCK = threading.Lock()
+
+
+# painel -> (cache na conta, montagem)
+MONTH_PANELS = {
+    'month_status': ('month_status', build_month_status_panel),
+    'month_vendor': ('month_vendor', build_month_vendor_panel),
+    'month_day': ('month_day', build_month_day_panel),
+    'prod_month': ('month_prod', build_products_month_panel),
+}
+PANEL_TEMPLATES = {
+    'month_status': 'partials/panel_month_status.html',
+    'month_vendor': 'partials/panel_month_vendor.html',
+    'month_day': 'partials/panel_month_day.html',
+    'month_chart': 'partials/panel_month_chart.html',   # gráfico: dados do painel de dias
+    'prod_month': 'partials/panel_prod_month.html',
+}
 
-    by_id = {}
-    for r in all_rows:
-        rid = r.get('id') or r.get('numero')
-        if rid is None:
-            continue
-        if rid not in by_id:
-            by_id[rid] = r
-    rows = list(by_id.values())
 
-    prods = defaultdict(lambda: {'qtd': 0.0, 'valor': 0.0, 'has_cancelled': False, 'details': []})
-    detail_cache = {}
+def cached_panel(name, acc=None):
+    """Último painel montado (ou vazio), para quando a montagem falhar."""
+    return getattr(acc or account(), MONTH_PANELS[name][0]).get('panel') or empty_panel(name)
 
-    for r in rows:
-        d_raw = first(r, ['dataEmissao', 'data.emissao', 'data'])
-        d = parse_date(d_raw)
-        if not d or d < m_ini or d > m_fim:
-            continue
 
-        sid = first(r, ['situacao.id', 'idSituacao', 'geral.situacao.id'])
+def _panel_job(name, client):
+    """(painel, novo) — ver serve_panel."""
+    attr, build = MONTH_PANELS[name]
+    with timing.stage('panel-' + name.replace('_', '-')):
+        return serve_panel(name, getattr(account(), attr), build, client)
+
+
+def submit_panel(name, client, acc=None):
+    """Agenda a montagem do painel no pool (reaproveita a que já estiver em andamento)."""
+    acc = acc or account()
+    with _JOBS_LOCK:
+        job = acc.panel_jobs.get(name)
+        if job is None or job.done():
+            # copia o contexto (conta e Server-Timing desta requisição)
+            job = PANEL_POOL.submit(accounts.context(acc).run, _panel_job, name, client)
+            acc.panel_jobs[name] = job
+    return job
+
+
+def collect_panels(jobs, deadline):
+    """
+    Painéis prontos até o prazo; os que faltam ficam None (placeholder na página).
+    Devolve (painéis, fallback): fallback tem os servidos do cache (ou vazios) por falha.
+    """
+    remaining = deadline - time.monotonic()
+    wait(list(jobs.values()), timeout=None if remaining == float('inf') else max(remaining, 0))
+    out, fallback = {}, set()
+    for name, job in jobs.items():
+        if not job.done():
+            out[name] = None
+        elif job.exception() is not None:
+            out[name] = cached_panel(name)
+            fallback.add(name)
+        else:
+            out[name], fresh = job.result()
+            if not fresh:
+                fallback.add(name)
+    return out, fallback
+
+
+def _prefetch_details(client, rows):
+    """Busca em segundo plano os detalhes que ficaram de fora pelo prazo do index."""
+    acc = account()
+    for p in rows:
         try:
-            sid = int(sid) if sid is not None else None
+            acc.detail_cache.fetch(client, p)
         except Exception:
-            sid = None
-
-        pid = r.get('numero') or r.get('id')
-        data_br = br_dmy_short(d_raw)
-
-        itens = r.get('itens')
-        if not itens:
-            det = detail_cache.get(pid)
-            if det is None:
-                try:
-                    det = client.get_sale(str(pid)) if pid else None
-                except Exception:
-                    det = None
-                detail_cache[pid] = det
-            itens = (det or {}).get('itens') or []
-
-        for i in itens:
-            ni = normalize_item(i)
-            key = (ni['_nome'] or '-', ni['_sku'] or '-')
-            q = parse_qty(ni['_qtd'])
-            v_item = (ni['_preco'] or 0.0) * q
-            prods[key]['details'].append({
-                'numero': pid,
-                'data': data_br,
-                'qtd': q,
-                'valor': v_item,
-                'sid': sid
-            })
-            if sid == 12:
-                prods[key]['has_cancelled'] = True
-            else:
-                prods[key]['qtd'] += q
-                prods[key]['valor'] += v_item
+            return
+    acc.vendor_index.flush()
 
-    lines, total_qtd, total_valor = [], 0.0, 0.0
-    for (nome, sku), d in prods.items():
-        lines.append({
-            'produto': nome,
-            'sku': d['sku'] if isinstance(d, dict) and 'sku' in d else sku,
-            'qtd': d['qtd'],
-            'valor': d['valor'],
-            'has_cancelled': d['has_cancelled'],
-            'detail_id': f"pm-{abs(hash((nome, sku))) % 10**8}",
-        })
-        total_qtd += d['qtd']
-        total_valor += d['valor']
 
-    lines.sort(key=lambda x: x['valor'], reverse=True)
+PRODUCTS_PAGE = int(os.getenv('PRODUCTS_PAGE', '50'))   # produtos do mês por página (index e consolidado)
 
-    details_map = {}
-    for (nome, sku), d in prods.items():
-        details_map[(nome, sku)] = d['details']
 
-    panel = {
-        'mes_label': m_ini.strftime('%m/%Y'),
-        'products_list': lines,
-        'total_qtd': total_qtd,
-        'total_valor': total_valor,
-        'details_by_product': details_map
-    }
-    MONTH_PROD_CACHE['key'] = cache_key
-    MONTH_PROD_CACHE['panel'] = panel
-    return panel
-# -----------------------------------------------------------------------------
+def _products_key(by):
+    """Ordem das tabelas de produtos: maior valor (ou quantidade) primeiro; empate por nome e SKU."""
+    col = 'qtd' if by == 'qtd' else 'valor'
+    return lambda l: (-l[col], str(l['produto']), str(l['sku']))
+
+
+def products_cursor(key) -> str:
+    """Cursor opaco para a página seguinte: a chave de ordenação do último produto mostrado."""
+    raw = json.dumps([-key[0], key[1], key[2]], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def parse_products_cursor(raw):
+    try:
+        v, nome, sku = json.loads(base64.urlsafe_b64decode(raw + '=' * (-len(raw) % 4)))
+        return (-float(v), str(nome), str(sku))
+    except Exception:
+        return None
+
+
+def page_products(panel, by, after=None, limit=None):
+    """
+    Cópia do painel de produtos com os `limit` primeiros na ordenação pedida
+    depois do cursor `after` (seleção parcial com heap, sem ordenar a lista
+    toda; limit=None devolve todos, ordenados). O painel em cache não muda;
+    o zoom continua o do painel, mas só as linhas da página são renderizadas.
+    Cursor em vez de deslocamento: se o painel mudar entre uma página e outra,
+    a seguinte continua de onde a anterior parou.
+    """
+    if not panel:
+        return panel
+    key = _products_key(by)
+    lines = panel['products_list']
+    total = len(lines)
+    if after is not None:
+        lines = [l for l in lines if key(l) > after]
+    if limit is None:
+        return dict(panel, products_list=sorted(lines, key=key), products_total=total,
+                    products_shown=total, next_cursor=None)
+    top = heapq.nsmallest(limit + 1, lines, key=key)
+    more = len(top) > limit
+    top = top[:limit]
+    return dict(panel, products_list=top, products_total=total,
+                products_shown=total - len(lines) + len(top),
+                next_cursor=products_cursor(key(top[-1])) if more else None)
+
+
+# =================== MEDIÇÃO POR REQUISIÇÃO ===================
+DEBUG_TIMING = os.getenv('ABLING_DEBUG_TIMING') == '1'
+
+
+@app.before_request
+def _timing_start():
+    timing.start(request.endpoint)
+
+
+@app.before_request
+def _select_account():
+    # empresa escolhida na sessão; o contexto segue para as threads do pool
+    accounts.use(ACCOUNTS.get(session.get('account')) or ACCOUNTS[DEFAULT_ACCOUNT])
+
+
+@app.after_request
+def _timing_header(resp):
+    t = timing.current()
+    if t is not None:
+        resp.headers['Server-Timing'] = t.server_timing()
+        metrics.HTTP_REQUESTS.observe(t.total(), request.endpoint or 'none', str(resp.status_code))
+    return resp
+
+
+@app.teardown_request
+def _timing_stop(exc=None):
+    timing.stop()
+
+
+@app.context_processor
+def _timing_footer():
+    def timing_footer():
+        """Rodapé de depuração: ABLING_DEBUG_TIMING=1 ou ?debug=timing."""
+        if not (DEBUG_TIMING or request.args.get('debug') == 'timing'):
+            return None
+        t = timing.current()
+        if t is None:
+            return None
+        return {'rows': t.rows(), 'total_ms': t.total() * 1000}
+    acc = account()
+    return {'timing_footer': timing_footer, 'refresh_ms': REFRESH_MS[acc.quota.level()],
+            'account': acc, 'accounts': list(ACCOUNTS.values()), 'connected': connected}
 
 
 # =================== ROTA PRINCIPAL ===================
 @app.route('/')
 def index():
-    if not session.get('bling_token'):
+    if not connected():
         return render_template('login.html', conectado=False)
+    acc = account()
+    deadline = time.monotonic() + INDEX_BUDGET if INDEX_BUDGET > 0 else float('inf')
 
     situacao = request.args.get('situacao', '').strip()
+    vendedor = request.args.get('vendedor', '').strip()
     di = request.args.get('data_ini', '')
     df = request.args.get('data_fim', '')
 
@@ -890,220 +1063,423 @@ def index():
             d_ini, d_fim = default_dates()
 
     client = api()
-    if not client.session.get('bling_token'):
+    if not client.session.get(acc.token_key):
         flash('Conecte ao Bling para continuar.', 'warning')
         return redirect(url_for('login'))
 
+    # situações/vendedores/formas de pagamento: recarga em segundo plano quando vencidos
+    acc.refdata.refresh_async(detached_api())
+
     # Assinaturas para invalidação
     m_ini, m_fim = month_bounds_today()
     force = request.args.get('refresh') == 'force'
-    month_newest = None if force else newest_month_key(client, m_ini, m_fim)
-    daily_newest = None if force else newest_range_key(client, d_ini, d_fim)
+    if force:
+        force_month_sync(m_ini, m_fim)
+        month_newest = None
+    elif acc.orders.covers(to_iso(m_ini), to_iso(m_fim)):
+        month_newest = month_version(client, m_ini, m_fim)
+        if month_newest is None:
+            # Bling fora: a cópia local continua servindo, marcada como desatualizada
+            acc.stale.setdefault('snapshot', br_now_saopaulo())
+    else:
+        month_newest = None     # primeira carga do mês fica com os painéis (dentro do prazo)
+    # filtros (datas, situação, vendedor) avaliados localmente sobre a cópia dos pedidos
+    local = None if force else daily_orders(client, d_ini, d_fim, m_ini, m_fim, situacao, vendedor)
+    if local is not None:
+        daily_newest = local[1]
+    else:
+        daily_newest = None if force else newest_range_key(client, d_ini, d_fim)
 
     snapshot_key = (
         m_ini.isoformat(),
         m_fim.isoformat(),
         month_newest,
         'daily',
+        d_ini.isoformat(),
+        d_fim.isoformat(),
+        situacao,
+        vendedor,
         daily_newest,
-        psd,
-        psm,
-        buscar_analise,
-    )
-
-    if (not force) and PAGE_SNAPSHOT.get('key') == snapshot_key and PAGE_SNAPSHOT.get('context'):
-        ctx = PAGE_SNAPSHOT['context']
-    else:
-        pedidos = []
+    )   # ordenação e análise (psd, psm, buscar_analise) ficam fora: são aplicadas na renderização
+
+    snapshot = acc.page_snapshot
+    hit = (not force) and snapshot.get('key') == snapshot_key and bool(snapshot.get('context'))
+    timing.record_cache('PAGE_SNAPSHOT', hit)
+    pedidos, daily_ok = [], False
+    if not hit:
+        # painéis do mês em paralelo com a parte diária; o que não ficar pronto
+        # até o prazo vira placeholder e é completado via /panel/<nome>
+        bg = detached_api()
+        jobs = {name: submit_panel(name, bg) for name in MONTH_PANELS}
         try:
-            resp = client.list_sales(to_iso(d_ini), to_iso(d_fim), situacao or None, pagina=1, limite=50)
-            pedidos = resp.get('data', [])
+            if local is not None:
+                pedidos = local[0]
+            else:
+                with timing.stage('list-daily'):
+                    resp = client.list_sales(to_iso(d_ini), to_iso(d_fim), situacao or None,
+                                             pagina=1, limite=DAILY_LIMIT)
+                pedidos = resp.get('data', [])
+                if vendedor:    # a listagem não traz vendedor: usa o índice local
+                    pedidos = [p for p in pedidos if str(acc.vendor_index.get(p.get('id'))) == vendedor]
+            daily_ok = True
         except Exception as e:
-            flash(f'Erro ao buscar pedidos: {e}', 'danger')
+            if snapshot.get('context'):
+                # Bling fora: serve a última página boa
+                hit = True
+                acc.stale.setdefault('snapshot', br_now_saopaulo())
+            else:
+                flash(f'Erro ao buscar pedidos: {e}', 'danger')
 
-        enriched = []
-        for p in pedidos:
-            pid = p.get('id') or p.get('numero')
-            det = None
-            try:
-                if pid:
-                    det = client.get_sale(str(pid))
-            except Exception:
-                det = None
+    if hit:
+        ctx = snapshot['context']
+    else:
 
-            itens = (det or {}).get('itens') or p.get('itens') or []
-            p['itens_norm'] = [normalize_item(i) for i in itens]
-            p['_numero'] = p.get('numero') or p.get('id')
+        raw = []
+        with timing.stage('enrich'):
+            enriched = [enrich_order(client, p, allow_fetch=time.monotonic() < deadline, raw=raw) for p in pedidos]
+        sem_detalhe = [p for p, o in zip(pedidos, enriched) if o['_sem_detalhe']]
+        if sem_detalhe and details_allowed():
+            DETAIL_POOL.submit(contextvars.copy_context().run, _prefetch_details, bg, sem_detalhe)
 
-            vendedor_id = (det or {}).get('vendedor', {}).get('id') or first(
-                p, ['vendedor.id', 'idVendedor', 'geral.vendedor.id']
-            )
-            nome_vendedor = None
-            try:
-                if vendedor_id is not None:
-                    nome_vendedor = VENDEDOR_MAP.get(int(vendedor_id))
-            except Exception:
-                nome_vendedor = None
-            p['_vendedor_display'] = nome_vendedor or (str(vendedor_id) if vendedor_id else '-')
+        acc.vendor_index.flush()
+        # payloads brutos ficam no disco (comprimidos), fora do snapshot e do cookie da sessão
+        acc.raw_archive.put_async(raw)
+        session.pop('last_raw_json', None)
+        session['last_raw_order'] = str(raw[-1][0]) if raw else None
 
-            situacao_id = first(p, ['situacao.id', 'idSituacao', 'geral.situacao.id'])
-            try:
-                sid = int(situacao_id) if situacao_id is not None else None
-            except Exception:
-                sid = None
-            p['_situacao_id'] = sid
-            p['_situacao_display'] = STATUS_MAP.get(sid, str(situacao_id) if situacao_id else '-')
-
-            data_em = first(p, ['dataEmissao', 'data.emissao', 'data'])
-            p['_data_emissao_br'] = br_dmy_short(data_em)
-
-            p['_obs'] = first(det or p, ['observacoes', 'obs']) or ''
-            p['_obs_int'] = first(det or p, ['observacoesInternas']) or ''
-
-            pars = (det or {}).get('parcelas') or p.get('parcelas') or []
-            norm = []
-            for par in pars:
-                fpid = None
-                if isinstance(par.get('formaPagamento'), dict):
-                    fpid = par['formaPagamento'].get('id')
-                desc = None
-                norm.append({
-                    'id': par.get('id'),
-                    'dataVencimento': br_dmy_short(par.get('dataVencimento') or par.get('vencimento')),
-                    'valor': par.get('valor') or 0,
-                    'observacoes': par.get('observacoes') or '',
-                    'caut': par.get('caut') or '',
-                    'formaPagamentoId': fpid,
-                    'formaPagamentoDesc': desc or (str(fpid) if fpid is not None else None)
-                })
-            p['_parcelas'] = norm
-
-            frete_raw = first(det or p, ['transporte.frete', 'frete'])
-            p['_frete'] = parse_total(frete_raw)
-
-            p['_raw_pair'] = {'lista': {k: v for k, v in p.items() if not str(k).startswith('_')},
-                              'detalhes': det}
-            enriched.append(p)
-
-        # === Buscar análise de margem na planilha, se solicitado ===
-        if buscar_analise and enriched:
-            sheet_url = get_analysis_sheet_url()
-            if not sheet_url:
-                flash('Cadastre primeiro a URL da planilha de análise de vendas em "Configurações".', 'warning')
-            else:
-                try:
-                    margin_map = load_margin_map_from_sheet(sheet_url)
-                    for p in enriched:
-                        num = str(p.get('_numero') or p.get('numero') or p.get('id') or '').strip()
-                        if num and num in margin_map:
-                            p['_margem_lucro'] = margin_map[num]
-                except Exception as e:
-                    flash(f'Erro ao buscar análise na planilha: {e}', 'danger')
-
-        session['last_raw_json'] = json.dumps(enriched[-1]['_raw_pair'], ensure_ascii=False) if enriched else None
-
-        vendor_panels, totais = build_daily_panels(enriched)
-        month_status_panel = build_month_status_panel(client, situacao=None)
-        month_vendor_panel = build_month_vendor_panel(client)
-        month_day_panel = build_month_day_panel(client)
-
-        # ====== DADOS DO GRÁFICO (VENDAS DIÁRIAS DO MÊS) ======
-        dias_list = month_day_panel['days_list']
-        dias_list_graf = list(reversed(dias_list))
-        graf_labels = [d['day_label'] for d in dias_list_graf]
-        graf_values = [d['valor'] for d in dias_list_graf]
-        graf_labels_json = json.dumps(graf_labels, ensure_ascii=False)
-        graf_values_json = json.dumps(graf_values, ensure_ascii=False)
-        # =====================================================
+        with timing.stage('panel-daily'):
+            vendor_panels, totais = build_daily_panels(enriched)
 
         # Painéis de produtos
-        prod_day_panel = build_products_today_panel(enriched)
-        prod_month_panel = build_products_month_panel(client)
+        with timing.stage('panel-prod-day'):
+            prod_day_panel = build_products_today_panel(enriched)
 
-        # aplica ordenação escolhida
-        if psd == 'qtd':
-            prod_day_panel['products_list'].sort(key=lambda x: x['qtd'], reverse=True)
-        else:
-            prod_day_panel['products_list'].sort(key=lambda x: x['valor'], reverse=True)
-
-        if psm == 'qtd':
-            prod_month_panel['products_list'].sort(key=lambda x: x['qtd'], reverse=True)
-        else:
-            prod_month_panel['products_list'].sort(key=lambda x: x['valor'], reverse=True)
-
-        # URLs de toggle ↑↓ e Buscar Análise
-        args_dict = request.args.to_dict()
-        # produtos dia
-        new_psd = 'qtd' if psd == 'valor' else 'valor'
-        args_psd = dict(args_dict, psd=new_psd)
-        toggle_psd_url = url_for('index', **args_psd)
-        # produtos mês
-        new_psm = 'qtd' if psm == 'valor' else 'valor'
-        args_psm = dict(args_dict, psm=new_psm)
-        toggle_psm_url = url_for('index', **args_psm)
-        # buscar análise
-        args_busca = dict(args_dict, buscar_analise='1')
-        buscar_analise_url = url_for('index', **args_busca)
+        panels, fallback = collect_panels(jobs, deadline)
+        # painel do cache por falha do Bling não entra no snapshot: a revalidação o troca
+        complete = all(v is not None for v in panels.values()) and not fallback and not sem_detalhe
 
         ctx = {
             'pedidos': enriched,
             'vendor_panels': vendor_panels,
             'totais': totais,
             'periodo': {'ini': d_ini.strftime('%d/%m/%y'), 'fim': d_fim.strftime('%d/%m/%y')},
-            'month_status_panel': month_status_panel,
-            'month_vendor_panel': month_vendor_panel,
-            'month_day_panel': month_day_panel,
+            'month_status_panel': panels['month_status'],
+            'month_vendor_panel': panels['month_vendor'],
+            'month_day_panel': panels['month_day'],
             'prod_day_panel': prod_day_panel,
-            'prod_month_panel': prod_month_panel,
+            'prod_month_panel': panels['prod_month'],
+            'sem_detalhe': len(sem_detalhe),
             'last_updated': fmt_br_min(br_now_saopaulo()),
-            'graf_labels_json': graf_labels_json,
-            'graf_values_json': graf_values_json,
-            'psd': psd,
-            'psm': psm,
-            'toggle_psd_url': toggle_psd_url,
-            'toggle_psm_url': toggle_psm_url,
-            'buscar_analise_url': buscar_analise_url,
-            'buscar_analise': buscar_analise,
         }
 
-        PAGE_SNAPSHOT['key'] = snapshot_key
-        PAGE_SNAPSHOT['context'] = ctx
-        PAGE_SNAPSHOT['at'] = br_now_saopaulo()
+        if complete:
+            if month_newest is None:
+                # mês carregado/reconciliado pelos painéis nesta requisição
+                snapshot_key = snapshot_key[:2] + (month_version(client, m_ini, m_fim),) + snapshot_key[3:]
+            snapshot['key'] = snapshot_key
+            snapshot['context'] = ctx
+            snapshot['at'] = br_now_saopaulo()
+        if daily_ok and local is None:
+            # com a lista local, quem limpa a marca é a consulta de novidade que deu certo
+            acc.stale.pop('snapshot', None)
+
+    # ---- apresentação sobre o ctx (cache ou novo): alternar ordenação/análise não consulta o Bling ----
+    pedidos = ctx['pedidos']
+    if buscar_analise and pedidos:
+        sheet_url = get_analysis_sheet_url()
+        if not sheet_url:
+            flash('Cadastre primeiro a URL da planilha de análise de vendas em "Configurações".', 'warning')
+        else:
+            try:
+                with timing.stage('sheet'):
+                    pedidos = with_margins(pedidos, margin_map_cached(sheet_url))
+            except Exception as e:
+                flash(f'Erro ao buscar análise na planilha: {e}', 'danger')
+
+    # URLs de toggle ↑↓ e Buscar Análise
+    args_dict = request.args.to_dict()
+    toggle_psd_url = url_for('index', **dict(args_dict, psd='qtd' if psd == 'valor' else 'valor'))
+    toggle_psm_url = url_for('index', **dict(args_dict, psm='qtd' if psm == 'valor' else 'valor'))
+    buscar_analise_url = url_for('index', **dict(args_dict, buscar_analise='1'))
+
+    with timing.stage('render'):
+        return render_template(
+            'index.html',
+            conectado=True,
+            pedidos=pedidos,
+            vendor_panels=ctx['vendor_panels'],
+            totais=ctx['totais'],
+            periodo=ctx['periodo'],
+            month_status_panel=ctx['month_status_panel'],
+            month_vendor_panel=ctx['month_vendor_panel'],
+            month_day_panel=ctx['month_day_panel'],
+            prod_day_panel=page_products(ctx['prod_day_panel'], psd),
+            prod_month_panel=page_products(ctx['prod_month_panel'], psm, limit=PRODUCTS_PAGE),
+            filtros={
+                'situacao': request.args.get('situacao', ''),
+                'data_ini': request.args.get('data_ini', ''),
+                'data_fim': request.args.get('data_fim', ''),
+                'vendedor': vendedor,
+            },
+            last_updated=ctx['last_updated'],
+            sem_detalhe=ctx.get('sem_detalhe', 0),
+            psd=psd,
+            psm=psm,
+            toggle_psd_url=toggle_psd_url,
+            toggle_psm_url=toggle_psm_url,
+            buscar_analise_url=buscar_analise_url,
+            buscar_analise=buscar_analise,
+            stale={k: fmt_br_min(v) for k, v in acc.stale.items()},
+        )
+
+
+# ======== PAINEL ATRASADO (fragmento para o placeholder) ========
+@app.route('/panel/<name>')
+def panel_fragment(name):
+    if not connected():
+        return Response('', status=401)
+    if name not in PANEL_TEMPLATES:
+        return Response('', status=404)
+    key = 'month_day' if name == 'month_chart' else name
+    job = submit_panel(key, detached_api())
+    wait([job], timeout=PANEL_WAIT)
+    if not job.done():
+        return Response('', status=202)   # ainda montando: o JS tenta de novo
+    panel = job.result()[0] if job.exception() is None else cached_panel(key)
+
+    psm = request.args.get('psm', 'valor')
+    if key == 'prod_month':
+        panel = page_products(panel, psm, limit=PRODUCTS_PAGE)
+    args_psm = dict(request.args.to_dict(), psm='qtd' if psm == 'valor' else 'valor')
+    return render_template(
+        PANEL_TEMPLATES[name],
+        **{f'{key}_panel': panel},
+        psm=psm,
+        toggle_psm_url=url_for('index', **args_psm),
+        stale={k: fmt_br_min(v) for k, v in account().stale.items()},
+    )
+
 
-    # render com ctx (seja cache ou novo)
+@app.route('/panel/prod_month/more')
+def products_more():
+    """Próxima página da tabela de produtos do mês (linhas <tr>), a partir do cursor `after`."""
+    psm = request.args.get('psm', 'valor')
+    after = parse_products_cursor(request.args.get('after', ''))
+    if after is None:
+        return Response('', status=400)
+    scope = 'all' if request.args.get('scope') == 'all' else None
+    if scope:
+        contas = [a for a in ACCOUNTS.values() if connected(a)]
+        if not contas:
+            return Response('', status=401)
+        panel = merge_panels('prod_month', [cached_panel('prod_month', a) for a in contas])
+    else:
+        if not connected():
+            return Response('', status=401)
+        panel = cached_panel('prod_month')
+    return render_template('partials/prod_month_rows.html',
+                           prod_month_panel=page_products(panel, psm, after=after, limit=PRODUCTS_PAGE),
+                           psm=psm, prod_scope=scope)
+
+
+# ======== VISÃO CONSOLIDADA (todas as empresas conectadas) ========
+@app.route('/consolidated')
+def consolidated():
+    contas = [a for a in ACCOUNTS.values() if connected(a)]
+    if not contas:
+        return redirect(url_for('index'))
+    psm = request.args.get('psm', 'valor')
+
+    # as empresas sincronizam ao mesmo tempo no pool, cada painel no contexto da sua conta
+    jobs = {(a.key, name): submit_panel(name, detached_api(a), acc=a) for a in contas for name in MONTH_PANELS}
+    wait(list(jobs.values()), timeout=PANEL_WAIT)
+    by_account, pendentes = {}, []
+    for (key, name), job in jobs.items():
+        acc = ACCOUNTS[key]
+        if job.done() and job.exception() is None:
+            panel = job.result()[0]
+        else:
+            panel = cached_panel(name, acc)
+            if not job.done() and acc.label not in pendentes:
+                pendentes.append(acc.label)
+        by_account.setdefault(key, {})[name] = panel
+
+    panels = {name: merge_panels(name, [by_account[a.key][name] for a in contas]) for name in MONTH_PANELS}
+    panels['prod_month'] = page_products(panels['prod_month'], psm, limit=PRODUCTS_PAGE)
+    resumo = [{'empresa': a.label, 'qtd': by_account[a.key]['month_status']['total_qtd'],
+               'valor': by_account[a.key]['month_status']['total_valor']} for a in contas]
+    stale = {}
+    for a in contas:
+        for k, v in a.stale.items():
+            stale.setdefault(k, fmt_br_min(v))
+    if pendentes:
+        flash('Ainda montando os painéis de: ' + ', '.join(pendentes) + '. Recarregue em instantes.', 'info')
+
+    args_psm = dict(request.args.to_dict(), psm='qtd' if psm == 'valor' else 'valor')
     return render_template(
-        'index.html',
+        'consolidated.html',
         conectado=True,
-        pedidos=ctx['pedidos'],
-        vendor_panels=ctx['vendor_panels'],
-        totais=ctx['totais'],
-        periodo=ctx['periodo'],
-        month_status_panel=ctx['month_status_panel'],
-        month_vendor_panel=ctx['month_vendor_panel'],
-        month_day_panel=ctx['month_day_panel'],
-        prod_day_panel=ctx['prod_day_panel'],
-        prod_month_panel=ctx['prod_month_panel'],
-        filtros={
-            'situacao': request.args.get('situacao', ''),
-            'data_ini': request.args.get('data_ini', ''),
-            'data_fim': request.args.get('data_fim', '')
-        },
-        last_updated=ctx['last_updated'],
-        graf_labels_json=ctx.get('graf_labels_json', '[]'),
-        graf_values_json=ctx.get('graf_values_json', '[]'),
-        psd=ctx.get('psd', 'valor'),
-        psm=ctx.get('psm', 'valor'),
-        toggle_psd_url=ctx.get('toggle_psd_url', url_for('index')),
-        toggle_psm_url=ctx.get('toggle_psm_url', url_for('index')),
-        buscar_analise_url=ctx.get('buscar_analise_url', url_for('index')),
-        buscar_analise=ctx.get('buscar_analise', False),
+        resumo=resumo,
+        nao_conectadas=[a.label for a in ACCOUNTS.values() if not connected(a)],
+        month_status_panel=panels['month_status'],
+        month_vendor_panel=panels['month_vendor'],
+        month_day_panel=panels['month_day'],
+        prod_month_panel=panels['prod_month'],
+        psm=psm,
+        prod_scope='all',
+        toggle_psm_url=url_for('consolidated', **args_psm),
+        stale=stale,
     )
 
 
+# ======== HISTÓRICO (qualquer período, a partir dos agregados diários locais) ========
+def history_presets(today):
+    """Atalhos de período: (rótulo, ini, fim)."""
+    m_ini = today.replace(day=1)
+    prev_fim = m_ini - timedelta(days=1)
+
+    def months_back(n):
+        y, m = divmod(m_ini.year * 12 + m_ini.month - 1 - n, 12)
+        return date(y, m + 1, 1)
+    return [
+        ('Mês atual', m_ini, today),
+        ('Mês passado', prev_fim.replace(day=1), prev_fim),
+        ('Últimos 3 meses', months_back(2), today),
+        ('Últimos 12 meses', months_back(11), today),
+    ]
+
+
+@app.route('/history')
+def history_view():
+    if not connected():
+        return redirect(url_for('index'))
+    acc = account()
+    today = br_now_saopaulo().date()
+    presets = history_presets(today)
+    try:
+        ini = datetime.strptime(request.args.get('data_ini', ''), '%Y-%m-%d').date()
+        fim = datetime.strptime(request.args.get('data_fim', ''), '%Y-%m-%d').date()
+    except ValueError:
+        _, ini, fim = presets[1]
+    if ini > fim:
+        ini, fim = fim, ini
+    psm = request.args.get('psm', 'valor')
+
+    refdata = acc.refdata
+    # mês fechado inteiro e arquivado: lê as colunas do arquivo
+    ym = f'{ini:%Y-%m}'
+    arquivado = closed_month(ym) == (ini, fim) and archived_panels(ym) is not None
+    with timing.stage('history'):
+        if arquivado:
+            panels = archived_panels(ym)
+        else:
+            panels = acc.history.panels(to_iso(ini), to_iso(fim), refdata.status_name, refdata.vendor_name,
+                                        refdata.vendor_names(),
+                                        lambda nome, sku: stable_id('ph', nome, sku))
+    args_psm = dict(request.args.to_dict(), psm='qtd' if psm == 'valor' else 'valor')
+    with timing.stage('render'):
+        return render_template(
+            'history.html',
+            conectado=True,
+            filtros={'data_ini': to_iso(ini), 'data_fim': to_iso(fim)},
+            presets=[(label, to_iso(a), to_iso(b)) for label, a, b in presets],
+            coverage=acc.history.coverage(),
+            arquivados=archive.months(acc.archive_dir),
+            arquivado=arquivado,
+            status_panel=panels['month_status'],
+            vendor_panel=panels['month_vendor'],
+            day_panel=panels['month_day'],
+            prod_panel=page_products(panels['prod_month'], psm),
+            psm=psm,
+            toggle_psm_url=url_for('history_view', **args_psm),
+        )
+
+
+# ======== EXPORTAÇÃO (CSV/XLSX por streaming) ========
+EXPORTS = ('pedidos', 'itens') + tuple(MONTH_PANELS)
+
+
+def export_margins():
+    """Mapa de margens da planilha de análise, ou None (sem planilha ou planilha fora do ar)."""
+    sheet_url = get_analysis_sheet_url()
+    if not sheet_url:
+        return None
+    try:
+        return margin_map_cached(sheet_url)
+    except Exception:
+        return None
+
+
+def export_table(client, what, ym=None):
+    """
+    (cabeçalho, gerador de linhas) de pedidos, itens ou um painel do mês da conta
+    atual; com `ym` ('AAAA-MM'), do mês fechado arquivado, sem chamar o Bling.
+    """
+    acc = account()
+    margins = export_margins()
+    if ym:
+        arc = month_archive(ym)
+        if arc is None:
+            raise ValueError(f'mês {ym} não arquivado')
+        if what in MONTH_PANELS:
+            return exporter.panel_table(what, archived_panels(ym)[what], margins)
+        contribs = arc.contributions()
+    elif what in MONTH_PANELS:
+        return exporter.panel_table(what, _panel_job(what, client)[0], margins)
+    else:
+        m_ini, m_fim = month_bounds_today()
+        month_version(client, m_ini, m_fim)
+        contribs = month_aggregates(client, m_ini, m_fim).contributions()
+    refdata = acc.refdata
+    if what == 'pedidos':
+        return exporter.orders_table(contribs, refdata.status_name, refdata.vendor_name, margins)
+    return exporter.items_table(contribs, refdata.status_name, margins)
+
+
+@app.route('/export/<what>.<fmt>')
+def export_view(what, fmt):
+    if what not in EXPORTS or fmt not in exporter.MIMETYPES:
+        return Response('Exportação desconhecida.', status=404)
+    if not connected():
+        return redirect(url_for('index'))
+    ym = request.args.get('mes') or None     # mês fechado arquivado
+    try:
+        with timing.stage('export'):
+            # painel vencido revalida numa thread (serve_panel), fora do request: token copiado
+            client = detached_api() if what in MONTH_PANELS else api()
+            header, rows = export_table(client, what, ym)
+    except Exception as e:
+        flash(f'Falha ao exportar: {e}', 'danger')
+        return redirect(url_for('index'))
+    # o arquivo é gerado enquanto é enviado: as linhas não ficam todas na memória
+    name = f'{what}-{account().key}-{ym or format(month_bounds_today()[0], "%Y-%m")}.{fmt}'
+    return Response(exporter.stream(fmt, header, rows, sheet=what), mimetype=exporter.MIMETYPES[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+
+# ======== WEBHOOK DO BLING (pedidos de venda) ========
+@app.route('/webhooks/bling', methods=['POST'])
+def bling_webhook():
+    body = request.get_data()
+    # a assinatura diz de qual empresa é o evento (cada app do Bling tem seu client secret)
+    signature = request.headers.get(SIGNATURE_HEADER)
+    acc = next((a for a in ACCOUNTS.values() if verify_webhook(a.client_secret, body, signature)), None)
+    if acc is None:
+        metrics.WEBHOOK_EVENTS.inc('-', 'unauthorized')
+        return Response('invalid signature\n', status=401, mimetype='text/plain')
+    result = acc.webhooks.handle(body)
+    try:
+        event = json.loads(body).get('event') or '-'
+    except Exception:
+        event = '-'
+    metrics.WEBHOOK_EVENTS.inc(event, result)
+    return {'result': result}, (400 if result == 'invalid' else 200)
+
+
 # ======== CONFIGURAÇÕES (URL PLANILHA) ========
 @app.route('/config', methods=['GET', 'POST'])
 def config_view():
-    if not session.get('bling_token'):
+    if not connected():
         return redirect(url_for('index'))
 
     current_url = get_analysis_sheet_url() or ''
@@ -1127,23 +1503,58 @@ def config_view():
     )
 
 
+# ======== MÉTRICAS (Prometheus) ========
+@app.route('/metrics')
+def metrics_view():
+    # expõe cota por empresa, rotas e webhooks: sem METRICS_TOKEN fica desligado
+    token = os.getenv('METRICS_TOKEN', '')
+    if not token:
+        return Response('metrics disabled (set METRICS_TOKEN)\n', status=404, mimetype='text/plain')
+    if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return Response('unauthorized\n', status=401, mimetype='text/plain')
+    return Response(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@app.route('/quota')
+def quota_view():
+    if not connected():
+        return redirect(url_for('index'))
+    quota = account().quota
+    quota.flush()
+    return quota.snapshot()
+
+
 # ======== AUXILIARES UI ========
 @app.route('/api-fields')
 def api_fields():
-    raw = session.get('last_raw_json')
-    if not raw:
+    # ?pedido=<id> mostra outro pedido da página (enquanto estiver no arquivo de payloads brutos)
+    oid = request.args.get('pedido') or session.get('last_raw_order')
+    raw = account().raw_archive.get(oid) if oid else None
+    if raw is None:
         flash('Nenhum pedido carregado ainda.', 'warning')
         return redirect(url_for('index'))
-    try:
-        pretty = json.dumps(json.loads(raw), ensure_ascii=False, indent=2)
-    except Exception:
-        pretty = raw
-    return render_template('api_fields.html', pretty=pretty, conectado=True)
+    pretty = json.dumps(raw, ensure_ascii=False, indent=2)
+    return render_template('api_fields.html', pretty=pretty, pedido=oid, conectado=True)
 
 
 @app.route('/login')
 def login():
-    return redirect(api().auth_url())
+    acc = ACCOUNTS.get(request.args.get('account', '')) or account()
+    session['account'] = acc.key
+    # a empresa volta no state para o callback trocar o código com o app certo
+    return redirect(api(acc).auth_url(state=f'ablingv1:{acc.key}'))
+
+
+@app.route('/account/<key>')
+def switch_account(key):
+    acc = ACCOUNTS.get(key)
+    if acc is None:
+        flash('Empresa desconhecida.', 'warning')
+        return redirect(url_for('index'))
+    session['account'] = acc.key
+    if not connected(acc):
+        return redirect(url_for('login', account=acc.key))
+    return redirect(url_for('index'))
 
 
 @app.route('/callback')
@@ -1156,9 +1567,12 @@ def callback():
     if not code:
         flash('Código ausente.', 'danger')
         return redirect(url_for('index'))
+    key = request.args.get('state', '').partition(':')[2]
+    acc = ACCOUNTS.get(key) or account()
+    session['account'] = acc.key
     try:
-        api().exchange_code(code)
-        flash('Conectado ao Bling com sucesso!', 'success')
+        api(acc).exchange_code(code)
+        flash(f'{acc.label} conectada ao Bling com sucesso!', 'success')
     except Exception as e:
         flash(f'Falha ao trocar código por token: {e}', 'danger')
     return redirect(url_for('index'))
@@ -0,0 +1,160 @@
+"""
+Arquivo colunar dos meses fechados (um diretório por mês, escrito uma vez).
+
+Mês fechado não muda na prática: em vez de buscar de novo no Bling ou
+reler JSON, os pedidos e itens do mês ficam em colunas binárias (array
+do Python, ordem de bytes nativa) abertas com mmap e lidas como
+memoryview, sem cópia:
+
+  pedidos: dia (ordinal da data), sid, vid, parcial, valor, item_ini
+           (deslocamento dos itens do pedido: pedido i tem os itens
+           item_ini[i]..item_ini[i+1])
+  itens:   item_prod (índice em produtos), item_qtd, item_valor
+
+Textos (ids, números, produtos (nome, sku)) ficam uma vez só em meta.json.
+A escrita vai para um diretório temporário renomeado no fim: um mês está
+arquivado ou não, nunca pela metade.
+
+O formato é só da biblioteca padrão (o projeto não depende de
+pyarrow/numpy); as colunas seguem o layout de memória de um array NumPy
+do mesmo tipo.
+"""
+from __future__ import annotations
+import json
+import mmap
+import os
+import shutil
+import sys
+import time
+from array import array
+from datetime import date
+
+FORMAT = 1
+COLUMNS = {     # nome -> typecode do array
+    'dia': 'i', 'sid': 'q', 'vid': 'q', 'parcial': 'b', 'valor': 'd', 'item_ini': 'q',
+    'item_prod': 'i', 'item_qtd': 'd', 'item_valor': 'd',
+}
+
+
+def month_dir(root, ym) -> str:
+    return os.path.join(root, ym)
+
+
+def exists(root, ym) -> bool:
+    return os.path.isfile(os.path.join(month_dir(root, ym), 'meta.json'))
+
+
+def months(root) -> list:
+    """Meses arquivados ('AAAA-MM'), mais recentes primeiro."""
+    try:
+        return sorted((d for d in os.listdir(root) if exists(root, d)), reverse=True)
+    except OSError:
+        return []
+
+
+def write(root, ym, period, contribs) -> dict:
+    """
+    Grava o mês `ym` a partir de [(oid, contribuição)] (formato dos agregados do mês),
+    na ordem recebida. Devolve o meta; FileExistsError se o mês já estiver arquivado.
+    """
+    final = month_dir(root, ym)
+    if exists(root, ym):
+        raise FileExistsError(final)
+    cols = {name: array(tc) for name, tc in COLUMNS.items()}
+    ids, numeros, produtos, prod_ix = [], [], [], {}
+    cols['item_ini'].append(0)
+    for oid, c in contribs:
+        ids.append(str(oid))
+        numeros.append(str(c['numero']))
+        cols['dia'].append(date.fromisoformat(c['dia']).toordinal())
+        cols['sid'].append(c['sid'] or 0)
+        cols['vid'].append(c['vid'] or 0)
+        cols['parcial'].append(1 if c['partial'] else 0)
+        cols['valor'].append(float(c['valor']))
+        for key, q, v in c['items']:
+            ix = prod_ix.get(key)
+            if ix is None:
+                ix = prod_ix[key] = len(produtos)
+                produtos.append(list(key))
+            cols['item_prod'].append(ix)
+            cols['item_qtd'].append(float(q))
+            cols['item_valor'].append(float(v))
+        cols['item_ini'].append(len(cols['item_prod']))
+
+    meta = {'formato': FORMAT, 'mes': ym, 'periodo': list(period), 'byteorder': sys.byteorder,
+            'pedidos': len(ids), 'itens': len(cols['item_prod']), 'criado_em': int(time.time()),
+            'ids': ids, 'numeros': numeros, 'produtos': produtos}
+    os.makedirs(root, exist_ok=True)
+    tmp = f'{final}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    for name, arr in cols.items():
+        with open(os.path.join(tmp, f'{name}.{COLUMNS[name]}'), 'wb') as f:
+            arr.tofile(f)
+    with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+    try:
+        os.rename(tmp, final)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise FileExistsError(final)
+    return meta
+
+
+class MonthArchive:
+    """Leitura de um mês arquivado: cada coluna é uma memoryview sobre o arquivo mapeado."""
+
+    def __init__(self, root, ym):
+        self.path = month_dir(root, ym)
+        with open(os.path.join(self.path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('formato') != FORMAT:
+            raise ValueError(f'formato de arquivo desconhecido em {self.path}')
+        self.ym = ym
+        self.period = tuple(self.meta['periodo'])
+        self.ids, self.numeros = self.meta['ids'], self.meta['numeros']
+        self.produtos = [tuple(p) for p in self.meta['produtos']]
+        self._maps = []
+        self.columns = {name: self._column(name, tc) for name, tc in COLUMNS.items()}
+
+    def _column(self, name, tc):
+        fn = os.path.join(self.path, f'{name}.{tc}')
+        if self.meta.get('byteorder') != sys.byteorder:
+            # gravado em outra arquitetura: cópia com os bytes trocados
+            arr = array(tc)
+            with open(fn, 'rb') as f:
+                arr.frombytes(f.read())
+            arr.byteswap()
+            return memoryview(arr)
+        if os.path.getsize(fn) == 0:
+            return memoryview(array(tc))
+        with open(fn, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps.append(mm)
+        return memoryview(mm).cast(tc)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def nbytes(self) -> int:
+        return sum(v.nbytes for v in self.columns.values())
+
+    def close(self) -> None:
+        for v in self.columns.values():
+            v.release()
+        for mm in self._maps:
+            mm.close()
+        self._maps = []
+
+    def contributions(self):
+        """(oid, contribuição) no formato dos agregados do mês, na ordem gravada."""
+        c = self.columns
+        dia, sid, vid, parcial, valor, ini = c['dia'], c['sid'], c['vid'], c['parcial'], c['valor'], c['item_ini']
+        prod, qtd, val = c['item_prod'], c['item_qtd'], c['item_valor']
+        produtos = self.produtos
+        for i, oid in enumerate(self.ids):
+            d = date.fromordinal(dia[i])
+            items = [(produtos[prod[j]], qtd[j], val[j]) for j in range(ini[i], ini[i + 1])]
+            yield oid, {'sid': sid[i] or None, 'dia': d.isoformat(), 'data_br': d.strftime('%d/%m/%y'),
+                        'numero': self.numeros[i], 'valor': valor[i], 'vid': vid[i] or None, 'items': items,
+                        'partial': bool(parcial[i]), 'fp': None}
@@ -0,0 +1,310 @@
+"""
+Backfill do histórico (history.py): pedidos e detalhes de períodos antigos.
+
+- O período é dividido em janelas de datas (--window dias), processadas
+  em paralelo (--workers); cada janela lista as páginas de /pedidos/vendas
+  e busca o detalhe (itens, vendedor) de cada pedido com get_sale.
+- Todas as chamadas passam por um limitador comum (--rps por segundo),
+  abaixo do limite do Bling, para sobrar vazão para o dashboard.
+- Cota: o backfill para quando o que ele já gastou hoje (origens com a
+  etapa "backfill" em quota.json, como cli-archive/backfill, somando
+  execuções anteriores) chega a --share
+  do limite diário, ou quando o nível da cota sai de "ok" — o dashboard
+  nunca é empurrado para o modo degradado por causa dele.
+- Janelas não cruzam meses; as de meses já arquivados (archive.py) são
+  puladas.
+- Checkpoint: cada janela concluída fica em <cache da conta>/backfill.json;
+  rodar de novo com o mesmo período retoma das janelas pendentes. Janela
+  com pedido sem detalhe (429/5xx mesmo depois das novas tentativas) não
+  conta como concluída. Pedidos
+  que já estão completos no histórico com a mesma impressão digital não
+  têm o detalhe buscado de novo.
+
+Sem navegador, o token vem do arquivo da conta (tokens.json no cache,
+gravado no login pelo navegador) ou de --tokens; só é renovado com
+--refresh (o token novo volta para o arquivo e a sessão do navegador o
+adota).
+
+  python backfill.py 2024-01-01 2024-12-31
+  python backfill.py 2023-01-01 2024-12-31 --account empresa2 --workers 4 --rps 1.5
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import date, timedelta
+
+import accounts
+import archive
+import timing
+from bling import CircuitOpen
+from config import settings
+from contributions import order_contribution   # as mesmas regras dos painéis do mês
+from order_store import order_fingerprint
+from quota import QuotaExceeded
+
+ORIGIN = 'backfill'
+
+
+class Stop(RuntimeError):
+    """Limite de cota do backfill atingido (ou interrupção): o restante fica para a próxima execução."""
+
+
+def _month_end(d: date) -> date:
+    return (d.replace(day=28) + timedelta(days=4)).replace(day=1) - timedelta(days=1)
+
+
+def windows(ini: date, fim: date, days: int) -> list:
+    """[(ini, fim)] ISO de até `days` dias cobrindo [ini, fim], sem cruzar meses, mais recentes primeiro."""
+    out, d = [], ini
+    while d <= fim:
+        end = min(d + timedelta(days=days - 1), _month_end(d), fim)
+        out.append((d.isoformat(), end.isoformat()))
+        d = end + timedelta(days=1)
+    out.reverse()
+    return out
+
+
+class RateLimiter:
+    """Balde de fichas compartilhado pelas threads: no máximo `rps` chamadas por segundo."""
+
+    def __init__(self, rps, burst=1):
+        self.interval = 1.0 / rps if rps > 0 else 0.0
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._next = time.monotonic()
+
+    def wait(self) -> None:
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            at = max(self._next, now - self.interval * (self.burst - 1))
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+
+class Throttled:
+    """Cliente do backfill: limita a vazão, respeita a parte da cota e conta as chamadas."""
+
+    def __init__(self, client, quota, limiter, share, stop):
+        self.client, self.quota, self.limiter = client, quota, limiter
+        self.budget = int(quota.daily_limit * share)
+        self.stop = stop
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def used(self) -> int:
+        # a etapa pode vir sob um timer de fora (abling archive: cli-archive/backfill)
+        return sum(n for k, n in self.quota.snapshot()['by_origin'].items() if ORIGIN in k.split('/'))
+
+    def _before(self):
+        if self.stop.is_set():
+            raise Stop('interrompido')
+        if self.quota.level() != 'ok':
+            raise Stop(f'cota do Bling em nível {self.quota.level()}; o restante fica para depois')
+        if self.used() >= self.budget:
+            raise Stop(f'parte da cota do backfill esgotada hoje ({self.budget} chamadas)')
+        self.limiter.wait()
+        with self._lock:
+            self.calls += 1
+
+    def _call(self, fn, *a, **kw):
+        for attempt in range(6):
+            self._before()
+            try:
+                return fn(*a, **kw)
+            except CircuitOpen:
+                # Bling falhando (5xx, 429): espera o disjuntor e tenta de novo
+                time.sleep(min(2 ** attempt, 30))
+        raise Stop('Bling indisponível')
+
+    def list_sales(self, *a, **kw):
+        return self._call(self.client.list_sales, *a, **kw)
+
+    def get_sale(self, pid, attempts=4):
+        # get_sale devolve None também em 429/5xx (não levanta): tenta de novo com espera
+        for attempt in range(attempts):
+            det = self._call(self.client.get_sale, pid)
+            if det is not None or attempt == attempts - 1:
+                return det
+            if self.stop.wait(min(2 ** attempt, 30)):
+                raise Stop('interrompido')
+        return None
+
+
+# ---------- checkpoint ----------
+class Checkpoint:
+    def __init__(self, path, ini, fim, window):
+        self.path = path
+        self.key = {'ini': ini, 'fim': fim, 'window': window}
+        self._lock = threading.Lock()
+        self.done = {}      # ini da janela -> pedidos gravados
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+            if all(raw.get(k) == v for k, v in self.key.items()):
+                self.done = dict(raw.get('done') or {})
+        except (OSError, ValueError):
+            pass
+
+    def mark(self, w_ini, n) -> None:
+        with self._lock:
+            self.done[w_ini] = n
+            raw = dict(self.key, done=self.done)
+            tmp = f'{self.path}.{os.getpid()}.tmp'
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(raw, f)
+            os.replace(tmp, self.path)
+
+
+# ---------- janelas ----------
+def _window(client, acc, w_ini, w_fim, page_size=100):
+    """
+    Lista e detalha os pedidos de uma janela e grava no histórico.
+    Devolve (pedidos, gravados, parciais): parciais são os que ficaram sem detalhe.
+    """
+    d_ini, d_fim = date.fromisoformat(w_ini), date.fromisoformat(w_fim)
+    known = acc.history.known(w_ini, w_fim)
+    rows, pagina = {}, 1
+    while True:
+        data = client.list_sales(w_ini, w_fim, None, pagina=pagina, limite=page_size).get('data') or []
+        for r in data:
+            rid = r.get('id') or r.get('numero')
+            if rid is not None:
+                rows.setdefault(str(rid), r)
+        if len(data) < page_size:
+            break
+        pagina += 1
+
+    entries, parciais = [], 0
+    for oid, r in rows.items():
+        old = known.get(oid)
+        if old and old[0] == repr(order_fingerprint(r)) and not old[1]:
+            continue    # já completo e sem alteração desde então
+        det = client.get_sale(oid)
+        merged = dict(r, itens=det.get('itens') or [], vendedor=det.get('vendedor') or r.get('vendedor')) if det else r
+        c = order_contribution(client, merged, d_ini, d_fim, acc, fetch=False)
+        if c is None:
+            continue
+        if det:
+            c['partial'] = False    # detalhe veio (pedido sem itens continua completo)
+        parciais += bool(c['partial'])
+        entries.append((oid, c))
+    return len(rows), acc.history.put_many(entries), parciais
+
+
+def run(client, acc, ini, fim, window=7, workers=4, rps=1.0, share=0.3, progress=print, every=10.0):
+    """
+    Backfill de [ini, fim] (date) da conta `acc` com `client` (BlingAPI ou equivalente).
+    Devolve as estatísticas; janelas não concluídas ficam no checkpoint para a próxima execução.
+    """
+    ck = Checkpoint(os.path.join(acc.cache_dir, 'backfill.json'), ini.isoformat(), fim.isoformat(), window)
+    # meses arquivados (archive.py) estão completos: nada a buscar no Bling
+    todo = [w for w in windows(ini, fim, window)
+            if w[0] not in ck.done and not archive.exists(acc.archive_dir, w[0][:7])]
+    stop = threading.Event()
+    tc = Throttled(client, acc.quota, RateLimiter(rps), share, stop)
+    stats = {'windows': len(todo), 'done': 0, 'orders': 0, 'written': 0, 'skipped_windows': len(ck.done),
+             'partial': 0, 'stopped': None}
+    t0 = last = time.perf_counter()
+
+    def job(w_ini, w_fim):
+        with timing.stage(ORIGIN):
+            return _window(tc, acc, w_ini, w_fim)
+
+    def report(final=False):
+        dt = max(time.perf_counter() - t0, 1e-9)
+        progress(f"{'fim' if final else '...'} janelas {stats['done']}/{stats['windows']}  "
+                 f"pedidos {stats['orders']} (gravados {stats['written']}, sem detalhe {stats['partial']})  "
+                 f"chamadas {tc.calls}  "
+                 f"{stats['orders'] / dt:.1f} pedidos/s  {tc.calls / dt:.2f} chamadas/s")
+
+    pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='backfill')
+    try:
+        futs = {pool.submit(accounts.context(acc).run, job, *w): w for w in todo}
+        for fut in as_completed(futs):
+            try:
+                n, written, parciais = fut.result()
+            except (Stop, QuotaExceeded) as e:
+                stop.set()
+                stats['stopped'] = stats['stopped'] or str(e)
+                continue
+            except Exception as e:
+                # erro do Bling (ex.: 401, token expirado): para tudo; a janela fica pendente
+                stop.set()
+                stats['stopped'] = stats['stopped'] or f'janela {futs[fut][0]}: {e}'
+                continue
+            stats['orders'] += n
+            stats['written'] += written
+            if parciais:
+                # pedidos sem detalhe (ex.: 429 persistente): a janela fica pendente para a próxima execução
+                stats['partial'] += parciais
+                continue
+            ck.mark(futs[fut][0], n)
+            stats['done'] += 1
+            if time.perf_counter() - last >= every:
+                last = time.perf_counter()
+                report()
+    except KeyboardInterrupt:
+        stop.set()
+        stats['stopped'] = 'interrompido'
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        acc.quota.flush()
+    stats['calls'] = tc.calls
+    stats['secs'] = round(time.perf_counter() - t0, 2)
+    report(final=True)
+    return stats
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Backfill do histórico de pedidos a partir do Bling.')
+    ap.add_argument('ini', type=date.fromisoformat, help='data inicial (AAAA-MM-DD)')
+    ap.add_argument('fim', type=date.fromisoformat, help='data final (AAAA-MM-DD)')
+    ap.add_argument('--account', default=settings.ACCOUNTS[0]['key'], help='empresa (padrão: a primeira)')
+    ap.add_argument('--window', type=int, default=int(os.getenv('BACKFILL_WINDOW', '7')), help='dias por janela')
+    ap.add_argument('--workers', type=int, default=int(os.getenv('BACKFILL_WORKERS', '4')))
+    ap.add_argument('--rps', type=float, default=float(os.getenv('BACKFILL_RPS', '1.0')),
+                    help='chamadas por segundo (o Bling aceita 3 por empresa; o resto fica para o dashboard)')
+    ap.add_argument('--share', type=float, default=float(os.getenv('BACKFILL_SHARE', '0.3')),
+                    help='fração da cota diária que o backfill pode usar')
+    ap.add_argument('--tokens', help='arquivo JSON com o token (padrão: tokens.json no cache da conta)')
+    ap.add_argument('--refresh', action='store_true', help='renova o token quando expirar')
+    ap.add_argument('--reset', action='store_true', help='ignora o checkpoint e começa do zero')
+    args = ap.parse_args(argv)
+
+    import app
+    acc = app.ACCOUNTS.get(args.account)
+    if acc is None:
+        ap.error(f'empresa desconhecida: {args.account}')
+    accounts.use(acc)
+    if args.reset:
+        try:
+            os.remove(os.path.join(acc.cache_dir, 'backfill.json'))
+        except OSError:
+            pass
+    try:
+        client = app.server_api(acc, tokens=args.tokens, refresh=args.refresh)
+    except RuntimeError as e:
+        print(e)
+        return 1
+    stats = run(client, acc, args.ini, args.fim, window=args.window, workers=args.workers,
+                rps=args.rps, share=args.share)
+    if stats['stopped']:
+        print('parado:', stats['stopped'], '— rode de novo para continuar')
+        return 2
+    if stats['partial']:
+        print(f"{stats['partial']} pedidos sem detalhe — as janelas deles ficaram pendentes; rode de novo")
+        return 2
+    print('histórico:', acc.history.coverage())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
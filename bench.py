@@ -0,0 +1,195 @@
+"""
+Benchmarks do pipeline do dashboard contra um cliente Bling simulado.
+
+Gera pedidos sintéticos (fake_bling.synth_orders) para o mês atual e mede,
+frio (caches vazios) e quente (segunda chamada):
+  build_month_status_panel, build_month_vendor_panel, build_month_day_panel,
+  build_products_month_panel, build_daily_panels, build_products_today_panel
+  e a renderização completa de `index`,
+com tempo, pico de memória (tracemalloc) e número de chamadas ao Bling.
+
+Uso:
+  python bench.py                         # 1k, 10k e 100k pedidos/mês
+  python bench.py --sizes 1000 --items 1 8 --json bench.json
+  python bench.py --baseline bench.json   # falha se regredir (tempo ou chamadas)
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+
+# caches persistentes do app vão para um diretório temporário
+os.environ.setdefault('ABLING_CACHE_DIR', tempfile.mkdtemp(prefix='abling-bench-'))
+
+import accounts  # noqa: E402
+import app  # noqa: E402
+from fake_bling import synth_orders, list_row  # noqa: E402
+
+
+class StubClient:
+    """Imita BlingAPI em memória e conta chamadas por método."""
+
+    def __init__(self, orders, latency_ms=0.0):
+        self.orders = sorted(orders, key=lambda o: (o['data'], o['id']), reverse=True)
+        self.by_id = {str(o['id']): o for o in orders}
+        self.latency = latency_ms / 1000.0
+        self.calls = Counter()
+        self.session = {'bling_token': {'access_token': 'bench'}}
+        self._filtered = {}
+
+    def _wait(self, name):
+        self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def list_sales(self, data_ini, data_fim, situacao=None, pagina=1, limite=50, **extra):
+        self._wait('list_sales')
+        key = (data_ini, data_fim, situacao, tuple(sorted(extra.items())))
+        rows = self._filtered.get(key)
+        if rows is None:
+            alt = extra.get('dataAlteracaoInicial') or ''
+            rows = [o for o in self.orders
+                    if data_ini <= o['data'] <= data_fim
+                    and (not situacao or str(o['situacao']['id']) == str(situacao))
+                    and (not alt or o['dataAlteracao'] >= alt)]
+            self._filtered[key] = rows
+        return {'data': [list_row(o) for o in rows[(pagina - 1) * limite: pagina * limite]]}
+
+    def get_sale(self, pid):
+        self._wait('get_sale')
+        o = self.by_id.get(str(pid))
+        return json.loads(json.dumps(o)) if o else None
+
+    def list_situation_modules(self):
+        self._wait('refdata')
+        return []
+
+    def list_vendors(self):
+        self._wait('refdata')
+        return []
+
+    def list_payment_methods(self):
+        self._wait('refdata')
+        return []
+
+
+def reset_caches():
+    acc = app.account()
+    fresh = app.ACCOUNTS[acc.key] = acc.fresh(tempfile.mkdtemp(prefix='abling-bench-'))
+    # o before_request do test client deixa a conta antiga na ContextVar desta thread
+    accounts.use(fresh)
+
+
+def measure(fn):
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = fn()
+    dt = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, dt, peak
+
+
+def run_size(n, items, latency_ms):
+    m_ini, m_fim = app.month_bounds_today()
+    days = (m_fim - m_ini).days + 1
+    orders = synth_orders(m_ini, m_fim, per_day=max(1, n // days), items=items, seed=n)
+    client = StubClient(orders, latency_ms)
+    app.api = lambda: client
+    app.detached_api = lambda: client
+    app.INDEX_BUDGET = 0    # mede a página completa, sem placeholders
+    d_ini, d_fim = app.default_dates()
+    results = []
+
+    def record(name, phase, fn):
+        before = sum(client.calls.values())
+        out, dt, peak = measure(fn)
+        results.append({'size': n, 'bench': name, 'phase': phase, 'ms': round(dt * 1000, 2),
+                        'peak_kb': round(peak / 1024, 1), 'bling_calls': sum(client.calls.values()) - before})
+        return out
+
+    def daily_rows():
+        resp = client.list_sales(app.to_iso(d_ini), app.to_iso(d_fim), None, pagina=1, limite=50)
+        return [app.enrich_order(client, p) for p in resp['data']]
+
+    builders = [
+        ('build_month_status_panel', lambda: app.build_month_status_panel(client)),
+        ('build_month_vendor_panel', lambda: app.build_month_vendor_panel(client)),
+        ('build_month_day_panel', lambda: app.build_month_day_panel(client)),
+        ('build_products_month_panel', lambda: app.build_products_month_panel(client)),
+    ]
+    reset_caches()
+    enriched = record('enrich_order (3 dias)', 'cold', daily_rows)
+    record('build_daily_panels', 'cold', lambda: app.build_daily_panels(enriched))
+    record('build_products_today_panel', 'cold', lambda: app.build_products_today_panel(enriched))
+    for name, fn in builders:
+        record(name, 'cold', fn)
+    store = app.account().orders
+    if store.truncated or len(store) != len(orders):
+        raise SystemExit(f'{n} pedidos: a cópia do mês tem {len(store)} de {len(orders)} (ORDERS_PAGE_LIMIT)')
+    for name, fn in builders:
+        record(name, 'warm', fn)
+
+    reset_caches()
+    with app.app.test_client() as tc:
+        with tc.session_transaction() as s:
+            s['bling_token'] = {'access_token': 'bench'}
+        for phase in ('cold', 'warm'):
+            r = record('index', phase, lambda: tc.get('/'))
+            if r.status_code != 200:
+                raise SystemExit(f'index respondeu {r.status_code}')
+    return results
+
+
+def compare(results, baseline, max_regress):
+    base = {(b['size'], b['bench'], b['phase']): b for b in baseline}
+    failures = []
+    for r in results:
+        b = base.get((r['size'], r['bench'], r['phase']))
+        if not b:
+            continue
+        if r['bling_calls'] > b['bling_calls']:
+            failures.append(f"{r['bench']} [{r['phase']}, {r['size']}]: chamadas {b['bling_calls']} -> {r['bling_calls']}")
+        if b['ms'] >= 5 and r['ms'] > b['ms'] * (1 + max_regress):
+            failures.append(f"{r['bench']} [{r['phase']}, {r['size']}]: {b['ms']} ms -> {r['ms']} ms")
+    return failures
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Benchmarks do dashboard ABLING.')
+    ap.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000], help='pedidos por mês')
+    ap.add_argument('--items', type=int, nargs=2, default=[1, 5], metavar=('MIN', 'MAX'), help='itens por pedido')
+    ap.add_argument('--latency-ms', type=float, default=0.0, help='latência simulada por chamada ao Bling')
+    ap.add_argument('--json', help='grava os resultados neste arquivo')
+    ap.add_argument('--baseline', help='compara com resultados gravados anteriormente')
+    ap.add_argument('--max-regress', type=float, default=0.25, help='tolerância de tempo (0.25 = +25%%)')
+    args = ap.parse_args(argv)
+
+    results = []
+    for n in args.sizes:
+        results.extend(run_size(n, tuple(args.items), args.latency_ms))
+
+    print(f"{'pedidos':>8}  {'benchmark':<28} {'fase':<5} {'ms':>10} {'pico KB':>10} {'Bling':>6}")
+    for r in results:
+        print(f"{r['size']:>8}  {r['bench']:<28} {r['phase']:<5} {r['ms']:>10.2f} {r['peak_kb']:>10.1f} {r['bling_calls']:>6}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            failures = compare(results, json.load(f), args.max_regress)
+        for msg in failures:
+            print('REGRESSÃO:', msg)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
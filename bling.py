@@ -1,17 +1,151 @@
-import time, os, requests
+import time, os, json, threading, requests
 from base64 import b64encode
+import timing, metrics
+from quota import QUOTA
 
-AUTH_URL='https://www.bling.com.br/b/Api/v3/oauth/authorize'
-TOKEN_URL='https://www.bling.com.br/b/Api/v3/oauth/token'
-API_BASE='https://api.bling.com.br/Api/v3'
+# sobrescrevíveis por env para apontar para o fake_bling.py local
+AUTH_URL=os.getenv('BLING_AUTH_URL','https://www.bling.com.br/b/Api/v3/oauth/authorize')
+TOKEN_URL=os.getenv('BLING_TOKEN_URL','https://www.bling.com.br/b/Api/v3/oauth/token')
+API_BASE=os.getenv('BLING_API_BASE','https://api.bling.com.br/Api/v3')
 
 def _basic_auth_header(cid, csec):
     return "Basic " + b64encode(f"{cid}:{csec}".encode()).decode()
 
+class Recorder:
+    """Grava pares requisição/resposta em JSONL (BLING_RECORD=caminho) para replay no fake_bling.py."""
+    SECRET_KEYS=('access_token','refresh_token','code')
+    def __init__(self, path):
+        self.path=path; self._lock=threading.Lock()
+        d=os.path.dirname(path)
+        if d: os.makedirs(d, exist_ok=True)
+
+    def _redact(self, obj):
+        if isinstance(obj, dict):
+            return {k:('***' if k in self.SECRET_KEYS else v) for k,v in obj.items()}
+        return obj
+
+    def record(self, method, path, params, resp, elapsed):
+        # gravação é diagnóstico: disco cheio ou corpo não serializável não pode derrubar a chamada ao Bling
+        try:
+            try: body=resp.json()
+            except Exception: body=resp.text
+            line=json.dumps({'ts':round(time.time(),3),'method':method,'path':path,'params':self._redact(params or {}),
+                             'status':resp.status_code,'elapsed_ms':round(elapsed*1000,1),'body':self._redact(body)},
+                            ensure_ascii=False)
+            with self._lock:
+                with open(self.path,'a',encoding='utf-8') as f: f.write(line+'\n')
+        except Exception:
+            pass
+
+RECORDER=Recorder(os.getenv('BLING_RECORD')) if os.getenv('BLING_RECORD') else None
+
+# timeout (s) de leitura das chamadas à API; conexão sempre 5 s
+TIMEOUT=(5, float(os.getenv('BLING_TIMEOUT','20')))
+
+class TokenFile:
+    """
+    Armazém de tokens em arquivo JSON (no lugar da sessão do Flask) para jobs sem navegador.
+    Aceita {chave_do_token: token, ...} ou o próprio token ({'access_token': ...}); grava atômico, modo 600.
+    """
+    def __init__(self, path):
+        self.path=path; self._lock=threading.Lock(); self._mtime=None; self._data={}; self._flat=False
+        self._load()
+
+    def _load(self):
+        # relê quando outro processo (app ou CLI) gravou um token novo
+        try: mtime=os.stat(self.path).st_mtime_ns
+        except OSError: mtime=None
+        if mtime==self._mtime: return
+        try:
+            with open(self.path,'r',encoding='utf-8') as f: self._data=json.load(f)
+        except (OSError, ValueError): self._data={}
+        self._mtime=mtime
+        self._flat='access_token' in self._data   # arquivo com um único token
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._load()
+            if self._flat: return dict(self._data) if not key.endswith('_ts') else self._data.get('obtained_at', default)
+            return self._data.get(key, default)
+
+    def __getitem__(self, key):
+        v=self.get(key)
+        if v is None: raise KeyError(key)
+        return v
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._load()
+            if self._flat:
+                if key.endswith('_ts'): self._data['obtained_at']=value
+                else: self._data=dict(value, obtained_at=self._data.get('obtained_at'))
+            else: self._data[key]=value
+            d=os.path.dirname(self.path)
+            if d: os.makedirs(d, exist_ok=True)
+            tmp=f'{self.path}.{os.getpid()}.tmp'
+            with open(os.open(tmp, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o600),'w',encoding='utf-8') as f:
+                json.dump(self._data, f)
+            os.replace(tmp, self.path)
+            self._mtime=os.stat(self.path).st_mtime_ns
+
+class CircuitOpen(RuntimeError):
+    pass
+
+class CircuitBreaker:
+    """
+    Disjuntor compartilhado pelas instâncias de BlingAPI do processo.
+    Após `threshold` falhas seguidas (rede, 5xx, 429) abre por `cooldown` s
+    (ou pelo Retry-After do 429); depois deixa passar uma chamada de teste.
+    """
+    def __init__(self, threshold=5, cooldown=30.0, max_cooldown=300.0):
+        self.threshold=threshold; self.base_cooldown=cooldown; self.max_cooldown=max_cooldown
+        self.failures=0; self.open_until=0.0; self.cooldown=cooldown; self._trial=False
+        self._lock=threading.Lock()
+
+    def is_open(self):
+        return time.time()<self.open_until
+
+    def before(self):
+        with self._lock:
+            now=time.time()
+            if now<self.open_until:
+                raise CircuitOpen(f'Bling indisponível; nova tentativa em {int(self.open_until-now)+1}s.')
+            if self.failures>=self.threshold:
+                if self._trial:   # outra thread já está testando
+                    raise CircuitOpen('Bling indisponível; testando conexão.')
+                self._trial=True
+
+    def success(self):
+        with self._lock:
+            self.failures=0; self.open_until=0.0; self.cooldown=self.base_cooldown; self._trial=False
+
+    def failure(self, retry_after=None):
+        with self._lock:
+            self.failures+=1; self._trial=False
+            if retry_after:
+                self.open_until=max(self.open_until, time.time()+retry_after)
+            if self.failures>=self.threshold:
+                self.open_until=max(self.open_until, time.time()+self.cooldown)
+                self.cooldown=min(self.cooldown*2, self.max_cooldown)
+
+BREAKER=CircuitBreaker(threshold=int(os.getenv('BLING_BREAKER_THRESHOLD','5')),
+                       cooldown=float(os.getenv('BLING_BREAKER_COOLDOWN','30')))
+
+def _retry_after(r):
+    try: return float(r.headers.get('Retry-After') or 1)
+    except Exception: return 1.0
+
 class BlingAPI:
-    def __init__(self, client_id, client_secret, redirect_uri, session_store):
+    def __init__(self, client_id, client_secret, redirect_uri, session_store, can_refresh=True,
+                 token_key='bling_token', quota=None, breaker=None, token_file=None):
         self.client_id=client_id; self.client_secret=client_secret; self.redirect_uri=redirect_uri; self.session=session_store
-        os.makedirs('cache', exist_ok=True)
+        self.can_refresh=can_refresh  # clientes de threads em segundo plano não renovam o token
+        # cada empresa guarda o token na própria chave da sessão e tem cota e disjuntor próprios
+        self.token_key=token_key; self.quota=quota or QUOTA; self.breaker=breaker or BREAKER
+        self.token_file=token_file    # TokenFile: cópia no servidor dos tokens obtidos/renovados (CLI)
 
     def auth_url(self, state='ablingv1'):
         from urllib.parse import urlencode
@@ -20,30 +154,58 @@ class BlingAPI:
 
     def _post_token(self, data):
         headers={'Accept':'application/json','Content-Type':'application/x-www-form-urlencoded','Authorization':_basic_auth_header(self.client_id,self.client_secret)}
-        return requests.post(TOKEN_URL, data=data, headers=headers, timeout=30)
+        self.quota.account('oauth/token')
+        t0=time.perf_counter(); r=None
+        try:
+            r=requests.post(TOKEN_URL, data=data, headers=headers, timeout=30)
+        finally:
+            timing.record_call('/oauth/token', time.perf_counter()-t0, r.status_code if r is not None else 0)
+        if RECORDER: RECORDER.record('POST', '/oauth/token', {'grant_type':data.get('grant_type')}, r, time.perf_counter()-t0)
+        return r
 
     def exchange_code(self, code):
         r=self._post_token({'grant_type':'authorization_code','code':code,'redirect_uri':self.redirect_uri}); r.raise_for_status()
-        tok=r.json(); self.session['bling_token']=tok; self.session['bling_token_ts']=int(time.time()); return tok
+        tok=r.json(); self._store(tok); return tok
+
+    def _store(self, tok):
+        ts=int(time.time())
+        self.session[self.token_key]=tok; self.session[self.token_key+'_ts']=ts
+        if self.token_file is not None and self.token_file is not self.session:
+            self.token_file[self.token_key]=tok; self.token_file[self.token_key+'_ts']=ts
 
     def refresh_token(self):
-        tok=self.session.get('bling_token',{}); ref=tok.get('refresh_token')
-        if not ref: return None
+        tok=self.session.get(self.token_key,{}); ref=tok.get('refresh_token')
+        if not ref or not self.can_refresh: return None
         r=self._post_token({'grant_type':'refresh_token','refresh_token':ref})
+        metrics.TOKEN_REFRESHES.inc('ok' if r.status_code==200 else 'fail')
         if r.status_code!=200: return None
-        new=r.json(); self.session['bling_token']=new; self.session['bling_token_ts']=int(time.time()); return new
+        new=r.json(); self._store(new); return new
 
     def _auth(self):
-        tok=self.session.get('bling_token',{}).get('access_token')
+        tok=self.session.get(self.token_key,{}).get('access_token')
         return {'Authorization': f'Bearer {tok}','Accept':'application/json'} if tok else {'Accept':'application/json'}
 
     def _get(self, path, params=None):
-        import requests
-        return requests.get(API_BASE+path, headers=self._auth(), params=params or {}, timeout=60)
+        self.quota.check()  # levanta QuotaExceeded quando só resta a reserva
+        self.breaker.before()  # levanta CircuitOpen enquanto o Bling estiver falhando
+        self.quota.account(timing.current_origin())
+        t0=time.perf_counter(); r=None
+        try:
+            r=requests.get(API_BASE+path, headers=self._auth(), params=params or {}, timeout=TIMEOUT)
+        except requests.RequestException:
+            self.breaker.failure(); raise
+        finally:
+            timing.record_call(path, time.perf_counter()-t0, r.status_code if r is not None else 0)
+        if r.status_code==429: self.breaker.failure(_retry_after(r))
+        elif r.status_code>=500: self.breaker.failure()
+        else: self.breaker.success()
+        if RECORDER: RECORDER.record('GET', path, params, r, time.perf_counter()-t0)
+        return r
 
-    def list_sales(self, data_ini, data_fim, situacao=None, pagina=1, limite=50):
+    def list_sales(self, data_ini, data_fim, situacao=None, pagina=1, limite=50, **extra):
         q={'pagina':pagina,'limite':limite,'dataEmissao[ini]':data_ini,'dataEmissao[fim]':data_fim}
         if situacao: q['situacao']=situacao
+        q.update(extra)   # ex.: dataAlteracaoInicial (feed de alterações)
         r=self._get('/pedidos/vendas', q)
         if r.status_code==401 and self.refresh_token():
             r=self._get('/pedidos/vendas', q)
@@ -56,3 +218,29 @@ class BlingAPI:
         if r.status_code!=200: return None
         try: return r.json().get('data')
         except Exception: return None
+
+    def _get_json(self, path, params=None):
+        r=self._get(path, params)
+        if r.status_code==401 and self.refresh_token():
+            r=self._get(path, params)
+        r.raise_for_status(); return r.json()
+
+    def _list_all(self, path, limite=100, page_limit=20):
+        rows=[]
+        for pagina in range(1, page_limit+1):
+            data=self._get_json(path, {'pagina':pagina,'limite':limite}).get('data') or []
+            rows.extend(data)
+            if len(data)<limite: break
+        return rows
+
+    def list_situation_modules(self):
+        return self._get_json('/situacoes/modulos').get('data') or []
+
+    def list_situations(self, modulo_id):
+        return self._get_json(f'/situacoes/modulos/{modulo_id}').get('data') or []
+
+    def list_vendors(self):
+        return self._list_all('/vendedores')
+
+    def list_payment_methods(self):
+        return self._list_all('/formas-pagamentos')
@@ -5,6 +5,15 @@ class Settings:
     BLING_CLIENT_ID=os.getenv('BLING_CLIENT_ID','').strip()
     BLING_CLIENT_SECRET=os.getenv('BLING_CLIENT_SECRET','').strip()
     BLING_REDIRECT_URI=os.getenv('BLING_REDIRECT_URI','').strip()
+    # empresas (contas do Bling): BLING_* é a primeira; BLING2_* é opcional
+    ACCOUNTS=[a for a in (
+        {'key':'empresa1','label':os.getenv('BLING_LABEL','Empresa 1').strip(),
+         'client_id':BLING_CLIENT_ID,'client_secret':BLING_CLIENT_SECRET},
+        {'key':'empresa2','label':os.getenv('BLING2_LABEL','Empresa 2').strip(),
+         'client_id':os.getenv('BLING2_CLIENT_ID','').strip(),'client_secret':os.getenv('BLING2_CLIENT_SECRET','').strip()},
+    ) if a['key']=='empresa1' or a['client_id']]
     FLASK_SECRET_KEY=os.getenv('FLASK_SECRET_KEY','dev-secret')
     PORT=int(os.getenv('FLASK_RUN_PORT','5050'))
+    # caches persistentes (detalhes, índices, dados de referência)
+    CACHE_DIR=os.getenv('ABLING_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)),'cache')
 settings=Settings()
@@ -0,0 +1,67 @@
+"""
+Contribuição de um pedido para os agregados do mês (aggregates.py) e para
+o histórico (history.py).
+
+Compartilhado pelo app (painéis do mês) e pelo backfill, para os dois
+contarem pedidos com as mesmas regras sem que o backfill dependa do Flask
+nem da conta da requisição: a conta vem por parâmetro.
+"""
+from __future__ import annotations
+
+from bling import CircuitOpen
+from order_store import order_fingerprint
+from orders import br_dmy_short, first, normalize_item, parse_date, parse_qty, parse_total
+
+
+def order_contribution(client, r, m_ini, m_fim, acc, fetch=True, allow_fetch=True):
+    """
+    Contribuição de um pedido da listagem para os painéis do mês (None se
+    fora do mês). fetch=False não consulta detalhes: serve para status e
+    dias e deixa o pedido marcado como parcial (itens/vendedor pendentes).
+    allow_fetch=False usa só o cache de detalhes da conta (cota crítica).
+    """
+    d_raw = first(r, ['dataEmissao', 'data.emissao', 'data'])
+    d = parse_date(d_raw)
+    if not d or d < m_ini or d > m_fim:
+        return None
+
+    sid = first(r, ['situacao.id', 'idSituacao', 'geral.situacao.id'])
+    try:
+        sid = int(sid) if sid is not None else None
+    except Exception:
+        sid = None
+
+    vid = first(r, ['vendedor.id', 'idVendedor', 'geral.vendedor.id'])
+    itens = r.get('itens')
+    partial = False
+    if not itens and not fetch:
+        partial = True
+    elif not itens:
+        cache = acc.detail_cache
+        try:
+            det = cache.fetch(client, r, allow_fetch=allow_fetch)
+        except CircuitOpen:
+            det = cache.fetch(client, r, allow_fetch=False)
+        if det:
+            itens = det.get('itens') or []
+            if vid is None:
+                vid = first(det, ['vendedor.id'])
+        else:
+            partial = True
+    if vid is None:
+        # sem detalhe: índice local de vendedores (0 = pedido sem vendedor)
+        vid = acc.vendor_index.get(r.get('id') or r.get('numero'))
+    try:
+        vid = int(vid) if vid else None
+    except Exception:
+        vid = None
+
+    items = []
+    for i in itens or []:
+        ni = normalize_item(i)
+        q = parse_qty(ni['_qtd'])
+        items.append(((ni['_nome'] or '-', ni['_sku'] or '-'), q, (ni['_preco'] or 0.0) * q))
+
+    return {'sid': sid, 'dia': d.isoformat(), 'data_br': br_dmy_short(d_raw),
+            'numero': r.get('numero') or r.get('id'), 'valor': parse_total(r.get('total')),
+            'vid': vid, 'items': items, 'partial': partial, 'fp': order_fingerprint(r)}
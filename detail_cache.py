@@ -0,0 +1,285 @@
+"""
+Cache persistente de detalhes de pedidos (GET /pedidos/vendas/{id}).
+
+- Memória: LRU limitada (OrderedDict).
+- Disco: um JSON por pedido em cache/details/.
+- Validade: a entrada guarda a "impressão digital" do pedido na listagem
+  (situação + data de alteração). Só é buscada de novo quando ela muda.
+- Pedidos em situação final (ATENDIDO, ENTREGUE, CANCELADO) nunca são
+  buscados de novo.
+- Índice pedido -> vendedor (cache/vendor_index.json), alimentado a cada
+  detalhe gravado, para o painel de vendedores não precisar do detalhe.
+- Arquivo dos payloads brutos (cache/raw.sqlite3): linha da listagem +
+  detalhe dos pedidos da página, comprimidos e limitados aos mais
+  recentes, lidos só pelo /api-fields.
+"""
+from __future__ import annotations
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from config import settings
+from bling import CircuitOpen
+import timing
+
+DETAIL_DIR = os.path.join(settings.CACHE_DIR, 'details')
+VENDOR_INDEX_FILE = os.path.join(settings.CACHE_DIR, 'vendor_index.json')
+RAW_ARCHIVE_FILE = os.path.join(settings.CACHE_DIR, 'raw.sqlite3')
+
+
+def _sid(row) -> int | None:
+    sit = row.get('situacao')
+    sid = sit.get('id') if isinstance(sit, dict) else row.get('idSituacao')
+    try:
+        return int(sid) if sid is not None else None
+    except Exception:
+        return None
+
+
+def row_fingerprint(row) -> tuple:
+    """(situação, data de alteração) de uma linha da listagem."""
+    alt = row.get('dataAlteracao')
+    if alt is None and isinstance(row.get('data'), dict):
+        alt = row['data'].get('alteracao')
+    return (_sid(row), str(alt or ''))
+
+
+class VendorIndex:
+    """
+    Mapa persistido id do pedido -> id do vendedor.
+    0 = pedido conhecido sem vendedor; None (ausente) = nunca visto.
+    """
+
+    def __init__(self, path=VENDOR_INDEX_FILE, flush_every=200):
+        self.path = path
+        self.flush_every = flush_every
+        self._map = {}
+        self._dirty = 0
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._map = {str(k): int(v) for k, v in json.load(f).items()}
+        except Exception:
+            self._map = {}
+
+    def __len__(self):
+        return len(self._map)
+
+    def get(self, oid) -> int | None:
+        if oid is None:
+            return None
+        return self._map.get(str(oid))
+
+    def forget(self, oids) -> None:
+        """Esquece pedidos alterados (vendedor pode ter mudado): o próximo uso busca o detalhe."""
+        with self._lock:
+            for oid in oids:
+                if self._map.pop(str(oid), None) is not None:
+                    self._dirty += 1
+
+    def record(self, oid, detail) -> None:
+        if oid is None or not detail:
+            return
+        vend = detail.get('vendedor')
+        vid = vend.get('id') if isinstance(vend, dict) else None
+        try:
+            vid = int(vid or 0)
+        except Exception:
+            vid = 0
+        with self._lock:
+            if self._map.get(str(oid)) == vid:
+                return
+            self._map[str(oid)] = vid
+            self._dirty += 1
+            due = self._dirty >= self.flush_every
+        if due:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            snap = dict(self._map)
+            self._dirty = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f'{self.path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(snap, f)
+            os.replace(tmp, self.path)
+        except Exception:
+            pass
+
+
+class DetailCache:
+    def __init__(self, path=DETAIL_DIR, max_items=2000, final_status=(), vendor_index=None):
+        self.path = path
+        self.max_items = max_items
+        self.final_status = set(final_status)
+        self.vendor_index = vendor_index
+        self._mem = OrderedDict()   # oid -> {'fp': [...], 'final': bool, 'data': {...}}
+        self._lock = threading.Lock()
+        os.makedirs(self.path, exist_ok=True)
+
+    def _file(self, oid):
+        safe = ''.join(c for c in str(oid) if c.isalnum() or c in '-_')
+        return os.path.join(self.path, f'{safe}.json')
+
+    def _load(self, oid):
+        with self._lock:
+            ent = self._mem.get(oid)
+            if ent is not None:
+                self._mem.move_to_end(oid)
+                return ent
+        try:
+            with open(self._file(oid), 'r', encoding='utf-8') as f:
+                ent = json.load(f)
+        except Exception:
+            return None
+        self._remember(oid, ent)
+        return ent
+
+    def _remember(self, oid, ent):
+        with self._lock:
+            self._mem[oid] = ent
+            self._mem.move_to_end(oid)
+            while len(self._mem) > self.max_items:
+                self._mem.popitem(last=False)
+
+    def is_valid(self, ent, fp) -> bool:
+        if ent is None:
+            return False
+        if ent.get('final'):
+            return True
+        return fp is None or tuple(ent.get('fp') or ()) == tuple(fp)
+
+    def get(self, oid, fp=None):
+        """Detalhe em cache se ainda válido para a impressão digital `fp`."""
+        if oid is None:
+            return None
+        oid = str(oid)
+        ent = self._load(oid)
+        return ent.get('data') if self.is_valid(ent, fp) else None
+
+    def put(self, oid, data, fp) -> None:
+        if oid is None or not data:
+            return
+        oid = str(oid)
+        if self.vendor_index is not None:
+            self.vendor_index.record(oid, data)
+        final = fp[0] in self.final_status or _sid(data) in self.final_status
+        ent = {'fp': list(fp), 'final': final, 'data': data}
+        self._remember(oid, ent)
+        tmp = f'{self._file(oid)}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(ent, f, ensure_ascii=False)
+            os.replace(tmp, self._file(oid))
+        except Exception:
+            pass
+
+    def forget(self, oids) -> None:
+        """Descarta detalhes de pedidos que o feed de alterações apontou (mesmo em situação final)."""
+        for oid in oids:
+            oid = str(oid)
+            with self._lock:
+                self._mem.pop(oid, None)
+            try:
+                os.remove(self._file(oid))
+            except OSError:
+                pass
+
+    def fetch(self, client, row, allow_fetch=True):
+        """
+        Detalhe do pedido da linha `row` da listagem: do cache quando a
+        situação/data de alteração não mudaram, senão via client.get_sale.
+        Com allow_fetch=False (cota baixa) devolve o que houver em cache,
+        mesmo desatualizado, sem chamar o Bling.
+        """
+        oid = row.get('id') or row.get('numero')
+        if not oid:
+            return None
+        fp = row_fingerprint(row)
+        det = self.get(oid, fp)
+        timing.record_cache('detail', det is not None)
+        if det is not None:
+            return det
+        if not allow_fetch:
+            ent = self._load(str(oid))
+            return ent.get('data') if ent else None
+        try:
+            det = client.get_sale(str(oid))
+        except CircuitOpen:
+            raise   # quem monta painel não deve cachear resultado parcial
+        except Exception:
+            det = None
+        self.put(oid, det, fp)
+        return det
+
+
+class RawArchive:
+    """
+    Payloads brutos dos pedidos ({'lista': linha, 'detalhes': detalhe}) para o
+    /api-fields, fora da memória: JSON comprimido com zlib num SQLite, só os
+    `max_items` gravados por último. O snapshot da página guarda só os campos
+    que o template usa.
+    """
+
+    def __init__(self, path=RAW_ARCHIVE_FILE, max_items=500):
+        self.path = path
+        self.max_items = max_items
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS bruto (id TEXT PRIMARY KEY, em REAL NOT NULL, dados BLOB NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS ix_bruto_em ON bruto (em)')
+        self._writer = None
+        self._pending = {}      # id -> par bruto ainda na fila do put_async (get já enxerga)
+
+    def put_async(self, entries):
+        """put_many numa thread própria: serializar e comprimir fica fora da requisição."""
+        entries = [(str(oid), pair) for oid, pair in entries if oid is not None]
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='raw-archive')
+            self._pending.update(entries)
+        return self._writer.submit(self._flush, entries)
+
+    def _flush(self, entries):
+        try:
+            self.put_many(entries)
+        finally:
+            with self._lock:
+                for oid, pair in entries:
+                    if self._pending.get(oid) is pair:   # uma gravação mais nova pode estar na fila
+                        del self._pending[oid]
+
+    def put_many(self, entries) -> None:
+        """Grava [(oid, par bruto)] e descarta os mais antigos além de max_items."""
+        now = time.time()
+        rows = [(str(oid), now + i * 1e-6,
+                 zlib.compress(json.dumps(pair, ensure_ascii=False, separators=(',', ':')).encode('utf-8')))
+                for i, (oid, pair) in enumerate(entries) if oid is not None]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO bruto VALUES (?, ?, ?)', rows)
+            self._db.execute('DELETE FROM bruto WHERE em < (SELECT MIN(em) FROM '
+                             '(SELECT em FROM bruto ORDER BY em DESC LIMIT ?))', (self.max_items,))
+
+    def get(self, oid):
+        """Par bruto do pedido, ou None se não estiver (mais) no arquivo."""
+        if oid is None:
+            return None
+        with self._lock:
+            pair = self._pending.get(str(oid))
+            if pair is not None:
+                return pair
+            row = self._db.execute('SELECT dados FROM bruto WHERE id = ?', (str(oid),)).fetchone()
+        return json.loads(zlib.decompress(row[0])) if row else None
@@ -0,0 +1,243 @@
+"""
+Exportação dos pedidos do mês, itens e painéis em CSV ou XLSX por streaming.
+
+As tabelas são geradores de linhas e os formatos são geradores de bytes:
+a resposta do Flask (ou o arquivo da CLI) recebe pedaços de poucos KB
+conforme as linhas são produzidas, sem montar o arquivo inteiro em memória.
+
+- CSV: UTF-8 com BOM, separador ";" e vírgula decimal (abre direto no
+  Excel em português).
+- XLSX: uma planilha mínima (XML da planilha escrito linha a linha dentro
+  de um zip em modo streaming, sem dependências).
+
+Com a planilha de análise configurada, pedidos e itens ganham a coluna de
+margem do pedido e os painéis a margem média ponderada pelo valor.
+"""
+from __future__ import annotations
+import csv
+import io
+import zipfile
+from xml.sax.saxutils import escape
+
+CANCELADO = 12
+CHUNK_ROWS = 500        # linhas por pedaço enviado
+
+
+# ---------- margens ----------
+def parse_margin(raw):
+    """'23,5%' -> 23.5; '0,18' -> 0.18 (mesma unidade da planilha); None se vazio/inválido."""
+    txt = str(raw or '').replace('%', '').strip()
+    if ',' in txt:
+        txt = txt.replace('.', '').replace(',', '.')
+    try:
+        return float(txt)
+    except ValueError:
+        return None
+
+
+def _avg_margin(entries, margins, weight_key, skip_cancelled):
+    num = den = 0.0
+    for d in entries:
+        if skip_cancelled and d.get('sid') == CANCELADO:
+            continue
+        m = parse_margin(margins.get(str(d.get('numero') or '').strip()))
+        w = d.get(weight_key) or 0.0
+        if m is None or not w:
+            continue
+        num += m * w
+        den += w
+    return round(num / den, 2) if den else None
+
+
+# ---------- tabelas ----------
+def panel_table(name, panel, margins=None):
+    """(cabeçalho, linhas) de um painel do mês (month_status, month_vendor, month_day, prod_month)."""
+    margins = margins or None
+    if name == 'month_status':
+        header = ['Situação', 'Pedidos', 'Valor']
+        lines, details, key = panel['status_list'], panel.get('details_by_status') or {}, 'sid'
+        cols = lambda l: [l['status'], l['qtd'], round(l['valor'], 2)]
+        weight, skip = 'total', False
+    elif name == 'month_vendor':
+        header = ['Vendedor', 'Pedidos', 'Valor', 'Tem cancelados']
+        lines, details, key = panel['vendors_list'], panel.get('details_by_vendor') or {}, 'vendedor'
+        cols = lambda l: [l['vendedor'], l['qtd'], round(l['valor'], 2), 'sim' if l.get('has_cancelled') else 'não']
+        weight, skip = 'total', True
+    elif name == 'month_day':
+        header = ['Dia', 'Pedidos', 'Valor', 'Tem cancelados']
+        lines, details, key = panel['days_list'], panel.get('details_by_day') or {}, 'day_key'
+        cols = lambda l: [l['day_key'], l['qtd'], round(l['valor'], 2), 'sim' if l.get('has_cancelled') else 'não']
+        weight, skip = 'total', False
+    elif name == 'prod_month':
+        header = ['Produto', 'SKU', 'Quantidade', 'Valor', 'Tem cancelados']
+        lines, details, key = panel['products_list'], panel.get('details_by_product') or {}, None
+        cols = lambda l: [l['produto'], l['sku'], l['qtd'], round(l['valor'], 2), 'sim' if l.get('has_cancelled') else 'não']
+        weight, skip = 'valor', True
+    else:
+        raise KeyError(name)
+    if margins:
+        header = header + ['Margem média']
+
+    def rows():
+        for l in lines:
+            out = cols(l)
+            if margins:
+                k = (l['produto'], l['sku']) if key is None else l[key]
+                out.append(_avg_margin(details.get(k) or [], margins, weight, skip))
+            yield out
+    return header, rows()
+
+
+def orders_table(contribs, status_name, vendor_name, margins=None):
+    """Pedidos do mês a partir das contribuições dos agregados [(oid, contribuição)]."""
+    header = ['Número', 'Data', 'Situação', 'Vendedor', 'Total', 'Itens', 'Detalhe completo']
+    if margins:
+        header.append('Margem')
+
+    def rows():
+        for oid, c in contribs:
+            out = [str(c['numero']), c['dia'], status_name(c['sid'], f"STATUS {c['sid']}"),
+                   (vendor_name(c['vid']) if c['vid'] else None) or 'SEM VENDEDOR', round(c['valor'], 2),
+                   len(c['items']), 'não' if c['partial'] else 'sim']
+            if margins:
+                out.append(margins.get(str(c['numero']).strip()))
+            yield out
+    return header, rows()
+
+
+def items_table(contribs, status_name, margins=None):
+    """Itens dos pedidos do mês (um por linha; pedidos sem detalhe não têm itens)."""
+    header = ['Número', 'Data', 'Situação', 'Produto', 'SKU', 'Quantidade', 'Valor']
+    if margins:
+        header.append('Margem do pedido')
+
+    def rows():
+        for oid, c in contribs:
+            situacao = status_name(c['sid'], f"STATUS {c['sid']}")
+            margem = margins.get(str(c['numero']).strip()) if margins else None
+            for (nome, sku), q, v in c['items']:
+                out = [str(c['numero']), c['dia'], situacao, nome, sku, q, round(v, 2)]
+                if margins:
+                    out.append(margem)
+                yield out
+    return header, rows()
+
+
+# ---------- formatos ----------
+def _br_number(v):
+    if isinstance(v, bool) or not isinstance(v, (int, float)):
+        return '' if v is None else v
+    return str(v).replace('.', ',') if isinstance(v, float) else str(v)
+
+
+def csv_stream(header, rows):
+    """Pedaços (bytes) de um CSV para Excel em português."""
+    buf = io.StringIO()
+    w = csv.writer(buf, delimiter=';', lineterminator='\r\n')
+    buf.write('\ufeff')
+    w.writerow(header)
+    for n, row in enumerate(rows, 1):
+        w.writerow([_br_number(v) for v in row])
+        if n % CHUNK_ROWS == 0:
+            yield buf.getvalue().encode('utf-8')
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue().encode('utf-8')
+
+
+class _Sink(io.RawIOBase):
+    """Destino do zip sem seek: acumula o que foi escrito até o gerador entregar."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def drain(self) -> bytes:
+        out = b''.join(self.chunks)
+        self.chunks.clear()
+        return out
+
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'officeDocument" Target="xl/workbook.xml"/></Relationships>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/'
+        'worksheet" Target="worksheets/sheet1.xml"/></Relationships>'),
+}
+
+
+def _xml_text(v) -> str:
+    s = ''.join(ch for ch in str(v) if ch in '\t\n\r' or ch >= ' ')   # XML não aceita controles
+    return escape(s)
+
+
+def _xlsx_row(values) -> str:
+    cells = []
+    for v in values:
+        if v is None or v == '':
+            cells.append('<c/>')
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            cells.append(f'<c><v>{v!r}</v></c>')
+        else:
+            cells.append(f'<c t="inlineStr"><is><t xml:space="preserve">{_xml_text(v)}</t></is></c>')
+    return '<row>' + ''.join(cells) + '</row>'
+
+
+def xlsx_stream(header, rows, sheet='Dados'):
+    """Pedaços (bytes) de um .xlsx de uma planilha, gerados enquanto as linhas chegam."""
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for name, xml in _XLSX_PARTS.items():
+            zf.writestr(name, xml)
+        zf.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{_xml_text(sheet[:31])}" sheetId="1" r:id="rId1"/></sheets></workbook>'))
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as f:
+            f.write(('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                     '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                     + _xlsx_row(header)).encode('utf-8'))
+            for n, row in enumerate(rows, 1):
+                f.write(_xlsx_row(row).encode('utf-8'))
+                if n % CHUNK_ROWS == 0:
+                    out = sink.drain()
+                    if out:
+                        yield out
+            f.write(b'</sheetData></worksheet>')
+    yield sink.drain()
+
+
+MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def stream(fmt, header, rows, sheet='Dados'):
+    """Gerador de bytes no formato pedido ('csv' ou 'xlsx')."""
+    if fmt == 'xlsx':
+        return xlsx_stream(header, rows, sheet=sheet)
+    return csv_stream(header, rows)
@@ -0,0 +1,253 @@
+"""
+Servidor Bling falso para rodar o ABLING offline (carga, benchmarks, demo).
+
+Implementa o mínimo que o app usa:
+  GET  /b/Api/v3/oauth/authorize      -> redireciona com ?code=fake
+  POST /b/Api/v3/oauth/token          -> token fake
+  GET  /Api/v3/pedidos/vendas         -> listagem paginada (mais novos primeiro)
+  GET  /Api/v3/pedidos/vendas/<id>    -> detalhe
+  GET  /Api/v3/situacoes/modulos[/<id>], /vendedores, /formas-pagamentos
+
+Os dados vêm de um arquivo gravado com BLING_RECORD (--replay) ou são
+sintetizados de forma determinística (--seed). Latência e respostas 429
+podem ser injetadas.
+
+Uso:
+  python fake_bling.py --port 5099 --orders-per-day 40 --latency-ms 150 --p429 0.02
+e no .env do app:
+  BLING_AUTH_URL=http://127.0.0.1:5099/b/Api/v3/oauth/authorize
+  BLING_TOKEN_URL=http://127.0.0.1:5099/b/Api/v3/oauth/token
+  BLING_API_BASE=http://127.0.0.1:5099/Api/v3
+"""
+from __future__ import annotations
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import date, timedelta
+from urllib.parse import urlencode
+
+from flask import Flask, jsonify, redirect, request
+
+from orders import STATUS_MAP, VENDEDOR_MAP, FORMAPAG_MAP, month_bounds_today
+
+PRODUCTS = [(7_000_000 + i, f'PRODUTO {i:03d}', f'SKU{i:04d}', round(5 + (i * 37 % 400) + 0.9, 2))
+            for i in range(1, 301)]
+STATUS_WEIGHTS = {9: 8, 67578: 6, 6: 4, 12: 1}
+
+
+# ---------------- dados sintéticos ----------------
+def synth_orders(d_ini: date, d_fim: date, per_day=40, items=(1, 5), seed=1, start_id=10_000_000):
+    """
+    Gera detalhes de pedidos no formato do Bling v3 (GET /pedidos/vendas/{id}).
+    Determinístico para o mesmo seed.
+    """
+    rnd = random.Random(seed)
+    status_ids = list(STATUS_MAP.keys())
+    weights = [STATUS_WEIGHTS.get(sid, 1) for sid in status_ids]
+    vend_ids = list(VENDEDOR_MAP.keys()) + [0]
+    fp_ids = list(FORMAPAG_MAP.keys())
+    orders, oid, num = [], start_id, 50_000
+    d = d_ini
+    while d <= d_fim:
+        for _ in range(per_day):
+            oid += 1
+            num += 1
+            itens = []
+            for _ in range(rnd.randint(*items)):
+                prod_id, nome, sku, preco = PRODUCTS[min(int(rnd.paretovariate(1.2)) - 1, len(PRODUCTS) - 1)]
+                itens.append({'codigo': sku, 'descricao': nome, 'quantidade': rnd.randint(1, 4),
+                              'valor': preco, 'produto': {'id': prod_id, 'nome': nome, 'codigo': sku}})
+            total = round(sum(i['quantidade'] * i['valor'] for i in itens), 2)
+            frete = round(rnd.choice([0, 0, 12.9, 25.5]), 2)
+            vid = rnd.choice(vend_ids)
+            orders.append({
+                'id': oid,
+                'numero': num,
+                'data': d.isoformat(),
+                'dataAlteracao': f'{d.isoformat()} {rnd.randint(8, 20):02d}:{rnd.randint(0, 59):02d}:00',
+                'total': round(total + frete, 2),
+                'totalProdutos': total,
+                'contato': {'id': 900 + oid % 500, 'nome': f'CLIENTE {oid % 500}'},
+                'situacao': {'id': rnd.choices(status_ids, weights=weights)[0], 'valor': 0},
+                'vendedor': {'id': vid},
+                'itens': itens,
+                'transporte': {'frete': frete},
+                'parcelas': [{'id': oid * 10, 'dataVencimento': d.isoformat(), 'valor': round(total + frete, 2),
+                              'observacoes': '', 'formaPagamento': {'id': rnd.choice(fp_ids)}}],
+                'observacoes': '',
+                'observacoesInternas': '',
+            })
+        d += timedelta(days=1)
+    return orders
+
+
+LIST_FIELDS = ('id', 'numero', 'data', 'dataAlteracao', 'total', 'totalProdutos', 'contato', 'situacao')
+
+
+def list_row(order):
+    """Linha da listagem: a listagem do Bling não traz itens, parcelas nem vendedor."""
+    return {k: order[k] for k in LIST_FIELDS if k in order}
+
+
+# ---------------- replay ----------------
+def load_archive(path):
+    """
+    Lê um JSONL gravado por BLING_RECORD.
+    Retorna (respostas exatas por (path, params), pedidos por id).
+    """
+    exact, orders = {}, {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if rec.get('method') != 'GET' or rec.get('status') != 200:
+                continue
+            body = rec.get('body') or {}
+            exact[(rec['path'], _params_key(rec.get('params') or {}))] = body
+            if rec['path'] == '/pedidos/vendas':
+                for row in body.get('data') or []:
+                    orders.setdefault(row.get('id'), {}).update(row)
+            elif rec['path'].startswith('/pedidos/vendas/'):
+                det = body.get('data') or {}
+                if det.get('id') is not None:
+                    orders.setdefault(det['id'], {}).update(det)
+    return exact, list(orders.values())
+
+
+def _params_key(params):
+    return urlencode(sorted((str(k), str(v)) for k, v in params.items()))
+
+
+# ---------------- servidor ----------------
+def create_app(orders, exact=None, latency_ms=0, jitter_ms=0, p429=0.0, rps=0, seed=1):
+    fake = Flask('fake_bling')
+    rnd = random.Random(seed)
+    by_id = {str(o['id']): o for o in orders}
+    ordered = sorted(orders, key=lambda o: (str(o.get('data') or ''), o.get('id') or 0), reverse=True)
+    hits = deque()
+    lock = threading.Lock()
+    exact = exact or {}
+
+    @fake.before_request
+    def inject():
+        if latency_ms or jitter_ms:
+            time.sleep((latency_ms + rnd.uniform(0, jitter_ms)) / 1000.0)
+        if request.path.endswith('/oauth/authorize') or request.path.endswith('/oauth/token'):
+            return None
+        limited = False
+        if rps:
+            now = time.monotonic()
+            with lock:
+                while hits and now - hits[0] > 1.0:
+                    hits.popleft()
+                limited = len(hits) >= rps
+                if not limited:
+                    hits.append(now)
+        if limited or (p429 and rnd.random() < p429):
+            return jsonify({'error': {'type': 'TOO_MANY_REQUESTS', 'message': 'Limite de requisições atingido.'}}), 429
+        if not request.headers.get('Authorization', '').startswith('Bearer '):
+            return jsonify({'error': {'type': 'invalid_token'}}), 401
+        return None
+
+    @fake.get('/b/Api/v3/oauth/authorize')
+    def authorize():
+        q = {'code': 'fake-code', 'state': request.args.get('state', '')}
+        return redirect(request.args.get('redirect_uri', '/') + '?' + urlencode(q))
+
+    @fake.post('/b/Api/v3/oauth/token')
+    def token():
+        return jsonify({'access_token': f'fake-{int(time.time())}', 'expires_in': 21600,
+                        'token_type': 'Bearer', 'scope': 'fake', 'refresh_token': 'fake-refresh'})
+
+    def _replayed():
+        sub = request.path.split('/Api/v3', 1)[-1]
+        return exact.get((sub, _params_key(request.args.to_dict())))
+
+    @fake.get('/Api/v3/pedidos/vendas')
+    def pedidos():
+        rec = _replayed()
+        if rec is not None:
+            return jsonify(rec)
+        a = request.args
+        pagina = max(int(a.get('pagina', 1)), 1)
+        limite = min(max(int(a.get('limite', 100)), 1), 100)
+        ini = a.get('dataEmissao[ini]') or a.get('dataInicial') or ''
+        fim = a.get('dataEmissao[fim]') or a.get('dataFinal') or '9999-12-31'
+        alt_ini = a.get('dataAlteracaoInicial') or ''
+        alt_fim = a.get('dataAlteracaoFinal') or '9999-12-31 23:59:59'
+        sit = a.get('situacao') or a.get('idsSituacoes[]')
+        rows = [o for o in ordered
+                if ini <= str(o.get('data') or '') <= fim
+                and (not sit or str((o.get('situacao') or {}).get('id')) == str(sit))
+                and (not alt_ini or alt_ini <= str(o.get('dataAlteracao') or '') <= alt_fim)]
+        page = rows[(pagina - 1) * limite: pagina * limite]
+        return jsonify({'data': [list_row(o) for o in page]})
+
+    @fake.get('/Api/v3/pedidos/vendas/<oid>')
+    def pedido(oid):
+        rec = _replayed()
+        if rec is not None:
+            return jsonify(rec)
+        o = by_id.get(str(oid))
+        if not o:
+            return jsonify({'error': {'type': 'RESOURCE_NOT_FOUND'}}), 404
+        return jsonify({'data': o})
+
+    @fake.get('/Api/v3/situacoes/modulos')
+    def modulos():
+        return jsonify({'data': [{'id': 98310, 'nome': 'Vendas', 'descricao': 'Pedidos de venda'}]})
+
+    @fake.get('/Api/v3/situacoes/modulos/<int:mid>')
+    def situacoes(mid):
+        return jsonify({'data': [{'id': k, 'nome': v.title(), 'idHerdado': 0} for k, v in STATUS_MAP.items()]})
+
+    @fake.get('/Api/v3/vendedores')
+    def vendedores():
+        pagina = int(request.args.get('pagina', 1))
+        data = [{'id': k, 'contato': {'id': k, 'nome': v}} for k, v in VENDEDOR_MAP.items()]
+        return jsonify({'data': data if pagina == 1 else []})
+
+    @fake.get('/Api/v3/formas-pagamentos')
+    def formas():
+        pagina = int(request.args.get('pagina', 1))
+        data = [{'id': k, 'descricao': v} for k, v in FORMAPAG_MAP.items()]
+        return jsonify({'data': data if pagina == 1 else []})
+
+    fake.config['ORDERS'] = orders
+    return fake
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Servidor Bling falso (offline).')
+    ap.add_argument('--port', type=int, default=5099)
+    ap.add_argument('--replay', help='JSONL gravado com BLING_RECORD')
+    ap.add_argument('--orders-per-day', type=int, default=40)
+    ap.add_argument('--months', type=int, default=1, help='meses sintetizados até hoje')
+    ap.add_argument('--seed', type=int, default=1)
+    ap.add_argument('--latency-ms', type=float, default=0)
+    ap.add_argument('--jitter-ms', type=float, default=0)
+    ap.add_argument('--p429', type=float, default=0.0, help='probabilidade de responder 429')
+    ap.add_argument('--rps', type=int, default=0, help='limite de requisições/s (0 = sem limite)')
+    args = ap.parse_args(argv)
+
+    exact = None
+    if args.replay:
+        exact, orders = load_archive(args.replay)
+    else:
+        m_ini, m_fim = month_bounds_today()
+        d_ini = m_ini
+        for _ in range(args.months - 1):
+            d_ini = (d_ini - timedelta(days=1)).replace(day=1)
+        orders = synth_orders(d_ini, m_fim, per_day=args.orders_per_day, seed=args.seed)
+    print(f'fake Bling: {len(orders)} pedidos - porta {args.port}')
+    create_app(orders, exact, args.latency_ms, args.jitter_ms, args.p429, args.rps, args.seed).run(
+        host='127.0.0.1', port=args.port, threaded=True, use_reloader=False)
+
+
+if __name__ == '__main__':
+    main()
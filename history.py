@@ -0,0 +1,191 @@
+"""
+Histórico local de pedidos (SQLite em disco, um arquivo por empresa) com
+agregados diários, para consultar qualquer período sem varrer o Bling.
+
+- pedidos/itens: a contribuição de cada pedido (a mesma dos painéis do
+  mês: situação, dia, total, vendedor, itens), gravada pelo app a cada
+  atualização do mês e pelo backfill para períodos antigos.
+- dia_status, dia_vendedor, dia_produto: somas por dia, refeitas só
+  para os dias tocados. Uma consulta de 12 meses lê ~365 linhas por
+  chave, então responde tão rápido quanto a de um mês.
+
+Regras de cancelado (sid == 12) iguais às dos painéis: entra nos totais
+de status e dias; fica fora dos totais de vendedor e produto (só marca
+has_cancelled). Os painéis do histórico não têm zoom por pedido.
+"""
+from __future__ import annotations
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+CANCELADO = 12
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pedidos (
+    id TEXT PRIMARY KEY, dia TEXT NOT NULL, sid INTEGER NOT NULL, vid INTEGER NOT NULL,
+    numero TEXT, valor REAL NOT NULL, parcial INTEGER NOT NULL, fp TEXT);
+CREATE INDEX IF NOT EXISTS ix_pedidos_dia ON pedidos (dia);
+CREATE TABLE IF NOT EXISTS itens (pedido TEXT NOT NULL, nome TEXT, sku TEXT, qtd REAL, valor REAL);
+CREATE INDEX IF NOT EXISTS ix_itens_pedido ON itens (pedido);
+CREATE TABLE IF NOT EXISTS dia_status (
+    dia TEXT, sid INTEGER, qtd INTEGER, valor REAL, PRIMARY KEY (dia, sid));
+CREATE TABLE IF NOT EXISTS dia_vendedor (
+    dia TEXT, vid INTEGER, qtd INTEGER, valor REAL, cancelados INTEGER, PRIMARY KEY (dia, vid));
+CREATE TABLE IF NOT EXISTS dia_produto (
+    dia TEXT, nome TEXT, sku TEXT, qtd REAL, valor REAL, cancelados INTEGER, PRIMARY KEY (dia, nome, sku));
+"""
+
+_ROLLUPS = (
+    ("INSERT INTO dia_status SELECT dia, sid, COUNT(*), SUM(valor) FROM pedidos "
+     "WHERE dia IN ({q}) GROUP BY dia, sid"),
+    ("INSERT INTO dia_vendedor SELECT dia, vid, SUM(sid != 12), SUM(CASE WHEN sid = 12 THEN 0 ELSE valor END), "
+     "SUM(sid = 12) FROM pedidos WHERE dia IN ({q}) GROUP BY dia, vid"),
+    ("INSERT INTO dia_produto SELECT p.dia, i.nome, i.sku, SUM(CASE WHEN p.sid = 12 THEN 0 ELSE i.qtd END), "
+     "SUM(CASE WHEN p.sid = 12 THEN 0 ELSE i.valor END), COUNT(DISTINCT CASE WHEN p.sid = 12 THEN p.id END) "
+     "FROM itens i JOIN pedidos p ON p.id = i.pedido WHERE p.dia IN ({q}) GROUP BY p.dia, i.nome, i.sku"),
+)
+
+
+def _br(iso):
+    try:
+        return datetime.strptime(iso, '%Y-%m-%d').strftime('%d/%m/%y')
+    except Exception:
+        return iso
+
+
+class HistoryStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript(SCHEMA)
+        self._writer = None
+
+    # ---------- gravação ----------
+    def put_async(self, entries):
+        """put_many numa thread própria (um escritor, na ordem de chegada): fora do caminho da requisição."""
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='history')
+        return self._writer.submit(self.put_many, list(entries))
+
+    def put_many(self, entries) -> int:
+        """
+        Grava [(oid, contribuição ou None)]; None remove o pedido. Pula os que
+        não mudaram (mesma impressão digital), sem trocar um registro completo
+        por um parcial. Devolve quantos foram gravados.
+        """
+        n, days = 0, set()
+        with self._lock, self._db:
+            cur = self._db.cursor()
+            for oid, c in entries:
+                oid = str(oid)
+                old = cur.execute('SELECT dia, fp, parcial FROM pedidos WHERE id = ?', (oid,)).fetchone()
+                if (c is not None and old is not None and old[1] == repr(c['fp'])
+                        and (old[2] == int(c['partial']) or c['partial'])):
+                    continue    # igual, ou só a versão parcial do que já está completo
+                if old is not None:
+                    days.add(old[0])
+                    cur.execute('DELETE FROM pedidos WHERE id = ?', (oid,))
+                    cur.execute('DELETE FROM itens WHERE pedido = ?', (oid,))
+                if c is not None:
+                    cur.execute('INSERT INTO pedidos VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                (oid, c['dia'], c['sid'] or 0, c['vid'] or 0, str(c['numero']),
+                                 float(c['valor']), int(c['partial']), repr(c['fp'])))
+                    cur.executemany('INSERT INTO itens VALUES (?, ?, ?, ?, ?)',
+                                    [(oid, nome, sku, q, v) for (nome, sku), q, v in c['items']])
+                    days.add(c['dia'])
+                if old is not None or c is not None:
+                    n += 1
+            self._rollup(cur, sorted(days))
+        return n
+
+    def _rollup(self, cur, days):
+        for i in range(0, len(days), 500):
+            chunk = days[i:i + 500]
+            q = ','.join('?' * len(chunk))
+            for table in ('dia_status', 'dia_vendedor', 'dia_produto'):
+                cur.execute(f'DELETE FROM {table} WHERE dia IN ({q})', chunk)
+            for sql in _ROLLUPS:
+                cur.execute(sql.format(q=q), chunk)
+
+    # ---------- consulta ----------
+    def coverage(self) -> dict:
+        with self._lock:
+            ini, fim, n, parciais = self._db.execute(
+                'SELECT MIN(dia), MAX(dia), COUNT(*), COALESCE(SUM(parcial), 0) FROM pedidos').fetchone()
+        return {'ini': ini, 'fim': fim, 'pedidos': n, 'parciais': parciais}
+
+    def known(self, ini, fim) -> dict:
+        """{id: (impressão digital, parcial)} dos pedidos gravados no período (o backfill pula os completos)."""
+        return {oid: (fp, bool(parcial)) for oid, fp, parcial in self._rows(
+            'SELECT id, fp, parcial FROM pedidos WHERE dia BETWEEN ? AND ?', ini, fim)}
+
+    def contributions(self, ini, fim) -> list:
+        """[(oid, contribuição)] do período, mais recentes primeiro, no formato dos agregados do mês (arquivo)."""
+        with self._lock:
+            pedidos = self._db.execute(
+                'SELECT id, dia, sid, vid, numero, valor, parcial, fp FROM pedidos WHERE dia BETWEEN ? AND ? '
+                'ORDER BY dia DESC, numero DESC', (str(ini), str(fim))).fetchall()
+            itens = {}
+            for pedido, nome, sku, q, v in self._db.execute(
+                    'SELECT i.pedido, i.nome, i.sku, i.qtd, i.valor FROM itens i JOIN pedidos p ON p.id = i.pedido '
+                    'WHERE p.dia BETWEEN ? AND ? ORDER BY i.rowid', (str(ini), str(fim))):
+                itens.setdefault(pedido, []).append(((nome, sku), q, v))
+        return [(oid, {'sid': sid or None, 'dia': dia, 'data_br': _br(dia), 'numero': numero, 'valor': valor,
+                       'vid': vid or None, 'items': itens.get(oid, []), 'partial': bool(parcial), 'fp': fp})
+                for oid, dia, sid, vid, numero, valor, parcial, fp in pedidos]
+
+    def _rows(self, sql, ini, fim):
+        with self._lock:
+            return self._db.execute(sql, (str(ini), str(fim))).fetchall()
+
+    def panels(self, ini, fim, status_name, vendor_name, nomes_validos, detail_id) -> dict:
+        """Painéis de status, vendedor, dias e produtos do período [ini, fim] (ISO), no formato dos do mês."""
+        label = f'{_br(str(ini))} a {_br(str(fim))}'
+
+        status = [{'sid': sid, 'status': status_name(sid, f'STATUS {sid}'), 'qtd': int(q), 'valor': float(v)}
+                  for sid, q, v in self._rows('SELECT sid, SUM(qtd), SUM(valor) FROM dia_status '
+                                              'WHERE dia BETWEEN ? AND ? GROUP BY sid', ini, fim)]
+        status.sort(key=lambda x: x['valor'], reverse=True)
+
+        acum = {}
+        for vid, q, v, nc in self._rows('SELECT vid, SUM(qtd), SUM(valor), SUM(cancelados) FROM dia_vendedor '
+                                        'WHERE dia BETWEEN ? AND ? GROUP BY vid', ini, fim):
+            nome = vendor_name(vid) if vid else None
+            a = acum.setdefault(nome if nome in nomes_validos else 'SEM VENDEDOR', [0, 0.0, False])
+            a[0] += q
+            a[1] += v
+            a[2] = a[2] or nc > 0
+        vendors = [{'vendedor': nome, 'qtd': int(a[0]), 'valor': float(a[1]), 'has_cancelled': a[2]}
+                   for nome, a in acum.items() if a[0] or nome == 'SEM VENDEDOR']
+        vendors.sort(key=lambda x: x['valor'], reverse=True)
+
+        days = [{'day_key': dia, 'day_label': _br(dia), 'qtd': int(q), 'valor': float(v), 'has_cancelled': False}
+                for dia, q, v in self._rows('SELECT dia, SUM(qtd), SUM(valor) FROM dia_status '
+                                            'WHERE dia BETWEEN ? AND ? GROUP BY dia ORDER BY dia DESC', ini, fim)]
+        cancelled_days = {dia for (dia,) in self._rows(f'SELECT dia FROM dia_status WHERE dia BETWEEN ? AND ? '
+                                                       f'AND sid = {CANCELADO}', ini, fim)}
+        for d in days:
+            d['has_cancelled'] = d['day_key'] in cancelled_days
+
+        prods = [{'produto': nome, 'sku': sku, 'qtd': q, 'valor': v, 'has_cancelled': nc > 0,
+                  'detail_id': detail_id(nome, sku)}
+                 for nome, sku, q, v, nc in self._rows(
+                     'SELECT nome, sku, SUM(qtd), SUM(valor), SUM(cancelados) FROM dia_produto '
+                     'WHERE dia BETWEEN ? AND ? GROUP BY nome, sku', ini, fim)]
+        prods.sort(key=lambda x: x['valor'], reverse=True)
+
+        def panel(key, lines, **extra):
+            return dict({'mes_label': label, key: lines, 'total_qtd': sum(x['qtd'] for x in lines),
+                         'total_valor': sum(x['valor'] for x in lines)}, **extra)
+
+        return {
+            'month_status': panel('status_list', status, details_by_status={}),
+            'month_vendor': panel('vendors_list', vendors, details_by_vendor={}),
+            'month_day': panel('days_list', days, details_by_day={}),
+            'prod_month': panel('products_list', prods, details_by_product={}),
+        }
@@ -0,0 +1,141 @@
+"""
+Métricas no formato de texto do Prometheus, sem dependências.
+
+Contadores e histogramas em memória do processo (com gunicorn, cada worker
+expõe os seus; agregue no Prometheus com sum()). Servidos em /metrics.
+"""
+from __future__ import annotations
+import threading
+
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60)
+REGISTRY = []
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    inner = ','.join(f'{n}="{_esc(v)}"' for n, v in zip(names, values))
+    return '{' + inner + '}'
+
+
+def _esc(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, doc, labels=()):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for lv, v in items:
+            yield f'{self.name}{_labels(self.labelnames, lv)} {v:g}'
+
+
+class Gauge:
+    """Valor lido na hora da coleta (fn devolve um número ou {labels: número})."""
+    kind = 'gauge'
+
+    def __init__(self, name, doc, fn, labels=()):
+        self.name, self.doc, self.fn, self.labelnames = name, doc, fn, tuple(labels)
+        REGISTRY.append(self)
+
+    def samples(self):
+        try:
+            val = self.fn()
+        except Exception:
+            return
+        items = sorted(val.items()) if isinstance(val, dict) else [((), val)]
+        for lv, v in items:
+            lv = lv if isinstance(lv, tuple) else (lv,)
+            yield f'{self.name}{_labels(self.labelnames, lv)} {float(v):g}'
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, doc, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name, self.doc, self.labelnames = name, doc, tuple(labels)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels -> [contagens por bucket..., soma, total]
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            slot = self._values.get(labels)
+            if slot is None:
+                slot = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    slot[i] += 1
+            slot[-2] += value
+            slot[-1] += 1
+
+    def samples(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        for lv, slot in items:
+            names = self.labelnames + ('le',)
+            for b, c in zip(self.buckets, slot):
+                yield f'{self.name}_bucket{_labels(names, lv + (f"{b:g}",))} {c}'
+            yield f'{self.name}_bucket{_labels(names, lv + ("+Inf",))} {slot[-1]}'
+            yield f'{self.name}_sum{_labels(self.labelnames, lv)} {slot[-2]:.6f}'
+            yield f'{self.name}_count{_labels(self.labelnames, lv)} {slot[-1]}'
+
+
+def render() -> str:
+    out = []
+    for m in REGISTRY:
+        out.append(f'# HELP {m.name} {m.doc}')
+        out.append(f'# TYPE {m.name} {m.kind}')
+        out.extend(m.samples())
+    return '\n'.join(out) + '\n'
+
+
+# ---------------- métricas do ABLING ----------------
+BLING_REQUESTS = Counter('abling_bling_requests_total',
+                         'Chamadas à API do Bling por endpoint e status HTTP (0 = erro de rede).',
+                         ('endpoint', 'status'))
+BLING_LATENCY = Histogram('abling_bling_request_duration_seconds',
+                          'Latência das chamadas à API do Bling.', ('endpoint',))
+TOKEN_REFRESHES = Counter('abling_token_refresh_total',
+                          'Renovações de token OAuth por resultado.', ('result',))
+CACHE_REQUESTS = Counter('abling_cache_requests_total',
+                         'Consultas aos caches por resultado (hit/miss).', ('cache', 'result'))
+PANEL_BUILD = Histogram('abling_panel_build_duration_seconds',
+                        'Duração da montagem de cada painel.', ('panel',))
+SHEET_FETCH = Histogram('abling_sheet_fetch_duration_seconds',
+                        'Duração do download da planilha de análise.')
+RENDER = Histogram('abling_render_duration_seconds',
+                   'Duração da renderização dos templates.')
+STAGE = Histogram('abling_stage_duration_seconds',
+                  'Duração das demais etapas do index (probes, listagem, detalhes).', ('stage',))
+WEBHOOK_EVENTS = Counter('abling_webhook_events_total',
+                         'Webhooks do Bling recebidos por evento e resultado.', ('event', 'result'))
+HTTP_REQUESTS = Histogram('abling_http_request_duration_seconds',
+                          'Duração das requisições HTTP ao ABLING por rota e status.', ('route', 'status'))
+
+
+def observe_stage(name, dt):
+    if name.startswith('panel-'):
+        PANEL_BUILD.observe(dt, name[len('panel-'):])
+    elif name == 'sheet':
+        SHEET_FETCH.observe(dt)
+    elif name == 'render':
+        RENDER.observe(dt)
+    else:
+        STAGE.observe(dt, name)
@@ -0,0 +1,292 @@
+"""
+Cópia local das linhas da listagem de pedidos do mês, mantida por um
+"feed" de alterações.
+
+- Carga completa: todas as páginas de /pedidos/vendas do período.
+- Depois, a cada sync, só as linhas com data de alteração desde o último
+  sync (dataAlteracaoInicial, com uma folga para relógios desencontrados).
+- Cada pedido guarda uma impressão digital (situação, data de alteração,
+  total); só os que mudaram contam como alterados.
+- A versão sobe quando algo muda: é ela que invalida os painéis do mês,
+  inclusive por mudanças em pedidos antigos (cancelamento, total editado,
+  troca de vendedor), não só pela chegada de um pedido novo.
+- Exclusões não aparecem no feed: uma recarga completa periódica
+  (reconcile_secs) reconcilia o conjunto.
+- A listagem para em page_limit páginas; se ainda houver mais, a cópia
+  fica marcada como truncada (truncated), o aviso vai para o log e a
+  recarga não remove os pedidos que não vieram.
+
+OrderIndex espelha uma cópia num SQLite em memória (índices por data,
+situação e vendedor) para filtrar localmente, sem ir ao Bling.
+"""
+from __future__ import annotations
+import logging
+import sqlite3
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+from detail_cache import row_fingerprint
+
+log = logging.getLogger(__name__)
+
+
+def _now_sp() -> datetime:
+    try:
+        return datetime.now(ZoneInfo('America/Sao_Paulo')).replace(tzinfo=None)
+    except Exception:
+        return datetime.now()
+
+
+def order_fingerprint(row) -> tuple:
+    return row_fingerprint(row) + (str(row.get('total')),)
+
+
+class OrderStore:
+    def __init__(self, page_size=100, page_limit=2000, overlap_secs=120,
+                 reconcile_secs=1800, log_size=64, on_change=None):
+        self.page_size, self.page_limit = page_size, page_limit
+        self.overlap = timedelta(seconds=overlap_secs)
+        self.reconcile_secs = reconcile_secs
+        self.on_change = on_change      # chamado com os ids alterados (não os novos)
+        self._lock = threading.Lock()        # dados
+        self._sync_lock = threading.Lock()   # um sync por vez (a rede fica fora de _lock)
+        self.period = None              # (ini, fim) ISO do período carregado
+        self.version = 0
+        self._rows = {}                 # id -> linha da listagem
+        self._fps = {}                  # id -> impressão digital
+        self._since = None              # início do último sync (horário de SP)
+        self._full_at = 0.0
+        self._log = deque(maxlen=log_size)   # (versão, ids alterados/novos/removidos)
+        self.truncated = False          # a última listagem bateu em page_limit com páginas sobrando
+
+    # ---------- consulta ----------
+    def covers(self, ini, fim) -> bool:
+        return self.period == (str(ini), str(fim))
+
+    def rows(self) -> list:
+        with self._lock:
+            return list(self._rows.values())
+
+    def get(self, oid):
+        return self._rows.get(str(oid))
+
+    def ids(self) -> list:
+        with self._lock:
+            return list(self._rows)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def request_full(self) -> None:
+        """O próximo sync faz a recarga completa."""
+        self._full_at = 0.0
+
+    def changes_since(self, version):
+        """Ids alterados depois de `version`, ou None se o histórico já não cobre."""
+        if version == self.version:
+            return set()
+        with self._lock:
+            log = list(self._log)
+        if not log or log[0][0] > version + 1:
+            return None
+        out = set()
+        for v, ids in log:
+            if v > version:
+                out |= ids
+        return out
+
+    # ---------- sincronização ----------
+    def _pages(self, client, ini, fim, **extra):
+        by_id = {}
+        for pagina in range(1, self.page_limit + 1):
+            resp = client.list_sales(ini, fim, None, pagina=pagina, limite=self.page_size, **extra)
+            data = resp.get('data', []) or []
+            for r in data:
+                rid = r.get('id') or r.get('numero')
+                if rid is not None:
+                    by_id.setdefault(str(rid), r)
+            if len(data) < self.page_size:
+                break
+        else:
+            self.truncated = True
+            log.warning('listagem de pedidos %s a %s truncada em %d páginas (%d pedidos); aumente ORDERS_PAGE_LIMIT',
+                        ini, fim, self.page_limit, len(by_id))
+        return by_id
+
+    def sync(self, client, ini, fim, full=False) -> set:
+        """
+        Atualiza a cópia do período [ini, fim] (datas ISO). Devolve os ids
+        que mudaram. Falha do Bling propaga a exceção (nada é alterado).
+        """
+        ini, fim = str(ini), str(fim)
+        with self._sync_lock:
+            started = _now_sp()
+            full = (full or self.period != (ini, fim) or self._since is None
+                    or time.time() - self._full_at >= self.reconcile_secs)
+            if full:
+                self.truncated = False
+                fetched = self._pages(client, ini, fim)
+            else:
+                since = (self._since - self.overlap).strftime('%Y-%m-%d %H:%M:%S')
+                fetched = self._pages(client, ini, fim, dataAlteracaoInicial=since)
+            with self._lock:
+                touched, changed = self._apply(ini, fim, fetched, full)
+            self._since = started
+            if full:
+                self._full_at = time.time()
+        if changed and self.on_change:
+            self.on_change(changed)
+        return touched
+
+    # ---------- eventos avulsos (webhook) ----------
+    def upsert(self, row) -> bool:
+        """Aplica uma linha recebida por push. Ignora pedidos fora do período carregado."""
+        oid = row.get('id') or row.get('numero')
+        data = str(row.get('data') or '')[:10]
+        if oid is None or self.period is None or not (self.period[0] <= data <= self.period[1]):
+            return False
+        oid = str(oid)
+        with self._lock:
+            merged = dict(self._rows.get(oid) or {}, **row)
+            fp, old = order_fingerprint(merged), self._fps.get(oid)
+            if old == fp:
+                return False
+            self._rows[oid], self._fps[oid] = merged, fp
+            self.version += 1
+            self._log.append((self.version, {oid}))
+        if old is not None and self.on_change:
+            self.on_change({oid})
+        return True
+
+    def remove(self, oid) -> bool:
+        oid = str(oid)
+        with self._lock:
+            if self._rows.pop(oid, None) is None:
+                return False
+            self._fps.pop(oid, None)
+            self.version += 1
+            self._log.append((self.version, {oid}))
+        if self.on_change:
+            self.on_change({oid})
+        return True
+
+    def _apply(self, ini, fim, fetched, full):
+        same = self.period == (ini, fim)
+        # listagem truncada: o que ficou além da última página não sumiu do Bling
+        removed = set(self._rows) - set(fetched) if (full and same and not self.truncated) else set()
+        changed, novos = set(), set()
+        if not same:
+            # período novo (virada do mês): descarta o anterior
+            self._rows, self._fps = {}, {}
+            self.period = (ini, fim)
+        for oid, row in fetched.items():
+            fp = order_fingerprint(row)
+            old = self._fps.get(oid)
+            if old == fp:
+                continue
+            (novos if old is None else changed).add(oid)
+            self._rows[oid], self._fps[oid] = row, fp
+        for oid in removed:
+            self._rows.pop(oid, None)
+            self._fps.pop(oid, None)
+        touched = changed | novos | removed
+        if touched or not same:
+            self.version += 1
+            self._log.append((self.version, touched))
+        return touched, changed | removed
+
+
+# ---------------- índice para filtros locais ----------------
+def _int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class OrderIndex:
+    """
+    Índice SQLite (em memória) das linhas de um OrderStore, atualizado pela
+    versão da cópia (só os pedidos alterados desde a última consulta).
+    A listagem não traz vendedor: vendor_of(oid) completa a coluna quando
+    o vendedor for conhecido (índice local de vendedores).
+    """
+
+    def __init__(self, store, vendor_of=None):
+        self.store = store
+        self.vendor_of = vendor_of
+        self.period, self.version = None, -1
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(':memory:', check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE pedidos (id TEXT PRIMARY KEY, data TEXT, sid INTEGER, vid INTEGER, num INTEGER);
+            CREATE INDEX ix_data ON pedidos (data, num);
+            CREATE INDEX ix_sid ON pedidos (sid, data, num);
+            CREATE INDEX ix_vid ON pedidos (vid, data, num);
+        """)
+
+    def _entry(self, oid, row):
+        sit = row.get('situacao') if isinstance(row.get('situacao'), dict) else {}
+        vid = self.vendor_of(oid) if self.vendor_of else None
+        return (oid, str(row.get('data') or '')[:10], _int(sit.get('id')), vid,
+                _int(row.get('numero')) or _int(oid) or 0)
+
+    def refresh(self) -> None:
+        store = self.store
+        with self._lock:
+            version = store.version
+            if self.period == store.period and self.version == version:
+                return
+            ids = store.changes_since(self.version) if self.period == store.period else None
+            if ids is None:
+                self._db.execute('DELETE FROM pedidos')
+                ids = store.ids()
+            gone, rows = [], []
+            for oid in ids:
+                row = store.get(oid)
+                if row is None:
+                    gone.append((oid,))
+                else:
+                    rows.append(self._entry(oid, row))
+            with self._db:
+                self._db.executemany('DELETE FROM pedidos WHERE id = ?', gone)
+                self._db.executemany('INSERT OR REPLACE INTO pedidos VALUES (?, ?, ?, ?, ?)', rows)
+            self.period, self.version = store.period, version
+
+    def _fill_vendors(self):
+        if not self.vendor_of:
+            return
+        pend = [r[0] for r in self._db.execute('SELECT id FROM pedidos WHERE vid IS NULL')]
+        found = [(vid, oid) for oid in pend for vid in (self.vendor_of(oid),) if vid is not None]
+        if found:
+            with self._db:
+                self._db.executemany('UPDATE pedidos SET vid = ? WHERE id = ?', found)
+
+    def query(self, ini, fim, situacao=None, vendedor=None, limit=50) -> list:
+        """
+        Cópias (rasas) das linhas do período [ini, fim], mais recentes primeiro,
+        filtradas por situação (id ou lista de ids) e vendedor (0 = sem vendedor).
+        """
+        self.refresh()
+        sql, args = 'SELECT id FROM pedidos WHERE data BETWEEN ? AND ?', [str(ini), str(fim)]
+        if situacao is not None:
+            sids = [_int(x) for x in (situacao if isinstance(situacao, (list, tuple, set)) else [situacao])]
+            sql += ' AND sid IN (%s)' % ','.join('?' * len(sids)) if sids else ' AND 0'
+            args.extend(sids)
+        with self._lock:
+            if vendedor not in (None, ''):
+                self._fill_vendors()
+                sql += ' AND vid = ?'
+                args.append(_int(vendedor))
+            sql += ' ORDER BY data DESC, num DESC LIMIT ?'
+            args.append(int(limit))
+            ids = [r[0] for r in self._db.execute(sql, args)]
+        out = []
+        for oid in ids:
+            row = self.store.get(oid)
+            if row is not None:
+                out.append(dict(row))
+        return out
@@ -0,0 +1,144 @@
+"""
+Regras de pedido sem estado: mapas fixos (situação, vendedor, forma de
+pagamento), o mês corrente no fuso de São Paulo e a leitura dos campos
+das linhas e itens do Bling (datas, totais, quantidades).
+
+Não importa Flask nem configura contas: o app, o fake_bling e os scripts
+de linha de comando usam daqui sem carregar o .env nem abrir os caches.
+"""
+from __future__ import annotations
+from datetime import datetime, timedelta, date
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+# ================== MAPAS ==================
+STATUS_MAP = {
+    56035: 'AGUARDANDO SEPARAÇÃO',
+    6: 'EM ABERTO',
+    466202: 'ENVIO ESTOQUE FULL',
+    12: 'CANCELADO',
+    9: 'ATENDIDO',
+    67578: 'ENTREGUE',
+    446927: 'SEPARADO AGUARD. COLETA',
+    21: 'EM DIGITAÇÃO',
+    67577: 'ENVIADO'
+}
+VENDEDOR_MAP = {
+    15596309360: 'WENIO',
+    15596488325: 'JOICE',
+    4664550185: 'MERCADO LIVRE',
+    14402874266: 'RANGEL'
+}
+FORMAPAG_MAP = {
+    2515978: 'CONTA A RECEBER',
+    1917260: 'PAGAR.ME',
+    554129: 'CONTA A RECEBER'
+}
+# situações que não mudam mais (detalhe nunca é buscado de novo)
+FINAL_STATUS_IDS = {sid for sid, nome in STATUS_MAP.items()
+                    if nome in ('ATENDIDO', 'ENTREGUE', 'CANCELADO')}
+
+
+# --------------- DATAS -----------------
+def _today():
+    try:
+        return datetime.now(ZoneInfo('America/Sao_Paulo')).date()
+    except ZoneInfoNotFoundError:
+        return datetime.now().date()
+
+
+def default_dates():
+    today = _today()
+    return today - timedelta(days=2), today
+
+
+def month_bounds_today():
+    today = _today()
+    return date(today.year, today.month, 1), today
+
+
+# --------------- CAMPOS DO BLING -----------------
+def first(d, keys):
+    for k in keys:
+        if not k:
+            continue
+        if '.' in k:
+            cur = d
+            ok = True
+            for part in k.split('.'):
+                if isinstance(cur, dict) and part in cur:
+                    cur = cur.get(part)
+                else:
+                    ok = False
+                    break
+            if ok and cur not in (None, ''):
+                return cur
+        else:
+            v = d.get(k)
+            if v not in (None, ''):
+                return v
+    return None
+
+
+def br_dmy_short(s):
+    if not s:
+        return '-'
+    s = str(s)
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            d = datetime.strptime(s[:10], fmt)
+            return d.strftime('%d/%m/%y')
+        except Exception:
+            pass
+    return s
+
+
+def parse_date(s):
+    if not s:
+        return None
+    s = str(s)
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(s[:10], fmt).date()
+        except Exception:
+            continue
+    return None
+
+
+def parse_total(raw) -> float:
+    if raw is None:
+        return 0.0
+    if isinstance(raw, (int, float)):
+        return float(raw)
+    s = str(raw).strip().replace('R$', '').replace(' ', '')
+    if ',' in s:
+        s = s.replace('.', '').replace(',', '.')
+    try:
+        return float(s)
+    except Exception:
+        return 0.0
+
+
+def parse_qty(q):
+    try:
+        return float(q)
+    except Exception:
+        try:
+            return float(str(q).replace(',', '.'))
+        except Exception:
+            return 0.0
+
+
+def normalize_item(i):
+    prod = i.get('produto') or {}
+    nome = prod.get('nome') or i.get('descricao') or '-'
+    sku = prod.get('codigo') or i.get('codigo') or '-'
+    qtd = parse_qty(i.get('quantidade') or 0)
+    preco = i.get('valor') or 0
+    try:
+        preco = float(preco)
+    except Exception:
+        try:
+            preco = float(str(preco).replace(',', '.'))
+        except Exception:
+            preco = 0.0
+    return {'_nome': nome, '_sku': sku, '_qtd': qtd, '_preco': preco}
@@ -0,0 +1,159 @@
+"""
+Contabilidade da cota diária da API do Bling.
+
+Cada chamada feita pelo BlingAPI é contada por origem (rota/etapa que a
+originou, ver timing.current_origin) num contador diário persistido em
+cache/quota.json (dia no fuso de São Paulo). Com gunicorn, cada processo
+soma seu delta ao arquivo ao gravar.
+
+Níveis usados pelo app para se degradar antes de esgotar a cota:
+  ok        -> normal
+  low       -> TTLs maiores (probes de novidade, auto-refresh da página)
+  critical  -> também não busca detalhes novos (usa só o que está em cache)
+  exhausted -> BlingAPI recusa chamadas (sobra a reserva para login/token)
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+from config import settings
+
+QUOTA_FILE = os.path.join(settings.CACHE_DIR, 'quota.json')
+LEVELS = ('ok', 'low', 'critical', 'exhausted')
+
+
+class QuotaExceeded(RuntimeError):
+    pass
+
+
+def _today() -> str:
+    try:
+        return datetime.now(ZoneInfo('America/Sao_Paulo')).date().isoformat()
+    except Exception:
+        return datetime.now().date().isoformat()
+
+
+def _day_fraction() -> float:
+    try:
+        now = datetime.now(ZoneInfo('America/Sao_Paulo'))
+    except Exception:
+        now = datetime.now()
+    return (now.hour * 3600 + now.minute * 60 + now.second) / 86400.0
+
+
+class QuotaBudget:
+    def __init__(self, path=QUOTA_FILE, daily_limit=120000, low=0.25, critical=0.10,
+                 reserve=0.02, flush_every=50, flush_secs=10.0):
+        self.path = path
+        self.daily_limit = daily_limit
+        self.low, self.critical, self.reserve = low, critical, reserve
+        self.flush_every, self.flush_secs = flush_every, flush_secs
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self.day = _today()
+        self.total = 0
+        self.by_origin = {}
+        self._pending = {}      # delta ainda não gravado
+        self._last_flush = time.time()
+        self._read()
+
+    # ---------- persistência ----------
+    def _read_file(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except Exception:
+            return None
+        return raw if raw.get('day') == self.day else None
+
+    def _read(self):
+        raw = self._read_file()
+        if raw:
+            self.total = int(raw.get('total') or 0)
+            self.by_origin = dict(raw.get('by_origin') or {})
+
+    def flush(self) -> None:
+        # um flush por vez no processo: ler-somar-gravar sem perder o delta de outra thread
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._last_flush = time.time()
+                if not pending:
+                    return
+                raw = self._read_file() or {'day': self.day, 'total': 0, 'by_origin': {}}
+                by_origin = dict(raw.get('by_origin') or {})
+                for k, n in pending.items():
+                    by_origin[k] = by_origin.get(k, 0) + n
+                raw = {'day': self.day, 'total': int(raw.get('total') or 0) + sum(pending.values()),
+                       'by_origin': by_origin, 'limit': self.daily_limit}
+                # adota a soma de todos os processos (cópia: raw é gravado fora do lock)
+                self.total, self.by_origin = raw['total'], dict(by_origin)
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+            try:
+                with open(tmp, 'w', encoding='utf-8') as f:
+                    json.dump(raw, f, ensure_ascii=False, indent=1)
+                os.replace(tmp, self.path)
+            except Exception:
+                pass
+
+    # ---------- contagem ----------
+    def _roll(self):
+        today = _today()
+        if today != self.day:
+            self.day, self.total, self.by_origin, self._pending = today, 0, {}, {}
+
+    def account(self, origin='other', n=1) -> None:
+        with self._lock:
+            self._roll()
+            self.total += n
+            self.by_origin[origin] = self.by_origin.get(origin, 0) + n
+            self._pending[origin] = self._pending.get(origin, 0) + n
+            due = (sum(self._pending.values()) >= self.flush_every
+                   or time.time() - self._last_flush >= self.flush_secs)
+        if due:
+            self.flush()
+
+    def check(self, essential=False) -> None:
+        """Levanta QuotaExceeded quando só resta a reserva (exceto chamadas essenciais)."""
+        if not essential and self.level() == 'exhausted':
+            raise QuotaExceeded(f'Cota diária do Bling quase esgotada ({self.total}/{self.daily_limit}).')
+
+    # ---------- orçamento ----------
+    def remaining(self) -> int:
+        with self._lock:
+            self._roll()
+            return max(self.daily_limit - self.total, 0)
+
+    def projected(self) -> int:
+        """Consumo previsto para o dia inteiro no ritmo atual (após a 1ª hora)."""
+        frac = _day_fraction()
+        if frac < 1 / 24:
+            return self.total
+        return int(self.total / frac)
+
+    def level(self) -> str:
+        rem = self.remaining() / float(self.daily_limit or 1)
+        if rem <= self.reserve:
+            return 'exhausted'
+        if rem <= self.critical:
+            return 'critical'
+        if rem <= self.low or self.projected() > self.daily_limit:
+            return 'low'
+        return 'ok'
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            self._roll()
+            by_origin = dict(sorted(self.by_origin.items(), key=lambda kv: kv[1], reverse=True))
+            total = self.total
+        return {'day': self.day, 'limit': self.daily_limit, 'used': total,
+                'remaining': max(self.daily_limit - total, 0), 'projected': self.projected(),
+                'level': self.level(), 'by_origin': by_origin}
+
+
+QUOTA = QuotaBudget(daily_limit=int(os.getenv('BLING_DAILY_QUOTA', '120000')))
@@ -0,0 +1,152 @@
+"""
+Dados de referência do Bling: situações (módulo Vendas), vendedores e
+formas de pagamento.
+
+Carregados em lote uma vez, persistidos em cache/refdata.json com TTL
+longo e renovados em segundo plano. Os mapas fixos do app (STATUS_MAP,
+VENDEDOR_MAP, FORMAPAG_MAP) entram como sementes e têm precedência, para
+manter os apelidos usados nos painéis.
+"""
+from __future__ import annotations
+import json
+import os
+import threading
+import time
+
+from config import settings
+import timing
+
+REFDATA_FILE = os.path.join(settings.CACHE_DIR, 'refdata.json')
+KINDS = ('status', 'vendor', 'payment')
+
+
+def _int(v):
+    try:
+        return int(v)
+    except Exception:
+        return None
+
+
+class ReferenceData:
+    def __init__(self, path=REFDATA_FILE, ttl=7 * 24 * 3600, seeds=None):
+        self.path = path
+        self.ttl = ttl
+        self.seeds = {k: dict((seeds or {}).get(k) or {}) for k in KINDS}
+        self.loaded_at = 0
+        self._maps = {k: dict(self.seeds[k]) for k in KINDS}
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._next_try = 0   # após falha, espera antes de tentar de novo
+        self._load_file()
+
+    # ---------- persistência ----------
+    def _load_file(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                raw = json.load(f)
+        except Exception:
+            return
+        fetched = {k: {_int(i): n for i, n in (raw.get(k) or {}).items() if _int(i) is not None}
+                   for k in KINDS}
+        self._apply(fetched, raw.get('ts') or 0)
+
+    def _save(self, fetched):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp = f'{self.path}.{threading.get_ident()}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(dict({k: {str(i): n for i, n in fetched[k].items()} for k in KINDS},
+                               ts=self.loaded_at), f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except Exception:
+            pass
+
+    def _apply(self, fetched, ts):
+        maps = {}
+        for k in KINDS:
+            m = dict(fetched.get(k) or {})
+            m.update(self.seeds[k])
+            maps[k] = m
+        with self._lock:
+            self._maps = maps
+            self.loaded_at = ts
+
+    # ---------- carga do Bling ----------
+    def load_from(self, client) -> None:
+        """Busca as três listas no Bling (poucas chamadas) e persiste."""
+        with timing.stage('refdata'):
+            fetched = self._fetch(client)
+        self._apply(fetched, time.time())
+        self._save(fetched)
+
+    def _fetch(self, client) -> dict:
+        fetched = {k: {} for k in KINDS}
+
+        for mod in client.list_situation_modules():
+            if 'venda' not in str(mod.get('nome') or '').lower():
+                continue
+            for sit in client.list_situations(mod.get('id')):
+                sid = _int(sit.get('id'))
+                if sid is not None and sit.get('nome'):
+                    fetched['status'][sid] = str(sit['nome']).upper()
+
+        for v in client.list_vendors():
+            vid = _int(v.get('id'))
+            nome = (v.get('contato') or {}).get('nome') or v.get('nome')
+            if vid is not None and nome:
+                fetched['vendor'][vid] = str(nome).upper()
+
+        for fp in client.list_payment_methods():
+            fid = _int(fp.get('id'))
+            if fid is not None and fp.get('descricao'):
+                fetched['payment'][fid] = str(fp['descricao']).upper()
+        return fetched
+
+    def is_stale(self) -> bool:
+        return time.time() - self.loaded_at > self.ttl
+
+    def refresh_async(self, client) -> bool:
+        """Dispara a recarga em thread se vencido; `client` não pode depender do request."""
+        with self._lock:
+            if self._refreshing or not self.is_stale() or time.time() < self._next_try:
+                return False
+            self._refreshing = True
+
+        def run():
+            try:
+                self.load_from(client)
+            except Exception:
+                self._next_try = time.time() + 300
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name='refdata-refresh', daemon=True).start()
+        return True
+
+    # ---------- consultas O(1) ----------
+    def name(self, kind, rid, default=None):
+        key = _int(rid)
+        if key is None:
+            return default
+        return self._maps[kind].get(key, default)
+
+    def status_name(self, sid, default=None):
+        return self.name('status', sid, default)
+
+    def vendor_name(self, vid, default=None):
+        return self.name('vendor', vid, default)
+
+    def payment_name(self, fid, default=None):
+        return self.name('payment', fid, default)
+
+    def vendor_names(self) -> set:
+        return set(self._maps['vendor'].values())
+
+    def find(self, kind, text) -> list:
+        """Ids cujo nome contém `text` (sem diferenciar maiúsculas); um número é o próprio id."""
+        key = _int(text)
+        if key is not None:
+            return [key]
+        t = str(text or '').strip().casefold()
+        return [rid for rid, nome in self._maps[kind].items() if t and t in str(nome).casefold()]
@@ -4,6 +4,32 @@ document.addEventListener('click',e=>{
   const id=b.getAttribute('data-target');const el=document.querySelector(id);
   if(el){el.hidden=!el.hidden;}
 });
-// Auto refresh a cada 60s (apenas quando a aba está visível)
-const REFRESH_MS = 60000;
+// Auto refresh (60s por padrão; maior quando a cota do Bling está baixa) apenas com a aba visível
+const REFRESH_MS = parseInt(document.body.dataset.refreshMs || '60000', 10);
 let timer = setInterval(()=>{ if(!document.hidden){ location.reload(); } }, REFRESH_MS);
+// Painéis que não ficaram prontos no prazo do index: busca o fragmento e troca o placeholder
+function loadPendingPanel(el, tries){
+  fetch(el.dataset.panelUrl, {credentials: 'same-origin'}).then(r=>{
+    if(r.status === 202){ if(tries < 30){ setTimeout(()=>loadPendingPanel(el, tries + 1), 2000); } return null; }
+    return r.ok ? r.text() : null;
+  }).then(html=>{
+    if(!html) return;
+    const tpl = document.createElement('template'); tpl.innerHTML = html.trim();
+    const node = tpl.content.firstElementChild; if(!node) return;
+    el.replaceWith(node);
+    document.dispatchEvent(new CustomEvent('abling:panel', {detail: node}));
+  }).catch(()=>{ if(tries < 30){ setTimeout(()=>loadPendingPanel(el, tries + 1), 5000); } });
+}
+document.querySelectorAll('.panel-pending[data-panel-url]').forEach(el=>loadPendingPanel(el, 0));
+// "Mostrar mais" da tabela de produtos do mês: a próxima página troca a linha do botão
+document.addEventListener('click',e=>{
+  const b=e.target.closest('.js-prod-more');if(!b)return;
+  e.preventDefault();
+  if(b.disabled)return;b.disabled=true;
+  const row=b.closest('tr');
+  fetch(b.dataset.url,{credentials:'same-origin'}).then(r=>r.ok?r.text():null).then(html=>{
+    if(html===null){b.disabled=false;return;}
+    const tpl=document.createElement('template');tpl.innerHTML=html.trim();
+    row.replaceWith(tpl.content);
+  }).catch(()=>{b.disabled=false;});
+});
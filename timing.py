@@ -0,0 +1,138 @@
+"""
+Medição por requisição (hot path) sem profiler.
+
+Cada requisição do Flask ganha um RequestTimer (contextvar) que acumula:
+  - etapas do index (probes, fan-out de detalhes, painéis, planilha, render);
+  - chamadas ao Bling por endpoint (quantidade, total e máximo);
+  - acertos/faltas de cada cache.
+O resultado vai no cabeçalho Server-Timing e, opcionalmente, num rodapé.
+Os mesmos eventos alimentam as métricas do processo (metrics.py), inclusive
+fora de uma requisição (threads, CLI), onde o RequestTimer não existe.
+"""
+from __future__ import annotations
+import re
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import metrics
+
+_current: ContextVar['RequestTimer | None'] = ContextVar('abling_timer', default=None)
+_stage: ContextVar['str | None'] = ContextVar('abling_stage', default=None)
+
+_ID_RE = re.compile(r'/\d+(?=/|$)')
+
+
+def endpoint_name(path: str) -> str:
+    """/pedidos/vendas/123 -> /pedidos/vendas/{id}"""
+    return _ID_RE.sub('/{id}', path or '')
+
+
+class RequestTimer:
+    def __init__(self, route=None):
+        self.route = route
+        self.t0 = time.perf_counter()
+        self.stages = {}   # nome -> [n, total_s, max_s]
+        self.calls = {}    # endpoint -> [n, total_s, max_s, erros]
+        self.caches = {}   # nome -> [hits, misses]
+
+    @staticmethod
+    def _acc(slot, dt):
+        slot[0] += 1
+        slot[1] += dt
+        slot[2] = max(slot[2], dt)
+
+    def add_stage(self, name, dt):
+        self._acc(self.stages.setdefault(name, [0, 0.0, 0.0]), dt)
+
+    def add_call(self, endpoint, dt, status):
+        slot = self.calls.setdefault(endpoint, [0, 0.0, 0.0, 0])
+        self._acc(slot, dt)
+        if not status or status >= 400:
+            slot[3] += 1
+
+    def add_cache(self, name, hit):
+        self.caches.setdefault(name, [0, 0])[0 if hit else 1] += 1
+
+    def total(self) -> float:
+        return time.perf_counter() - self.t0
+
+    def server_timing(self) -> str:
+        parts = []
+        for name, (n, tot, mx) in self.stages.items():
+            parts.append(f'{_token(name)};dur={tot * 1000:.1f}' + (f';desc="n={n}"' if n > 1 else ''))
+        for ep, (n, tot, mx, err) in self.calls.items():
+            desc = f'{ep} n={n} max={mx * 1000:.0f}ms' + (f' err={err}' if err else '')
+            parts.append(f'bling-{_token(ep)};dur={tot * 1000:.1f};desc="{desc}"')
+        for name, (h, m) in self.caches.items():
+            parts.append(f'cache-{_token(name)};desc="hit={h} miss={m}"')
+        parts.append(f'total;dur={self.total() * 1000:.1f}')
+        return ', '.join(parts)
+
+    def rows(self):
+        """Linhas para o rodapé de depuração."""
+        out = []
+        for name, (n, tot, mx) in self.stages.items():
+            out.append(('etapa', name, n, tot * 1000, mx * 1000, ''))
+        for ep, (n, tot, mx, err) in self.calls.items():
+            out.append(('bling', ep, n, tot * 1000, mx * 1000, f'erros={err}' if err else ''))
+        for name, (h, m) in self.caches.items():
+            out.append(('cache', name, h + m, None, None, f'hit={h} miss={m}'))
+        return out
+
+
+def _token(name: str) -> str:
+    return re.sub(r'[^A-Za-z0-9_-]+', '-', name).strip('-') or 'x'
+
+
+# ---------- API usada pelo app / BlingAPI / caches ----------
+def start(route=None) -> RequestTimer:
+    t = RequestTimer(route)
+    _current.set(t)
+    return t
+
+
+def current() -> RequestTimer | None:
+    return _current.get()
+
+
+def stop() -> None:
+    _current.set(None)
+
+
+def current_origin() -> str:
+    """Rota/etapa em andamento (para contabilizar a cota do Bling por origem)."""
+    t = _current.get()
+    parts = [p for p in ((t.route if t else None), _stage.get()) if p]
+    return '/'.join(parts) or 'background'
+
+
+@contextmanager
+def stage(name):
+    t0 = time.perf_counter()
+    token = _stage.set(name)
+    try:
+        yield
+    finally:
+        _stage.reset(token)
+        dt = time.perf_counter() - t0
+        metrics.observe_stage(name, dt)
+        t = _current.get()
+        if t is not None:
+            t.add_stage(name, dt)
+
+
+def record_call(path, dt, status):
+    ep = endpoint_name(path)
+    metrics.BLING_REQUESTS.inc(ep, str(status or 0))
+    metrics.BLING_LATENCY.observe(dt, ep)
+    t = _current.get()
+    if t is not None:
+        t.add_call(ep, dt, status)
+
+
+def record_cache(name, hit):
+    metrics.CACHE_REQUESTS.inc(name, 'hit' if hit else 'miss')
+    t = _current.get()
+    if t is not None:
+        t.add_cache(name, hit)
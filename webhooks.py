@@ -0,0 +1,136 @@
+"""
+Webhooks de pedidos de venda do Bling (order.created / order.updated / order.deleted).
+
+- Autenticidade: cabeçalho X-Bling-Signature-256 = "sha256=" + HMAC-SHA256
+  do corpo cru com o client secret do aplicativo.
+- Cada evento vira uma linha da listagem aplicada na cópia local do mês
+  (OrderStore.upsert/remove); eventos repetidos (mesmo eventId) são ignorados.
+- Com webhooks chegando, o app espaça o polling (ver WebhookInbox.active);
+  o feed de alterações e a recarga completa continuam como reconciliação.
+
+Reenvio local de payloads gravados (BLING_WEBHOOK_RECORD=arquivo.jsonl):
+  python webhooks.py cache/webhooks.jsonl --url http://127.0.0.1:5050/webhooks/bling
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import hmac
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+SIGNATURE_HEADER = 'X-Bling-Signature-256'
+ORDER_EVENTS = ('order.created', 'order.updated', 'order.deleted')
+
+
+def sign(secret: str, body: bytes) -> str:
+    return 'sha256=' + hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+
+
+def verify(secret: str, body: bytes, header: str | None) -> bool:
+    if not secret or not header:
+        return False
+    return hmac.compare_digest(sign(secret, body), header.strip())
+
+
+def _alteracao(date_str) -> str:
+    """'2024-09-27T16:35:10-03:00' -> '2024-09-27 16:35:10' (formato do dataAlteracao)."""
+    s = str(date_str or '')
+    return s[:19].replace('T', ' ') if len(s) >= 19 else s
+
+
+def order_row(event: dict) -> dict:
+    """Linha no formato da listagem a partir do payload do evento."""
+    data = dict(event.get('data') or {})
+    row = {k: data[k] for k in ('id', 'numero', 'data', 'total', 'totalProdutos', 'contato',
+                                'situacao', 'vendedor', 'loja') if k in data}
+    if event.get('date'):
+        row['dataAlteracao'] = _alteracao(event['date'])
+    return row
+
+
+class WebhookInbox:
+    def __init__(self, store, record_path=None, seen_max=5000, active_secs=900):
+        self.store = store
+        self.record_path = record_path
+        self.seen_max, self.active_secs = seen_max, active_secs
+        self.last_at = 0.0
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+
+    def active(self) -> bool:
+        """Recebeu webhook recentemente (o polling pode ser espaçado)."""
+        return time.time() - self.last_at < self.active_secs
+
+    def _dup(self, event_id) -> bool:
+        if not event_id:
+            return False
+        with self._lock:
+            if event_id in self._seen:
+                return True
+            self._seen[event_id] = True
+            while len(self._seen) > self.seen_max:
+                self._seen.popitem(last=False)
+        return False
+
+    def _record(self, body: bytes):
+        if not self.record_path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.record_path) or '.', exist_ok=True)
+            with self._lock, open(self.record_path, 'ab') as f:
+                f.write(body.strip() + b'\n')
+        except Exception:
+            pass
+
+    def handle(self, body: bytes) -> str:
+        """Aplica um evento já verificado. Devolve o resultado (para métricas/resposta)."""
+        try:
+            event = json.loads(body)
+        except Exception:
+            return 'invalid'
+        self._record(body)
+        kind = event.get('event')
+        if kind not in ORDER_EVENTS:
+            return 'ignored'
+        if self._dup(event.get('eventId')):
+            return 'duplicate'
+        # só eventos de pedido mantêm o polling espaçado (estoque, produto... não atualizam a cópia)
+        self.last_at = time.time()
+        if kind == 'order.deleted':
+            oid = (event.get('data') or {}).get('id')
+            return 'applied' if oid is not None and self.store.remove(oid) else 'noop'
+        return 'applied' if self.store.upsert(order_row(event)) else 'noop'
+
+
+# ---------------- reenvio local ----------------
+def main(argv=None):
+    import requests
+    from config import settings
+
+    ap = argparse.ArgumentParser(description='Reenvia payloads de webhook gravados (JSONL) assinados.')
+    ap.add_argument('file', help='um payload JSON por linha')
+    ap.add_argument('--url', default='http://127.0.0.1:5050/webhooks/bling')
+    ap.add_argument('--secret', default=None, help='padrão: BLING_CLIENT_SECRET')
+    args = ap.parse_args(argv)
+    secret = args.secret or settings.BLING_CLIENT_SECRET
+
+    n = 0
+    with open(args.file, 'rb') as f:
+        for line in f:
+            body = line.strip()
+            if not body:
+                continue
+            r = requests.post(args.url, data=body, timeout=10,
+                              headers={'Content-Type': 'application/json', SIGNATURE_HEADER: sign(secret, body)})
+            n += 1
+            print(r.status_code, r.text.strip())
+    print(f'{n} eventos enviados')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())